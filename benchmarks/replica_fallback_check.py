@@ -0,0 +1,104 @@
+"""
+Проверка аналитических чтений при сбое реплики посреди запроса: запрос на реплике
+обрывается pg_terminate_backend из отдельного соединения, read_with_fallback
+и stream_with_fallback должны вернуть результат из основной БД, а следующие запросы
+в течение DB_REPLICA_RETRY_SECONDS — сразу идти в основную БД.
+Нужны два экземпляра PostgreSQL (реплика — под пользователем, которому разрешён
+pg_terminate_backend); для проверки самого переключения подойдёт и один сервер под двумя URL.
+
+    DATABASE_URL=... DATABASE_REPLICA_URL=... python -m benchmarks.replica_fallback_check
+"""
+import sys
+import time
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from sqlalchemy import text
+
+import src.data.db as db
+
+SLEEP_SECONDS = 3
+# Метка в тексте запроса, по которой он находится в pg_stat_activity реплики
+TAG = "/* replica_fallback_check */"
+
+
+def served_by(session) -> str:
+    return "реплика" if session.bind is db.replica_engine else "основная"
+
+
+async def terminate(where: str, **params) -> int:
+    async with db.replica_engine.connect() as conn:
+        result = await conn.execute(text(f"SELECT count(pg_terminate_backend(pid)) FROM pg_stat_activity WHERE {where}"), params)
+        return result.scalar_one()
+
+
+async def check_read() -> bool:
+    pid: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def query(session) -> str:
+        if session.bind is db.replica_engine and not pid.done():
+            pid.set_result((await session.execute(text("SELECT pg_backend_pid()"))).scalar_one())
+        await session.execute(text(f"SELECT pg_sleep({SLEEP_SECONDS})"))
+        return served_by(session)
+
+    async def kill() -> int:
+        backend = await pid
+        await asyncio.sleep(0.5)
+        return await terminate("pid = :pid", pid=backend)
+
+    started = time.perf_counter()
+    killer = asyncio.create_task(kill())
+    served = await db.read_with_fallback(query)
+    killed = await killer
+    print(f"read_with_fallback: оборвано соединений {killed}, ответила {served} БД за {time.perf_counter() - started:.1f} с")
+    return killed == 1 and served == "основная"
+
+
+async def check_down_window() -> bool:
+    async def query(session) -> str:
+        await session.execute(text("SELECT 1"))
+        return served_by(session)
+
+    served = await db.read_with_fallback(query)
+    print(f"повторный запрос в окне DB_REPLICA_RETRY_SECONDS: ответила {served} БД")
+    return served == "основная"
+
+
+async def check_stream() -> bool:
+    stmt = text(f"{TAG} SELECT n FROM generate_series(1, 10) n, pg_sleep({SLEEP_SECONDS})")
+
+    async def kill() -> int:
+        await asyncio.sleep(1)
+        return await terminate("query LIKE :tag AND pid <> pg_backend_pid()", tag=f"{TAG}%")
+
+    killer = asyncio.create_task(kill())
+    rows = []
+    async for partition in db.stream_with_fallback(stmt, 4):
+        rows.extend(partition)
+    killed = await killer
+    print(f"stream_with_fallback: оборвано соединений {killed}, получено строк {len(rows)}")
+    return killed >= 1 and len(rows) == 10
+
+
+async def main() -> int:
+    if db.replica_engine is None:
+        print("DATABASE_REPLICA_URL не задан")
+        return 2
+    try:
+        ok = await check_read()
+        ok = await check_down_window() and ok
+        # Следующая проверка снова начинается с реплики
+        db._replica_down_until = 0.0
+        ok = await check_stream() and ok
+    finally:
+        await db.engine.dispose()
+        await db.replica_engine.dispose()
+    print("OK" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,141 @@
+"""
+Потоковая выгрузка полной статистики в xlsx, csv.gz и parquet: время, размер файлов
+и пиковая память процесса на двух объёмах (rows / 10 и rows оценок, NPS — на каждую вторую).
+Если память не зависит от числа строк, пик после большой выгрузки почти не растёт.
+С --legacy после этого выгружается прежним способом (все строки в списки и pandas в xlsx).
+Таблицы создаются во временной схеме, запросы — те же, что у бота.
+
+    python -m benchmarks.statistics_export_bench [число оценок] [--legacy]
+"""
+import os
+import sys
+import time
+import asyncio
+import resource
+import tempfile
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from sqlalchemy import text
+
+from src.data.db import engine
+from src.data.repositories.assessmentOfQuality_repository import aoq_crud
+from src.data.repositories.netPromoterScore_repository import nps_crud
+from src.utils.statistics_export import AOQ_COLUMNS, NPS_COLUMNS, EXPORT_BATCH_SIZE, EXPORT_FORMATS, export_statistics
+
+SCHEMA = "statistics_export_bench"
+USERS = 10_000
+SPECIALISTS = 2_000
+
+
+async def create_tables(conn, rows: int) -> None:
+    for statement in (
+        f"CREATE TABLE {SCHEMA}.social_subcategories (id uuid PRIMARY KEY, name varchar(255))",
+        f"CREATE TABLE {SCHEMA}.users (id uuid PRIMARY KEY, username varchar(255), full_name varchar(255), "
+        "social_subcategory_id uuid)",
+        f"CREATE TABLE {SCHEMA}.specialists (id uuid PRIMARY KEY, fullname varchar(255))",
+        f"CREATE TABLE {SCHEMA}.services (id uuid PRIMARY KEY, name varchar(255))",
+        f"CREATE TABLE {SCHEMA}.assessments_of_quality (id uuid PRIMARY KEY, user_id uuid, specialist_id uuid, "
+        "service_id uuid, score int, comment text, created_at timestamp)",
+        f"CREATE TABLE {SCHEMA}.net_promoter_scores (id uuid PRIMARY KEY, user_id uuid, aoq_id uuid, "
+        "score int, created_at timestamp)",
+        f"INSERT INTO {SCHEMA}.social_subcategories SELECT md5('c' || i)::uuid, 'Подкатегория ' || i "
+        "FROM generate_series(1, 20) i",
+        f"INSERT INTO {SCHEMA}.users SELECT md5('u' || i)::uuid, 'user' || i, 'Пользователь ' || i, "
+        f"md5('c' || (i % 20 + 1))::uuid FROM generate_series(1, {USERS}) i",
+        f"INSERT INTO {SCHEMA}.specialists SELECT md5('s' || i)::uuid, 'Специалист ' || i "
+        f"FROM generate_series(1, {SPECIALISTS}) i",
+        f"INSERT INTO {SCHEMA}.services SELECT md5('v' || i)::uuid, 'Услуга ' || i FROM generate_series(1, 30) i",
+        f"INSERT INTO {SCHEMA}.assessments_of_quality SELECT md5('a' || i)::uuid, md5('u' || (i % {USERS} + 1))::uuid, "
+        f"md5('s' || (i % {SPECIALISTS} + 1))::uuid, md5('v' || (i % 30 + 1))::uuid, i % 5 + 1, "
+        "CASE WHEN i % 3 = 0 THEN 'Комментарий к оценке ' || i END, now() - (i % 365) * interval '1 day' "
+        f"FROM generate_series(1, {rows}) i",
+        f"INSERT INTO {SCHEMA}.net_promoter_scores SELECT md5('n' || i)::uuid, md5('u' || (i % {USERS} + 1))::uuid, "
+        f"md5('a' || i)::uuid, i % 5 + 1, now() - (i % 365) * interval '1 day' FROM generate_series(1, {rows}, 2) i",
+        f"CREATE INDEX ON {SCHEMA}.assessments_of_quality (created_at, id)",
+        f"CREATE INDEX ON {SCHEMA}.net_promoter_scores (created_at, id)",
+        f"ANALYZE {SCHEMA}.assessments_of_quality",
+        f"ANALYZE {SCHEMA}.net_promoter_scores",
+    ):
+        await conn.execute(text(statement))
+
+
+async def stream(stmt):
+    """
+    Как CRUDRepository.stream_rows, но по таблицам временной схемы.
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(schema_translate_map={None: SCHEMA})
+        result = await conn.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.partitions():
+            yield partition
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def export_streaming(export_format: str):
+    async def export(directory: str) -> List[str]:
+        paths, _ = await export_statistics(directory, "bench", export_format, [
+            ("AOQ", AOQ_COLUMNS, stream(aoq_crud.export_statement())),
+            ("NPS", NPS_COLUMNS, stream(nps_crud.export_statement())),
+        ])
+        return paths
+    return export
+
+
+async def export_legacy(directory: str) -> List[str]:
+    import pandas as pd
+
+    path = os.path.join(directory, "bench.xlsx")
+    aoq_headers = [header for header, _ in AOQ_COLUMNS]
+    nps_headers = [header for header, _ in NPS_COLUMNS]
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(schema_translate_map={None: SCHEMA})
+        aoq = [dict(zip(aoq_headers, row)) for row in (await conn.execute(aoq_crud.export_statement())).all()]
+        nps = [dict(zip(nps_headers, row)) for row in (await conn.execute(nps_crud.export_statement())).all()]
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        pd.DataFrame(aoq).to_excel(writer, sheet_name="AOQ", index=False)
+        pd.DataFrame(nps).to_excel(writer, sheet_name="NPS", index=False)
+    return [path]
+
+
+async def seed(rows: int) -> None:
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await create_tables(conn, rows)
+
+
+async def measure(label: str, export, rows: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        paths = await export(directory)
+        elapsed = time.perf_counter() - started
+        size = sum(os.path.getsize(path) for path in paths)
+    print(f"{label:>8} {rows:>9} оценок: {elapsed:6.1f} с, "
+          f"файлы {size / 1024 / 1024:6.1f} МБ, пик памяти процесса {peak_rss_mb():6.0f} МБ")
+
+
+async def main(rows: int, legacy: bool) -> None:
+    try:
+        print(f"Пик памяти до выгрузок {peak_rss_mb():.0f} МБ, пачка {EXPORT_BATCH_SIZE} строк")
+        for size in (rows // 10, rows):
+            await seed(size)
+            for export_format in EXPORT_FORMATS:
+                await measure(export_format, export_streaming(export_format), size)
+        if legacy:
+            await measure("pandas", export_legacy, rows)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    asyncio.run(main(int(args[0]) if args else 1_000_000, "--legacy" in sys.argv))
@@ -0,0 +1,38 @@
+"""
+Микробенчмарк ThrottlingMiddleware: стоимость одной проверки token bucket
+при 100k активных пользователей.
+
+    python -m benchmarks.throttling_bench
+"""
+import os
+import random
+import time
+
+from src.middlewares.throttling_middleware import LocalBucketStore, SharedMemoryBucketStore
+
+USERS = 100_000
+CHECKS = 1_000_000
+
+
+def bench(store, label: str) -> None:
+    user_ids = [random.randrange(10**8, 10**10) for _ in range(USERS)]
+    now = time.monotonic()
+    for tg_id in user_ids:
+        store.consume(tg_id, 1, 2, now)
+
+    sample = [random.choice(user_ids) for _ in range(CHECKS)]
+    clock = time.monotonic
+    started = time.perf_counter()
+    for tg_id in sample:
+        store.consume(tg_id, 1, 2, clock())
+    elapsed = time.perf_counter() - started
+    print(f"{label:>14}: {elapsed / CHECKS * 1e9:7.0f} ns/check ({USERS} users, {CHECKS} checks)")
+
+
+if __name__ == "__main__":
+    bench(LocalBucketStore(capacity=USERS), "local")
+    shm_store = SharedMemoryBucketStore(f"throttling_bench_{os.getpid()}", capacity=USERS)
+    try:
+        bench(shm_store, "shared memory")
+    finally:
+        shm_store.close(unlink=True)
@@ -0,0 +1,103 @@
+"""
+Сравнение ключей VARCHAR(36) и uuid на таблицах вида AOQ/NPS:
+размер индексов PK/FK и время соединения AOQ ⋈ NPS ⋈ специалисты.
+Таблицы создаются во временной схеме и удаляются после замера.
+
+    python -m benchmarks.uuid_keys_bench [число оценок]
+"""
+import sys
+import time
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+from sqlalchemy import text
+
+from src.data.db import engine
+
+SCHEMA = "uuid_keys_bench"
+SPECIALISTS = 2_000
+RUNS = 9
+
+JOIN_QUERY = """
+SELECT count(*), avg(a.score), avg(n.score)
+FROM {schema}.aoq_{kind} a
+JOIN {schema}.nps_{kind} n ON n.aoq_id = a.id
+JOIN {schema}.specialists_{kind} s ON s.id = a.specialist_id
+"""
+
+
+async def create_tables(conn, kind: str, key_type: str, rows: int) -> None:
+    cast = "::uuid" if key_type == "uuid" else "::text"
+    for statement in (
+        f"CREATE TABLE {SCHEMA}.specialists_{kind} (id {key_type} PRIMARY KEY, fullname varchar(255))",
+        f"CREATE TABLE {SCHEMA}.aoq_{kind} (id {key_type} PRIMARY KEY, "
+        f"specialist_id {key_type} REFERENCES {SCHEMA}.specialists_{kind}(id), score int, created_at timestamp)",
+        f"CREATE TABLE {SCHEMA}.nps_{kind} (id {key_type} PRIMARY KEY, "
+        f"aoq_id {key_type} UNIQUE REFERENCES {SCHEMA}.aoq_{kind}(id), score int)",
+        f"INSERT INTO {SCHEMA}.specialists_{kind} "
+        f"SELECT md5('s' || i)::uuid{cast}, 'Специалист ' || i FROM generate_series(1, {SPECIALISTS}) i",
+        f"INSERT INTO {SCHEMA}.aoq_{kind} "
+        f"SELECT md5('a' || i)::uuid{cast}, md5('s' || (i % {SPECIALISTS} + 1))::uuid{cast}, "
+        f"i % 5 + 1, now() - (i % 365) * interval '1 day' FROM generate_series(1, {rows}) i",
+        f"INSERT INTO {SCHEMA}.nps_{kind} "
+        f"SELECT md5('n' || i)::uuid{cast}, md5('a' || i)::uuid{cast}, i % 11 "
+        f"FROM generate_series(1, {rows}, 2) i",
+        f"CREATE INDEX ON {SCHEMA}.aoq_{kind} (specialist_id, created_at)",
+        f"ANALYZE {SCHEMA}.specialists_{kind}",
+        f"ANALYZE {SCHEMA}.aoq_{kind}",
+        f"ANALYZE {SCHEMA}.nps_{kind}",
+    ):
+        await conn.execute(text(statement))
+
+
+async def index_size(conn, kind: str) -> int:
+    result = await conn.execute(text(
+        "SELECT coalesce(sum(pg_relation_size(indexrelid)), 0) FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = :schema AND c.relname LIKE :pattern"
+    ), {"schema": SCHEMA, "pattern": f"%\\_{kind}"})
+    return result.scalar_one()
+
+
+async def join_ms(conn, kinds) -> dict:
+    """
+    Медиана времени соединения; замеры по типам ключей чередуются,
+    чтобы прогрев кэша не давал преимущества одному из них.
+    """
+    queries = {kind: text(JOIN_QUERY.format(schema=SCHEMA, kind=kind)) for kind in kinds}
+    timings = {kind: [] for kind in kinds}
+    for kind in kinds:
+        await conn.execute(queries[kind])
+    for _ in range(RUNS):
+        for kind in kinds:
+            started = time.perf_counter()
+            await conn.execute(queries[kind])
+            timings[kind].append((time.perf_counter() - started) * 1000)
+    return {kind: sorted(values)[len(values) // 2] for kind, values in timings.items()}
+
+
+async def main(rows: int) -> None:
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+            await create_tables(conn, "text", "varchar(36)", rows)
+            await create_tables(conn, "uuid", "uuid", rows)
+
+        async with engine.connect() as conn:
+            print(f"{rows} оценок, {rows // 2} NPS, {SPECIALISTS} специалистов")
+            elapsed = await join_ms(conn, ("text", "uuid"))
+            for kind in ("text", "uuid"):
+                size = await index_size(conn, kind)
+                print(f"{kind:>5}: индексы {size / 1024 / 1024:7.1f} МБ, соединение AOQ⋈NPS⋈специалисты {elapsed[kind]:7.1f} мс")
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000))
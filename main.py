@@ -9,11 +9,16 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from src.data.models import tz
 
 from src.data.db import init_db
+from src.data.reference_data import reference_data
+from src.data.specialist_directory import specialist_directory
 from src.middlewares import register_all_middlwares
+from src.middlewares.instrumentation_middleware import ApiCallCounterMiddleware
+from src.middlewares.unit_of_work_middleware import UnitOfWorkCommitMiddleware
 from src.routers import register_all_routers
-from src.utils.misc_functions import backup_db, send_full_statistics_excel
+from src.utils.misc_functions import backup_db, send_full_statistics
 from src.utils.misc.bot_commands import set_commands
 from src.utils.misc.bot_logging import bot_logger
+from src.utils.misc.metrics import metrics
 
 load_dotenv(override=True)
 
@@ -24,7 +29,13 @@ async def scheduler_start(bot: Bot):
     # BOT_SCHEDULER.add_job(update_profit_week, trigger="cron", day_of_week="mon", hour=00, minute=00, second=10)
     # BOT_SCHEDULER.add_job(update_profit_day, trigger="cron", hour=00, minute=00, second=15, args=(bot,))
     BOT_SCHEDULER.add_job(backup_db, trigger="cron", hour=00, args=(bot,))
-    BOT_SCHEDULER.add_job(send_full_statistics_excel, day_of_week="mon", trigger="cron", hour=12, minute=00, args=(bot,))
+    BOT_SCHEDULER.add_job(send_full_statistics, day_of_week="mon", trigger="cron", hour=12, minute=00,
+                          args=(bot, None, os.getenv("STATISTICS_EXPORT_FORMAT", "xlsx"),
+                                os.getenv("STATISTICS_EXPORT_MODE", "delta") == "delta"))
+    BOT_SCHEDULER.add_job(metrics.dump_to_log, trigger="interval", minutes=int(os.getenv("METRICS_DUMP_MINUTES", "15")))
+    refresh_seconds = int(os.getenv("REFERENCE_REFRESH_SECONDS", "60"))
+    BOT_SCHEDULER.add_job(reference_data.refresh, trigger="interval", seconds=refresh_seconds)
+    BOT_SCHEDULER.add_job(specialist_directory.refresh, trigger="interval", seconds=refresh_seconds)
     # BOT_SCHEDULER.add_job(check_update, trigger="cron", hour=00, args=(bot, arSession,))
     # BOT_SCHEDULER.add_job(check_mail, trigger="cron", hour=12, args=(bot, arSession,))
 
@@ -32,9 +43,14 @@ async def scheduler_start(bot: Bot):
 async def main():
     BOT_SCHEDULER.start()
     await init_db()
+    await reference_data.load()
+    await specialist_directory.load()
     
     dp = Dispatcher()
     bot = Bot(token=os.getenv('TOKEN'))
+    if os.getenv("DB_UNIT_OF_WORK", "0") == "1":
+        bot.session.middleware(UnitOfWorkCommitMiddleware())
+    bot.session.middleware(ApiCallCounterMiddleware())
     register_all_middlwares(dp)
     register_all_routers(dp)
     
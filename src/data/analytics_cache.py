@@ -0,0 +1,61 @@
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from cachetools import TTLCache
+
+from src.data.repositories.assessmentOfQuality_repository import aoq_crud
+from src.data.repositories.netPromoterScore_repository import nps_crud
+from src.data.repositories.ratingRollup_repository import rating_rollup_crud
+from src.data.repositories.service_repository import service_crud
+from src.data.repositories.specialist_repository import specialist_crud
+
+
+class AnalyticsCache:
+    """
+    Готовые сообщения аналитики по набору окон (ключ включает даты начала окон).
+    Новая оценка, NPS, очистка статистики или изменение специалистов и услуг
+    (их названия есть в тексте) сбрасывают кэш; кроме того, записи живут ANALYTICS_CACHE_TTL.
+    Одновременные запросы одного ключа ждут одно вычисление.
+    """
+    def __init__(self):
+        self.messages: TTLCache = TTLCache(maxsize=16, ttl=float(os.getenv("ANALYTICS_CACHE_TTL", "60")))
+        # Номер сброса: результат вычисления, начатого до сброса, не кэшируется
+        self._version = 0
+        self._inflight: Dict[Tuple[Hashable, int], asyncio.Task] = {}
+
+        for crud in (aoq_crud, nps_crud, rating_rollup_crud, specialist_crud, service_crud):
+            crud.add_write_listener(self.invalidate)
+
+    def invalidate(self, ids: Optional[Sequence[Any]] = None) -> None:
+        self._version += 1
+        self.messages.clear()
+
+    async def get(self, key: Hashable, render: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        """
+        Сообщения из кэша или результат render(), посчитанный один раз на все ожидающие запросы.
+        """
+        messages = self.messages.get(key)
+        if messages is not None:
+            return messages
+
+        inflight_key = (key, self._version)
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.create_task(self._render(inflight_key, render))
+            self._inflight[inflight_key] = task
+        # Отмена одного ожидающего апдейта не прерывает вычисление для остальных
+        return await asyncio.shield(task)
+
+    async def _render(self, inflight_key: Tuple[Hashable, int], render: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        key, version = inflight_key
+        try:
+            messages = await render()
+        finally:
+            self._inflight.pop(inflight_key, None)
+        if version == self._version:
+            self.messages[key] = messages
+        return messages
+
+
+analytics_cache = AnalyticsCache()
@@ -1,16 +1,412 @@
 import os
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+import time
+import asyncio
+import functools
+import inspect as pyinspect
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from sqlalchemy import exc, inspect, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from src.data.models import BaseEntity
+from src.utils.misc.metrics import instrument_engine, metrics, query_origin
+from src.utils.misc.bot_logging import bot_logger
 
 
 db_url = os.getenv("DATABASE_URL")
 if not db_url:
     raise ValueError("DATABASE_URL is not set!")
 
-engine = create_async_engine(url=db_url)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул, который замеряет ожидание свободного соединения и выход за pool_size.
+    """
+    def _do_get(self):
+        started = time.perf_counter()
+        overflow = self._overflow
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            metrics.pool.observe_wait(
+                (time.perf_counter() - started) * 1000,
+                overflow=self._overflow > max(overflow, 0),
+                timed_out=timed_out,
+            )
+
+
+def engine_options(url: str, instrumented_pool: bool = True) -> Dict[str, Any]:
+    """
+    Параметры пула и драйвера из переменных окружения.
+    """
+    options: Dict[str, Any] = {
+        "poolclass": InstrumentedQueuePool if instrumented_pool else AsyncAdaptedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+
+    if url.startswith("postgresql+asyncpg"):
+        connect_args: Dict[str, Any] = {
+            # Кэш подготовленных выражений на соединение (0 — для pgbouncer в режиме transaction)
+            "prepared_statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500")),
+            "command_timeout": float(os.getenv("DB_COMMAND_TIMEOUT", "60")),
+            "timeout": float(os.getenv("DB_CONNECT_TIMEOUT", "10")),
+        }
+        jit = os.getenv("DB_JIT")
+        if jit:
+            connect_args["server_settings"] = {"jit": jit}
+        options["connect_args"] = connect_args
+    return options
+
+
+engine = create_async_engine(url=db_url, **engine_options(db_url))
+instrument_engine(engine)
 async_session = async_sessionmaker(engine)
 
+# Необязательная реплика для аналитики и выгрузок
+replica_url = os.getenv("DATABASE_REPLICA_URL")
+replica_engine = (
+    create_async_engine(url=replica_url, **engine_options(replica_url, instrumented_pool=False))
+    if replica_url else None
+)
+if replica_engine is not None:
+    instrument_engine(replica_engine, track_pool=False)
+replica_session = async_sessionmaker(replica_engine) if replica_engine is not None else None
+# Сколько секунд не обращаться к реплике после ошибки подключения
+REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+_replica_down_until = 0.0
+# SQLSTATE ошибок реплики, после которых чтение повторяется в основной БД: обрыв соединения (08xxx),
+# отмена из-за конфликта с восстановлением (40001), остановка сервера (57P01–57P03)
+REPLICA_RETRY_SQLSTATES = frozenset({"40001", "57P01", "57P02", "57P03"})
+
+T = TypeVar("T")
+
+
+async def warm_pool(size: int) -> None:
+    """
+    Открывает size соединений заранее, чтобы первые апдейты не ждали подключения.
+    """
+    if size <= 0:
+        return
+    connections = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    try:
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in connections))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in connections))
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Состояние пула: занятые соединения, время ожидания, переполнение.
+    """
+    stats = metrics.pool.snapshot()
+    stats.update(pool_size=engine.pool.size(), overflow=engine.pool.overflow())
+    return stats
+
+
 async def init_db():
+    from src.data.migrations import run_migrations
+
     async with engine.begin() as conn:
+        # В новой БД схема создаётся по моделям целиком, миграции только отмечаются
+        fresh = not await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table("users"))
         await conn.run_sync(BaseEntity.metadata.create_all)
+    if os.getenv("DB_MIGRATE_ON_START", "1") == "1":
+        await run_migrations(engine, stamp_only=fresh)
+    if isinstance(engine.pool, AsyncAdaptedQueuePool):
+        await warm_pool(min(engine.pool.size(), int(os.getenv("DB_POOL_WARM", str(engine.pool.size())))))
+
+
+class UnitOfWork:
+    """
+    Сессия, общая для всех репозиториев в рамках одного апдейта.
+    Открывается при первом обращении и фиксируется одним коммитом в конце.
+    Фоновые задачи, запущенные из хэндлера, её не используют.
+    savepoints=False — записи репозиториев без SAVEPOINT (см. transaction).
+    """
+    def __init__(self, savepoints: bool = True):
+        self.session: Optional[AsyncSession] = None
+        self.owner = asyncio.current_task()
+        self.closed = False
+        self.savepoints = savepoints
+        self._after_commit: List[Callable[[], None]] = []
+        self._on_rollback: List[Callable[[], None]] = []
+
+    def usable(self) -> bool:
+        return not self.closed and asyncio.current_task() is self.owner
+
+    def get_session(self) -> AsyncSession:
+        if self.session is None:
+            self.session = async_session(expire_on_commit=False)
+        return self.session
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        self._after_commit.append(callback)
+
+    def on_rollback(self, callback: Callable[[], None]) -> None:
+        self._on_rollback.append(callback)
+
+    async def commit(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.session is None:
+            return
+        try:
+            await self.session.commit()
+        except Exception:
+            for callback in self._on_rollback:
+                callback()
+            raise
+        finally:
+            await self.session.close()
+        for callback in self._after_commit:
+            callback()
+
+    async def rollback(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.session is None:
+            return
+        try:
+            await self.session.rollback()
+        finally:
+            await self.session.close()
+            for callback in self._on_rollback:
+                callback()
+
+
+current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("current_uow", default=None)
+
+
+def active_uow() -> Optional[UnitOfWork]:
+    uow = current_uow.get()
+    return uow if uow is not None and uow.usable() else None
+
+
+async def commit_unit_of_work() -> None:
+    """
+    Досрочно фиксирует unit of work апдейта: вызывается перед первым запросом к Bot API
+    и перед хэндлерами с флагом unit_of_work=False. Дальнейшие запросы идут в собственных сессиях.
+    """
+    uow = active_uow()
+    if uow is not None:
+        await uow.commit()
+
+
+def _replica_failed(e: BaseException) -> bool:
+    """
+    Ошибка реплики (а не самого запроса), после которой чтение можно повторить в основной БД.
+    """
+    if isinstance(e, (OSError, asyncio.TimeoutError, exc.TimeoutError)):
+        return True
+    if isinstance(e, exc.DBAPIError):
+        sqlstate = getattr(e.orig, "sqlstate", None) or ""
+        return e.connection_invalidated or sqlstate.startswith("08") or sqlstate in REPLICA_RETRY_SQLSTATES
+    return False
+
+
+def _mark_replica_down(e: BaseException) -> None:
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+    bot_logger.warning(f"Реплика БД недоступна, запросы идут в основную БД: {e}")
+
+
+async def _open_replica_session() -> Optional[AsyncSession]:
+    """
+    Сессия на реплике с уже полученным соединением или None,
+    если реплика не настроена или недоступна.
+    """
+    if replica_session is None or time.monotonic() < _replica_down_until:
+        return None
+
+    session = replica_session(expire_on_commit=False)
+    try:
+        await session.connection()
+    except (OSError, asyncio.TimeoutError, exc.DBAPIError, exc.TimeoutError) as e:
+        await session.close()
+        _mark_replica_down(e)
+        return None
+    return session
+
+
+async def read_with_fallback(query: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """
+    Аналитическое чтение: query(session) выполняется на реплике (DATABASE_REPLICA_URL),
+    а если реплика не настроена, недоступна или оборвала запрос — в основной БД.
+    query только читает: при сбое реплики он выполняется повторно.
+    """
+    session = await _open_replica_session()
+    if session is not None:
+        try:
+            async with session:
+                return await query(session)
+        except Exception as e:
+            if not _replica_failed(e):
+                raise
+            _mark_replica_down(e)
+
+    async with session_scope() as session:
+        return await query(session)
+
+
+async def stream_with_fallback(stmt, batch_size: int) -> AsyncIterator[List[Any]]:
+    """
+    Пачки строк stmt через серверный курсор в собственной сессии (не в unit of work):
+    с реплики, а если она недоступна или оборвала запрос до первой пачки — из основной БД.
+    После первой пачки сбой реплики поднимается: часть строк уже отдана.
+    """
+    session = await _open_replica_session()
+    if session is not None:
+        started = False
+        try:
+            async with session:
+                result = await session.stream(stmt.execution_options(yield_per=batch_size))
+                async for partition in result.partitions():
+                    started = True
+                    yield partition
+            return
+        except Exception as e:
+            if not _replica_failed(e):
+                raise
+            _mark_replica_down(e)
+            if started:
+                raise
+
+    async with session_scope(standalone=True) as session:
+        result = await session.stream(stmt.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            yield partition
+
+
+def _with_origin(func):
+    """
+    Обёртка async-метода (или async-генератора) репозитория: запросы внутри него
+    учитываются в метриках от имени "SpecialistRepository.get" (класс — фактический тип объекта).
+    """
+    if pyinspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def generator(self, *args, **kwargs):
+            origin = f"{type(self).__name__}.{func.__name__}"
+            rows = func(self, *args, **kwargs)
+            try:
+                while True:
+                    # Переменная выставляется на каждый шаг: между шагами генератор не владеет контекстом
+                    token = query_origin.set(origin)
+                    try:
+                        item = await rows.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        query_origin.reset(token)
+                    yield item
+            finally:
+                await rows.aclose()
+        return generator
+
+    @functools.wraps(func)
+    async def method(self, *args, **kwargs):
+        token = query_origin.set(f"{type(self).__name__}.{func.__name__}")
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            query_origin.reset(token)
+    return method
+
+
+def track_query_origin(cls):
+    """
+    Декоратор класса репозитория: оборачивает его async-методы через _with_origin.
+    """
+    for name, func in list(vars(cls).items()):
+        if not name.startswith("__") and (pyinspect.iscoroutinefunction(func) or pyinspect.isasyncgenfunction(func)):
+            setattr(cls, name, _with_origin(func))
+    return cls
+
+
+@asynccontextmanager
+async def session_scope(write: bool = False, standalone: bool = False) -> AsyncIterator[AsyncSession]:
+    """
+    Сессия основной БД для метода репозитория. Внутри апдейта с unit of work
+    переиспользует его сессию (запись — в savepoint), иначе открывает собственную.
+    standalone=True — всегда собственная сессия, даже внутри unit of work
+    (долгие чтения не держат соединение апдейта).
+    Аналитические чтения с реплики — read_with_fallback и stream_with_fallback.
+    """
+    uow = None if standalone else active_uow()
+    if uow is not None:
+        session = uow.get_session()
+        if write and uow.savepoints:
+            async with session.begin_nested():
+                yield session
+        else:
+            yield session
+        return
+
+    async with async_session(expire_on_commit=False) as session:
+        if write:
+            async with session.begin():
+                yield session
+        else:
+            yield session
+
+
+@asynccontextmanager
+async def transaction() -> AsyncIterator[AsyncSession]:
+    """
+    Одна транзакция на несколько вызовов репозиториев (например, пакетная запись оценок
+    вместе с дневной сводкой): внутри блока session_scope отдаёт её сессию,
+    а after_commit откладывается до коммита. Внутри unit of work апдейта — его сессия в savepoint.
+    """
+    uow = active_uow()
+    if uow is not None:
+        session = uow.get_session()
+        if uow.savepoints:
+            async with session.begin_nested():
+                yield session
+        else:
+            yield session
+        return
+
+    uow = UnitOfWork(savepoints=False)
+    token = current_uow.set(uow)
+    try:
+        yield uow.get_session()
+    except BaseException:
+        await uow.rollback()
+        raise
+    else:
+        await uow.commit()
+    finally:
+        current_uow.reset(token)
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """
+    Выполняет callback после фиксации данных: сразу или после коммита unit of work.
+    """
+    uow = active_uow()
+    if uow is not None:
+        uow.after_commit(callback)
+    else:
+        callback()
+
+
+def on_rollback(callback: Callable[[], None]) -> None:
+    """
+    Выполняет callback, если unit of work текущего апдейта будет откатан.
+    """
+    uow = active_uow()
+    if uow is not None:
+        uow.on_rollback(callback)
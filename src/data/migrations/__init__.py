@@ -0,0 +1,103 @@
+import importlib
+import pkgutil
+from types import ModuleType
+from typing import List, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from src.utils.misc.bot_logging import bot_logger
+
+
+MIGRATIONS_TABLE = "schema_migrations"
+# Ключ pg_advisory_lock, чтобы два процесса бота не применяли миграции одновременно
+MIGRATIONS_LOCK_ID = 4_817_202_501
+
+
+def load_revisions() -> List[ModuleType]:
+    """
+    Модули ревизий из src/data/migrations/versions в порядке имён файлов.
+    Каждый модуль задаёт revision, description, async upgrade(conn)
+    и, если DDL нельзя выполнять в транзакции, transactional = False.
+    """
+    from src.data.migrations import versions
+
+    names = sorted(info.name for info in pkgutil.iter_modules(versions.__path__))
+    return [importlib.import_module(f"{versions.__name__}.{name}") for name in names]
+
+
+async def _applied_revisions(conn: AsyncConnection) -> Set[str]:
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+        "revision VARCHAR(64) PRIMARY KEY, "
+        "description VARCHAR(255), "
+        "applied_at TIMESTAMP NOT NULL DEFAULT now())"
+    ))
+    result = await conn.execute(text(f"SELECT revision FROM {MIGRATIONS_TABLE}"))
+    return set(result.scalars().all())
+
+
+async def _mark_applied(conn: AsyncConnection, module: ModuleType) -> None:
+    await conn.execute(
+        text(f"INSERT INTO {MIGRATIONS_TABLE} (revision, description) VALUES (:revision, :description) "
+             "ON CONFLICT (revision) DO NOTHING"),
+        {"revision": module.revision, "description": module.description},
+    )
+
+
+async def run_migrations(engine: AsyncEngine, stamp_only: bool = False) -> List[str]:
+    """
+    Применяет ещё не применённые ревизии. stamp_only — только отметить их применёнными
+    (свежая БД, схема которой уже создана по моделям).
+    Возвращает список применённых ревизий.
+    """
+    applied_now = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_ID})
+        try:
+            applied = await _applied_revisions(conn)
+            for module in load_revisions():
+                if module.revision in applied:
+                    continue
+                if not stamp_only:
+                    bot_logger.warning(f"Применяется миграция {module.revision}: {module.description}")
+                    if getattr(module, "transactional", True):
+                        async with engine.begin() as tx_conn:
+                            await module.upgrade(tx_conn)
+                    else:
+                        await module.upgrade(conn)
+                await _mark_applied(conn, module)
+                applied_now.append(module.revision)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_ID})
+    return applied_now
+
+
+async def migration_status(engine: AsyncEngine) -> List[tuple]:
+    """
+    Список (ревизия, описание, применена ли).
+    """
+    async with engine.begin() as conn:
+        applied = await _applied_revisions(conn)
+    return [(module.revision, module.description, module.revision in applied) for module in load_revisions()]
+
+
+async def create_index_concurrently(
+    conn: AsyncConnection, name: str, table: str, definition: str, unique: bool = False
+) -> None:
+    """
+    CREATE [UNIQUE] INDEX CONCURRENTLY без блокировки записи в таблицу.
+    Невалидный индекс, оставшийся от прерванной сборки, пересоздаётся.
+    Соединение должно быть в режиме AUTOCOMMIT.
+    """
+    result = await conn.execute(
+        text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"),
+        {"name": name},
+    )
+    valid = result.scalar_one_or_none()
+    if valid is False:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    await conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"
+    ))
@@ -0,0 +1,38 @@
+"""
+Миграции схемы из командной строки:
+    python -m src.data.migrations upgrade
+    python -m src.data.migrations status
+    python -m src.data.migrations rollups   # пересчитать дневную сводку оценок
+"""
+import sys
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+async def main(command: str) -> None:
+    from src.data.db import engine
+    from src.data.migrations import run_migrations, migration_status
+
+    try:
+        if command == "upgrade":
+            applied = await run_migrations(engine)
+            print(f"Применено миграций: {len(applied)}" + (f" ({', '.join(applied)})" if applied else ""))
+        elif command == "status":
+            for revision, description, applied in await migration_status(engine):
+                print(f"{'✅' if applied else '⏳'} {revision} {description}")
+        elif command == "rollups":
+            from src.data.repositories.ratingRollup_repository import rating_rollup_crud
+
+            rows = await rating_rollup_crud.backfill()
+            print(f"Дневная сводка оценок пересчитана: {rows} строк")
+        else:
+            print(f"Неизвестная команда: {command}. Доступно: upgrade, status, rollups")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "upgrade"))
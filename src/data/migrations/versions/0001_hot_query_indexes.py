@@ -0,0 +1,25 @@
+"""
+Индексы под частые запросы: проверка оценки за 7 дней, аналитика,
+смена роли по username, список специалистов организации.
+"""
+from src.data.migrations import create_index_concurrently
+
+
+revision = "0001"
+description = "indexes for hot queries"
+transactional = False
+
+INDEXES = (
+    ("ix_aoq_user_id_created_at", "assessments_of_quality", "(user_id, created_at)"),
+    ("ix_aoq_specialist_id_created_at", "assessments_of_quality", "(specialist_id, created_at)"),
+    ("ix_aoq_service_id", "assessments_of_quality", "(service_id)"),
+    ("ix_aoq_created_at", "assessments_of_quality", "(created_at)"),
+    ("ix_nps_created_at", "net_promoter_scores", "(created_at)"),
+    ("ix_users_username_lower", "users", "(lower(username))"),
+    ("ix_specialists_organization_fullname", "specialists", "(organization, fullname)"),
+)
+
+
+async def upgrade(conn):
+    for name, table, definition in INDEXES:
+        await create_index_concurrently(conn, name, table, definition)
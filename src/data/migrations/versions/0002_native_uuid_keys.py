@@ -0,0 +1,245 @@
+"""
+Перевод первичных и внешних ключей с VARCHAR(36) на нативный uuid.
+Значения не меняются, поэтому ссылки с id специалиста на уже напечатанных
+QR-кодах остаются рабочими.
+
+Без долгих блокировок: рядом с каждой колонкой создаётся uuid-колонка, которую триггер
+заполняет при записи, старые строки переносятся пачками, индексы строятся CONCURRENTLY,
+NOT NULL подтверждается проверкой NOT VALID + VALIDATE. Затем одна короткая транзакция
+меняет колонки местами, а внешние ключи создаются NOT VALID и проверяются уже после неё.
+Прерванную миграцию можно запустить снова — она продолжит с того же места.
+"""
+import re
+import asyncio
+from typing import Dict, List, Tuple
+
+from sqlalchemy import exc, text
+
+from src.data.migrations import create_index_concurrently
+from src.utils.misc.bot_logging import bot_logger
+
+
+revision = "0002"
+description = "native uuid primary and foreign keys"
+transactional = False
+
+# Таблица → колонки-ключи
+KEY_COLUMNS = {
+    "users": ("id", "social_subcategory_id"),
+    "services": ("id",),
+    "social_categories": ("id",),
+    "social_subcategories": ("id", "category_id"),
+    "specialists": ("id",),
+    "assessments_of_quality": ("id", "user_id", "specialist_id", "service_id"),
+    "net_promoter_scores": ("id", "aoq_id", "user_id"),
+}
+
+BACKFILL_BATCH_SIZE = 10_000
+# Транзакция замены колонок ждёт блокировку недолго и повторяется
+SWAP_LOCK_TIMEOUT = "5s"
+SWAP_ATTEMPTS = 10
+SWAP_RETRY_SECONDS = 5
+# SQLSTATE lock_not_available
+LOCK_NOT_AVAILABLE = "55P03"
+
+# (таблица, индекс, индекс на uuid-колонках, тип ограничения "p"/"u" или None, имя ограничения)
+ShadowIndex = Tuple[str, str, str, str, str]
+
+
+def _shadow(column: str) -> str:
+    return f"{column}__uuid"
+
+
+def _not_null_check(table: str, column: str) -> str:
+    return f"{table}_{column}__uuid_not_null"
+
+
+async def _pending(conn) -> Dict[str, List[str]]:
+    result = await conn.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND data_type <> 'uuid' "
+        "AND table_name = ANY(:tables)"
+    ), {"tables": list(KEY_COLUMNS)})
+    found = {(table, column) for table, column in result.all() if column in KEY_COLUMNS[table]}
+    return {
+        table: [column for column in columns if (table, column) in found]
+        for table, columns in KEY_COLUMNS.items()
+        if any((table, column) in found for column in columns)
+    }
+
+
+async def _add_shadow_columns(conn, table: str, columns: List[str]) -> None:
+    """
+    uuid-колонки рядом со старыми и триггер, который заполняет их при каждой записи.
+    """
+    sync = " ".join(f"NEW.{_shadow(column)} := NEW.{column}::uuid;" for column in columns)
+    await conn.execute(text("SET lock_timeout = '10s'"))
+    for column in columns:
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {_shadow(column)} uuid"))
+    await conn.execute(text(
+        f"CREATE OR REPLACE FUNCTION {table}__uuid_sync() RETURNS trigger LANGUAGE plpgsql "
+        f"AS $$ BEGIN {sync} RETURN NEW; END $$"
+    ))
+    await conn.execute(text(f"DROP TRIGGER IF EXISTS {table}__uuid_sync ON {table}"))
+    await conn.execute(text(
+        f"CREATE TRIGGER {table}__uuid_sync BEFORE INSERT OR UPDATE ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION {table}__uuid_sync()"
+    ))
+    await conn.execute(text("RESET lock_timeout"))
+
+
+async def _backfill(conn, table: str, columns: List[str]) -> None:
+    """
+    Переносит значения в uuid-колонки пачками по id: каждая пачка — короткая транзакция.
+    """
+    assign = ", ".join(f"{_shadow(column)} = {column}::uuid" for column in columns)
+    differs = " OR ".join(f"{_shadow(column)} IS DISTINCT FROM {column}::uuid" for column in columns)
+    last_id = None
+    while True:
+        after = "" if last_id is None else "WHERE id > :last_id "
+        result = await conn.execute(
+            text(f"SELECT id FROM {table} {after}ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+        )
+        ids = result.scalars().all()
+        if not ids:
+            return
+        await conn.execute(
+            text(f"UPDATE {table} SET {assign} WHERE id BETWEEN :first_id AND :last_id AND ({differs})"),
+            {"first_id": ids[0], "last_id": ids[-1]},
+        )
+        last_id = ids[-1]
+
+
+async def _shadow_indexes(conn, table: str, columns: List[str]) -> List[ShadowIndex]:
+    """
+    Копии индексов (в том числе первичного ключа и уникальных ограничений), в которые
+    входят старые колонки, на uuid-колонках — CREATE INDEX CONCURRENTLY.
+    """
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisunique, con.contype::text, con.conname "
+        "FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_class t ON t.oid = i.indrelid "
+        "LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid "
+        "AND con.contype IN ('p', 'u') "
+        "WHERE t.relname = :table AND t.relnamespace = current_schema()::regnamespace "
+        "AND EXISTS (SELECT 1 FROM pg_attribute a WHERE a.attrelid = t.oid "
+        "AND a.attnum = ANY(i.indkey) AND a.attname = ANY(:columns))"
+    ), {"table": table, "columns": columns})
+
+    indexes = []
+    for name, definition, unique, contype, conname in result.all():
+        using = definition[definition.index(" USING "):].strip()
+        for column in columns:
+            using = re.sub(rf"\b{column}\b", _shadow(column), using)
+        shadow_name = f"{name}__uuid"
+        await create_index_concurrently(conn, shadow_name, table, using, unique=unique)
+        indexes.append((table, name, shadow_name, contype, conname))
+    return indexes
+
+
+async def _not_null_columns(conn, pending: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    """
+    NOT NULL для uuid-колонок подтверждается проверкой NOT VALID + VALIDATE (без блокировки записи),
+    тогда SET NOT NULL при замене колонок не сканирует таблицу.
+    """
+    result = await conn.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND is_nullable = 'NO' AND table_name = ANY(:tables)"
+    ), {"tables": list(pending)})
+    not_null = [(table, column) for table, column in result.all() if column in pending[table]]
+
+    for table, column in not_null:
+        name = _not_null_check(table, column)
+        exists = await conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": name})
+        if exists.first() is None:
+            await conn.execute(text("SET lock_timeout = '10s'"))
+            await conn.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({_shadow(column)} IS NOT NULL) NOT VALID"
+            ))
+            await conn.execute(text("RESET lock_timeout"))
+        await conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}"))
+    return not_null
+
+
+async def _swap(
+    tx, pending: Dict[str, List[str]], indexes: List[ShadowIndex], not_null: List[Tuple[str, str]]
+) -> None:
+    """
+    Одна короткая транзакция: старые колонки удаляются (вместе с их индексами), uuid-колонки
+    получают их имена, индексы-копии становятся первичными ключами и ограничениями,
+    внешние ключи создаются NOT VALID.
+    """
+    await tx.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+    result = await tx.execute(text(
+        "SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid) "
+        "FROM pg_constraint c "
+        "WHERE c.contype = 'f' AND c.connamespace = current_schema()::regnamespace "
+        "AND (c.conrelid::regclass::text = ANY(:tables) OR c.confrelid::regclass::text = ANY(:tables))"
+    ), {"tables": list(pending)})
+    foreign_keys = result.all()
+
+    for table, name, _ in foreign_keys:
+        await tx.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+
+    for table, columns in pending.items():
+        await tx.execute(text(f"DROP TRIGGER IF EXISTS {table}__uuid_sync ON {table}"))
+        await tx.execute(text(f"DROP FUNCTION IF EXISTS {table}__uuid_sync()"))
+        for column in columns:
+            await tx.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+            await tx.execute(text(f"ALTER TABLE {table} RENAME COLUMN {_shadow(column)} TO {column}"))
+
+    for table, column in not_null:
+        await tx.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"))
+        await tx.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {_not_null_check(table, column)}"))
+
+    for table, name, shadow_name, contype, conname in indexes:
+        if contype == "p":
+            await tx.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{conname}" PRIMARY KEY USING INDEX {shadow_name}'))
+        elif contype == "u":
+            await tx.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{conname}" UNIQUE USING INDEX {shadow_name}'))
+        else:
+            await tx.execute(text(f'ALTER INDEX {shadow_name} RENAME TO "{name}"'))
+
+    for table, name, definition in foreign_keys:
+        await tx.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition} NOT VALID'))
+
+
+async def _validate_foreign_keys(conn) -> None:
+    """
+    Проверка внешних ключей, созданных NOT VALID: читает таблицы, но не блокирует запись.
+    """
+    result = await conn.execute(text(
+        "SELECT c.conrelid::regclass::text, c.conname FROM pg_constraint c "
+        "WHERE c.contype = 'f' AND NOT c.convalidated AND c.connamespace = current_schema()::regnamespace "
+        "AND c.conrelid::regclass::text = ANY(:tables)"
+    ), {"tables": list(KEY_COLUMNS)})
+    for table, name in result.all():
+        await conn.execute(text(f'ALTER TABLE {table} VALIDATE CONSTRAINT "{name}"'))
+
+
+async def upgrade(conn):
+    pending = await _pending(conn)
+    if pending:
+        for table, columns in pending.items():
+            await _add_shadow_columns(conn, table, columns)
+        for table, columns in pending.items():
+            await _backfill(conn, table, columns)
+        indexes = []
+        for table, columns in pending.items():
+            indexes += await _shadow_indexes(conn, table, columns)
+        not_null = await _not_null_columns(conn, pending)
+
+        for attempt in range(1, SWAP_ATTEMPTS + 1):
+            try:
+                async with conn.engine.begin() as tx:
+                    await _swap(tx, pending, indexes, not_null)
+                break
+            except exc.DBAPIError as e:
+                if getattr(e.orig, "sqlstate", None) != LOCK_NOT_AVAILABLE or attempt == SWAP_ATTEMPTS:
+                    raise
+                bot_logger.warning(f"Замена колонок на uuid ждёт блокировку, попытка {attempt}: {e}")
+                await asyncio.sleep(SWAP_RETRY_SECONDS)
+
+    await _validate_foreign_keys(conn)
@@ -0,0 +1,25 @@
+"""
+Триграммный индекс для поиска специалистов по ФИО, должности и организации.
+Выражение совпадает с models.specialist_search_document.
+"""
+from sqlalchemy import text
+
+from src.data.migrations import create_index_concurrently
+from src.data.models import SEARCH_FOLD_FROM, SEARCH_FOLD_TO
+
+
+revision = "0003"
+description = "pg_trgm index for specialist search"
+transactional = False
+
+SEARCH_DOCUMENT = (
+    "translate(coalesce(fullname, '') || ' ' || coalesce(position, '') || ' ' || coalesce(organization, ''), "
+    f"'{SEARCH_FOLD_FROM}', '{SEARCH_FOLD_TO}')"
+)
+
+
+async def upgrade(conn):
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await create_index_concurrently(
+        conn, "ix_specialists_search_trgm", "specialists", f"USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)"
+    )
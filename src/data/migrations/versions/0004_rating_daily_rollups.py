@@ -0,0 +1,13 @@
+"""
+Дневная сводка оценок (rating_daily_rollups). Заполняется по уже накопленным оценкам
+в 0006, когда у оценок появляется подкатегория на момент оценки.
+"""
+from src.data.models import RatingDailyRollup
+
+
+revision = "0004"
+description = "daily rating rollups"
+
+
+async def upgrade(conn):
+    await conn.run_sync(lambda sync_conn: RatingDailyRollup.__table__.create(sync_conn, checkfirst=True))
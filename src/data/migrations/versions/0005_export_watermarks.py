@@ -0,0 +1,22 @@
+"""
+Водяные знаки выгрузок статистики (export_watermarks) и индексы по modified_at
+для выгрузки только новых и изменённых оценок.
+"""
+from src.data.migrations import create_index_concurrently
+from src.data.models import ExportWatermark
+
+
+revision = "0005"
+description = "export watermarks and modified_at indexes"
+transactional = False
+
+INDEXES = (
+    ("ix_aoq_modified_at", "assessments_of_quality", "(modified_at)"),
+    ("ix_nps_modified_at", "net_promoter_scores", "(modified_at)"),
+)
+
+
+async def upgrade(conn):
+    await conn.run_sync(lambda sync_conn: ExportWatermark.__table__.create(sync_conn, checkfirst=True))
+    for name, table, definition in INDEXES:
+        await create_index_concurrently(conn, name, table, definition)
@@ -0,0 +1,49 @@
+"""
+Подкатегория пользователя на момент оценки (assessments_of_quality.social_subcategory_id) —
+ключ дневной сводки. Накопленные оценки получают текущую подкатегорию пользователя
+пачками по id, затем сводка пересчитывается по ним один раз.
+"""
+from sqlalchemy import text
+
+from src.data.repositories.ratingRollup_repository import rating_rollup_crud
+
+
+revision = "0006"
+description = "social subcategory snapshot on assessments"
+transactional = False
+
+BACKFILL_BATCH_SIZE = 10_000
+
+
+async def upgrade(conn):
+    # Колонка без значения по умолчанию добавляется без перезаписи таблицы
+    await conn.execute(text("SET lock_timeout = '10s'"))
+    await conn.execute(text(
+        "ALTER TABLE assessments_of_quality ADD COLUMN IF NOT EXISTS social_subcategory_id uuid"
+    ))
+    await conn.execute(text("RESET lock_timeout"))
+
+    # Каждая пачка — отдельная короткая транзакция (соединение в AUTOCOMMIT)
+    last_id = None
+    while True:
+        result = await conn.execute(
+            text(
+                "SELECT id FROM assessments_of_quality WHERE (CAST(:last_id AS uuid) IS NULL OR id > :last_id) "
+                "ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+        )
+        ids = result.scalars().all()
+        if not ids:
+            break
+        await conn.execute(
+            text(
+                "UPDATE assessments_of_quality a SET social_subcategory_id = u.social_subcategory_id "
+                "FROM users u WHERE u.id = a.user_id AND a.id BETWEEN :first_id AND :last_id "
+                "AND a.social_subcategory_id IS NULL"
+            ),
+            {"first_id": ids[0], "last_id": ids[-1]},
+        )
+        last_id = ids[-1]
+
+    await rating_rollup_crud.backfill()
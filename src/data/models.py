@@ -1,11 +1,11 @@
 import os, enum
 from typing import Optional, Union
 import pytz
-from sqlalchemy import event, Float, String, Integer, BigInteger, DateTime, ForeignKey, Enum, func
+from sqlalchemy import event, DDL, Float, String, Integer, BigInteger, Date, DateTime, ForeignKey, Enum, Index, Uuid, func, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from uuid import uuid4, UUID
 
-from datetime import datetime
+from datetime import date, datetime
 
 tz = pytz.timezone(os.getenv("TIMEZONE", "Asia/Yakutsk"))
 
@@ -16,7 +16,8 @@ def tz_now_naive() -> datetime:
 class BaseEntity(DeclarativeBase):
     __abstract__ = True
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
+    # Нативный uuid в БД, в Python — строка (как в ссылках и callback_data)
+    id: Mapped[str] = mapped_column(Uuid(as_uuid=False), primary_key=True, default=lambda: str(uuid4()))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=tz_now_naive)
     modified_at: Mapped[datetime] = mapped_column(DateTime, default=tz_now_naive, onupdate=tz_now_naive)
 
@@ -42,6 +43,8 @@ class User(BaseEntity):
     nps: Mapped[list["NetPromoterScore"]] = relationship(back_populates="user")
     socialsubcategory: Mapped["SocialSubcategory"] = relationship(back_populates="user", uselist=False)
 
+Index("ix_users_username_lower", func.lower(User.username))
+
 class Service(BaseEntity):
     __tablename__ = 'services'
 
@@ -68,6 +71,9 @@ class SocialSubcategory(BaseEntity):
     
 class Specialist(BaseEntity):
     __tablename__ = 'specialists'
+    __table_args__ = (
+        Index("ix_specialists_organization_fullname", "organization", "fullname"),
+    )
 
     organization: Mapped[str] = mapped_column(String(255), nullable=False)
     position: Mapped[str] = mapped_column(String(255), nullable=True)
@@ -78,12 +84,60 @@ class Specialist(BaseEntity):
     
     aoq: Mapped[list["AssessmentOfQuality"]] = relationship(back_populates="specialist", cascade="all, delete-orphan")
 
+
+# Нижний регистр и ё → е без учёта локали БД: lower() при локали C не трогает кириллицу
+SEARCH_FOLD_FROM = "ABCDEFGHIJKLMNOPQRSTUVWXYZАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯё"
+SEARCH_FOLD_TO = "abcdefghijklmnopqrstuvwxyzабвгдеежзийклмнопрстуфхцчшщъыьэюяе"
+
+
+_SEARCH_FOLD_TABLE = str.maketrans(SEARCH_FOLD_FROM, SEARCH_FOLD_TO)
+
+
+def search_fold(value: str) -> str:
+    """
+    То же преобразование, что specialist_search_document, для строки запроса.
+    """
+    return value.translate(_SEARCH_FOLD_TABLE)
+
+
+# ФИО, должность и организация одной строкой для триграммного поиска.
+# Константы встроены в SQL, чтобы выражение в запросе совпадало с индексом.
+specialist_search_document = func.translate(
+    func.coalesce(Specialist.fullname, text("''"))
+    .op("||")(text("' '"))
+    .op("||")(func.coalesce(Specialist.position, text("''")))
+    .op("||")(text("' '"))
+    .op("||")(func.coalesce(Specialist.organization, text("''"))),
+    text(f"'{SEARCH_FOLD_FROM}'"),
+    text(f"'{SEARCH_FOLD_TO}'"),
+)
+
+Index(
+    "ix_specialists_search_trgm",
+    specialist_search_document.label("search_document"),
+    postgresql_using="gin",
+    postgresql_ops={"search_document": "gin_trgm_ops"},
+)
+
+# Расширение нужно индексу поиска и при создании схемы с нуля
+event.listen(BaseEntity.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
 class AssessmentOfQuality(BaseEntity):
     __tablename__ = 'assessments_of_quality'
+    __table_args__ = (
+        Index("ix_aoq_user_id_created_at", "user_id", "created_at"),
+        Index("ix_aoq_specialist_id_created_at", "specialist_id", "created_at"),
+        Index("ix_aoq_service_id", "service_id"),
+        Index("ix_aoq_created_at", "created_at"),
+        Index("ix_aoq_modified_at", "modified_at"),
+    )
     
     user_id: Mapped[UUID] = mapped_column(ForeignKey('users.id'), nullable=False)
     specialist_id: Mapped[UUID] = mapped_column(ForeignKey('specialists.id'), nullable=False)
     service_id: Mapped[UUID] = mapped_column(ForeignKey('services.id', ondelete="SET NULL"), nullable=True)
+    # Социальная подкатегория пользователя на момент оценки — ключ дневной сводки.
+    # Без внешнего ключа, как и в сводке: смена или удаление подкатегории не меняет прошлые оценки
+    social_subcategory_id: Mapped[Optional[str]] = mapped_column(Uuid(as_uuid=False), nullable=True)
     
     score: Mapped[int] = mapped_column(Integer, nullable=False)
     comment: Mapped[str] = mapped_column(String(1000), nullable=True)
@@ -95,6 +149,10 @@ class AssessmentOfQuality(BaseEntity):
     
 class NetPromoterScore(BaseEntity):
     __tablename__ = 'net_promoter_scores'
+    __table_args__ = (
+        Index("ix_nps_created_at", "created_at"),
+        Index("ix_nps_modified_at", "modified_at"),
+    )
     
     aoq_id: Mapped[UUID] = mapped_column(ForeignKey('assessments_of_quality.id'), unique=True)
     user_id: Mapped[UUID] = mapped_column(ForeignKey('users.id'), nullable=False)
@@ -103,3 +161,46 @@ class NetPromoterScore(BaseEntity):
 
     user: Mapped["User"] = relationship(back_populates="nps")
     aoq: Mapped["AssessmentOfQuality"] = relationship(back_populates="nps", uselist=False)
+
+
+class RatingDailyRollup(BaseEntity):
+    """
+    Оценки за день по специалисту, услуге и социальной подкатегории пользователя на момент оценки.
+    Обновляется в одной транзакции с записью AOQ/NPS; отчёты читают её вместо сырых оценок.
+    """
+    __tablename__ = 'rating_daily_rollups'
+    __table_args__ = (
+        Index(
+            "ux_rating_daily_rollups_key", "day", "specialist_id", "service_id", "social_subcategory_id",
+            unique=True, postgresql_nulls_not_distinct=True,
+        ),
+    )
+
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    # Без внешних ключей: удалённая услуга переносится в строки без услуги (см. detach_services),
+    # полный пересчёт из оценок — командой rollups
+    specialist_id: Mapped[str] = mapped_column(Uuid(as_uuid=False), nullable=False)
+    service_id: Mapped[Optional[str]] = mapped_column(Uuid(as_uuid=False), nullable=True)
+    social_subcategory_id: Mapped[Optional[str]] = mapped_column(Uuid(as_uuid=False), nullable=True)
+
+    aoq_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_sum: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_1: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_2: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_3: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_4: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    score_5: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    nps_promoters: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    nps_passives: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    nps_detractors: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class ExportWatermark(BaseEntity):
+    """
+    Момент, до которого статистика уже выгружена получателю: следующая
+    выгрузка изменений содержит только строки, созданные или изменённые позже.
+    """
+    __tablename__ = 'export_watermarks'
+
+    tg_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
+    exported_until: Mapped[datetime] = mapped_column(DateTime, nullable=False)
@@ -0,0 +1,137 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.data.repositories.base_repository import projection_type
+from src.data.repositories.service_repository import service_crud
+from src.data.repositories.socialCategory_repository import social_category_crud
+from src.data.repositories.socialSubcategory_repository import social_subcategory_crud
+from src.data.repositories.specialist_repository import specialist_crud
+
+
+# Организация и id одного из её специалистов (курсор и ключ в callback_data)
+OrganizationRow = projection_type("Organization", ("name", "id"))
+
+SERVICES = "services"
+CATEGORIES = "categories"
+SUBCATEGORIES = "subcategories"
+ORGANIZATIONS = "organizations"
+
+
+class ReferenceData:
+    """
+    Справочники в памяти: услуги, социальные категории и подкатегории, организации.
+    Запись в соответствующую таблицу помечает справочник устаревшим,
+    он перечитывается из БД при следующем обращении. Записи других процессов
+    находит периодическая проверка refresh.
+    """
+    def __init__(self):
+        self.services: List[Any] = []
+        self.categories: List[Any] = []
+        self.subcategories: Dict[str, List[Any]] = {}
+        self.organizations: List[Any] = []
+        self.organization_by_id: Dict[str, str] = {}
+        # Номер изменения справочника и номер, с которым он загружен
+        self._versions: Dict[str, int] = {kind: 1 for kind in (SERVICES, CATEGORIES, SUBCATEGORIES, ORGANIZATIONS)}
+        self._loaded: Dict[str, int] = {kind: 0 for kind in self._versions}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Отпечаток таблицы справочника на момент загрузки (write_stamp)
+        self._stamps: Dict[str, Tuple[Any, ...]] = {}
+        self._repositories = {
+            SERVICES: service_crud,
+            CATEGORIES: social_category_crud,
+            SUBCATEGORIES: social_subcategory_crud,
+            ORGANIZATIONS: specialist_crud,
+        }
+        self._loaders = {
+            SERVICES: self._load_services,
+            CATEGORIES: self._load_categories,
+            SUBCATEGORIES: self._load_subcategories,
+            ORGANIZATIONS: self._load_organizations,
+        }
+
+        service_crud.add_write_listener(lambda ids: self.invalidate(SERVICES))
+        # Удаление категории каскадно удаляет её подкатегории
+        social_category_crud.add_write_listener(lambda ids: self.invalidate(CATEGORIES, SUBCATEGORIES))
+        social_subcategory_crud.add_write_listener(lambda ids: self.invalidate(SUBCATEGORIES))
+        specialist_crud.add_write_listener(lambda ids: self.invalidate(ORGANIZATIONS))
+
+    def invalidate(self, *kinds: str) -> None:
+        for kind in kinds:
+            self._versions[kind] += 1
+
+    async def load(self) -> None:
+        """
+        Загружает все справочники (при запуске бота).
+        """
+        for kind in self._loaders:
+            await self._ensure(kind)
+
+    async def _ensure(self, kind: str) -> None:
+        if self._loaded[kind] == self._versions[kind]:
+            return
+        lock = self._locks.setdefault(kind, asyncio.Lock())
+        async with lock:
+            version = self._versions[kind]
+            if self._loaded[kind] == version:
+                return
+            stamp = await self._repositories[kind].write_stamp()
+            await self._loaders[kind]()
+            self._stamps[kind] = stamp
+            self._loaded[kind] = version
+
+    async def refresh(self) -> None:
+        """
+        Проверка по расписанию: справочники, чьи таблицы изменились с загрузки
+        (в том числе другим процессом), перечитываются.
+        """
+        for kind, repository in self._repositories.items():
+            if kind in self._stamps and await repository.write_stamp() != self._stamps[kind]:
+                self.invalidate(kind)
+                await self._ensure(kind)
+
+    async def _load_services(self) -> None:
+        self.services = await service_crud.list_projection(["id", "name"], order_by=["name", "id"])
+
+    async def _load_categories(self) -> None:
+        self.categories = await social_category_crud.list_projection(["id", "name"], order_by=["name", "id"])
+
+    async def _load_subcategories(self) -> None:
+        rows = await social_subcategory_crud.list_projection(["id", "name", "category_id"], order_by=["name", "id"])
+        subcategories: Dict[str, List[Any]] = {}
+        for row in rows:
+            subcategories.setdefault(str(row.category_id), []).append(row)
+        self.subcategories = subcategories
+
+    async def _load_organizations(self) -> None:
+        rows = await specialist_crud.get_organizations()
+        self.organizations = [OrganizationRow(name, specialist_id) for name, specialist_id in rows]
+        self.organization_by_id = {row.id: row.name for row in self.organizations}
+
+    async def get_services(self) -> List[Any]:
+        await self._ensure(SERVICES)
+        return self.services
+
+    async def get_categories(self) -> List[Any]:
+        await self._ensure(CATEGORIES)
+        return self.categories
+
+    async def get_subcategories(self, category_id: str) -> List[Any]:
+        await self._ensure(SUBCATEGORIES)
+        return self.subcategories.get(str(category_id), [])
+
+    async def get_organizations(self) -> List[Any]:
+        await self._ensure(ORGANIZATIONS)
+        return self.organizations
+
+    async def get_organization(self, specialist_id: str) -> Optional[str]:
+        """
+        Организация по id из кнопки списка организаций; для прочих id — запрос в БД.
+        """
+        await self._ensure(ORGANIZATIONS)
+        organization = self.organization_by_id.get(specialist_id)
+        if organization is None:
+            organization = await specialist_crud.get_organization(specialist_id)
+        return organization
+
+
+reference_data = ReferenceData()
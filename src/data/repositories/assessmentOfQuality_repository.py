@@ -1,25 +1,154 @@
-from typing import Optional
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
 
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from cachetools import TTLCache
+from sqlalchemy import select, func, or_
 
-from src.data.repositories.base_repository import CRUDRepository, async_session
-from src.data.models import AssessmentOfQuality, User
+from src.data.db import session_scope, after_commit
+from src.data.repositories.base_repository import DELETE_CHUNK_SIZE
+from src.data.repositories.ratingRollup_repository import RolledUpRepository, rating_rollup_crud, AOQ_MEASURES
+from src.data.models import AssessmentOfQuality, Service, SocialSubcategory, Specialist, User, tz_now_naive
 
 
-class AssessmentOfQualityRepository(CRUDRepository[AssessmentOfQuality]):
+RATING_COOLDOWN = timedelta(days=int(os.getenv("RATING_COOLDOWN_DAYS", "7")))
+
+# Значение в кэше для пользователя, который ещё не оценивал
+_NEVER = datetime.min
+# Колонки, от которых зависит кэш времени последней оценки
+LAST_RATED_COLUMNS = frozenset({"user_id", "created_at"})
+
+
+class AssessmentOfQualityRepository(RolledUpRepository[AssessmentOfQuality]):
+    rollup_columns = frozenset({"specialist_id", "service_id", "social_subcategory_id", "score", "created_at"})
+    rollup_measures = AOQ_MEASURES
+
     def __init__(self):
         super().__init__(AssessmentOfQuality)
+        # user_id → время последней оценки
+        self.last_rated: TTLCache = TTLCache(
+            maxsize=int(os.getenv("LAST_RATED_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("LAST_RATED_CACHE_TTL", "3600")),
+        )
 
-    async def get_list_with_relations(self):
-        async with async_session() as session:
-            stmt = select(AssessmentOfQuality)
-            stmt = stmt.options(
-                selectinload(AssessmentOfQuality.user).selectinload(User.socialsubcategory),
-                selectinload(AssessmentOfQuality.specialist),
-                selectinload(AssessmentOfQuality.service),
+    def export_statement(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """
+        Оценки для выгрузки статистики: id, специалист, услуга, пользователь,
+        социальная подкатегория, балл, комментарий, дата — в порядке создания.
+        since/until — только созданные или изменённые в [since, until) (выгрузка изменений).
+        """
+        stmt = (
+            select(
+                AssessmentOfQuality.id,
+                Specialist.fullname,
+                Service.name,
+                func.coalesce(User.full_name, User.username),
+                SocialSubcategory.name,
+                AssessmentOfQuality.score,
+                AssessmentOfQuality.comment,
+                AssessmentOfQuality.created_at,
             )
-            result = await session.execute(stmt)
-            return result.scalars().all()
-        
+            .outerjoin(Specialist, Specialist.id == AssessmentOfQuality.specialist_id)
+            .outerjoin(Service, Service.id == AssessmentOfQuality.service_id)
+            .outerjoin(User, User.id == AssessmentOfQuality.user_id)
+            .outerjoin(SocialSubcategory, SocialSubcategory.id == User.social_subcategory_id)
+            .order_by(AssessmentOfQuality.created_at, AssessmentOfQuality.id)
+        )
+        if since is not None:
+            stmt = stmt.where(or_(AssessmentOfQuality.created_at >= since, AssessmentOfQuality.modified_at >= since))
+        if until is not None:
+            stmt = stmt.where(AssessmentOfQuality.created_at < until, AssessmentOfQuality.modified_at < until)
+        return stmt
+
+    async def rated_recently(self, user_id: str) -> bool:
+        """
+        Оценивал ли пользователь за RATING_COOLDOWN (проверка перед оценкой по QR-коду).
+        Время последней оценки берётся из кэша, иначе — один запрос
+        по индексу (user_id, created_at).
+        """
+        since = tz_now_naive() - RATING_COOLDOWN
+        last_rated_at = self.last_rated.get(user_id)
+        if last_rated_at is not None:
+            return last_rated_at > since
+
+        async with session_scope() as session:
+            stmt = select(func.max(AssessmentOfQuality.created_at)).where(AssessmentOfQuality.user_id == user_id)
+            last_rated_at = (await session.execute(stmt)).scalar_one_or_none()
+
+        last_rated_at = last_rated_at or _NEVER
+        self.last_rated[user_id] = last_rated_at
+        return last_rated_at > since
+
+    def _touch(self, user_id: str, created_at: datetime) -> None:
+        if created_at > self.last_rated.get(user_id, _NEVER):
+            self.last_rated[user_id] = created_at
+
+    def _tracking(self, session, ids: Sequence[Any], new: bool = False):
+        return rating_rollup_crud.tracking(session, aoq_ids=ids, new=new)
+
+    async def _with_subcategories(self, rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Подставляет в строки без social_subcategory_id подкатегорию пользователя на момент записи.
+        """
+        user_ids = list({row["user_id"] for row in rows if "social_subcategory_id" not in row})
+        if not user_ids:
+            return list(rows)
+        subcategories = {}
+        async with session_scope() as session:
+            for start in range(0, len(user_ids), DELETE_CHUNK_SIZE):
+                stmt = select(User.id, User.social_subcategory_id).where(User.id.in_(user_ids[start:start + DELETE_CHUNK_SIZE]))
+                subcategories.update((await session.execute(stmt)).all())
+        return [
+            row if "social_subcategory_id" in row else {**row, "social_subcategory_id": subcategories.get(row["user_id"])}
+            for row in rows
+        ]
+
+    async def create(self, **data: Any) -> AssessmentOfQuality:
+        """
+        Создаёт оценку вместе со строкой дневной сводки в одной транзакции
+        и после коммита обновляет время последней оценки пользователя.
+        Без social_subcategory_id берётся текущая подкатегория пользователя.
+        """
+        async with session_scope(write=True) as session:
+            if "social_subcategory_id" not in data:
+                stmt = select(User.social_subcategory_id).where(User.id == data["user_id"])
+                data["social_subcategory_id"] = (await session.execute(stmt)).scalar_one_or_none()
+            instance = AssessmentOfQuality(**data)
+            session.add(instance)
+            await session.flush()
+            await rating_rollup_crud.record_aoq(session, instance)
+        self._notify_write([instance.id])
+        user_id, created_at = instance.user_id, instance.created_at
+        after_commit(lambda: self._touch(user_id, created_at))
+        return instance
+
+    # Пакетные записи, изменения и удаления сбрасывают кэш времени последней оценки
+
+    async def create_many(self, rows: Sequence[Dict[str, Any]]) -> List[Any]:
+        ids = await super().create_many(await self._with_subcategories(rows))
+        self.last_rated.clear()
+        return ids
+
+    async def upsert_many(self, rows: Sequence[Dict[str, Any]], conflict_cols: Sequence[str]) -> List[Any]:
+        ids = await super().upsert_many(await self._with_subcategories(rows), conflict_cols)
+        self.last_rated.clear()
+        return ids
+
+    async def update(self, filters: Dict[str, Any], updates: Dict[str, Any]) -> int:
+        rowcount = await super().update(filters, updates)
+        if rowcount and LAST_RATED_COLUMNS & updates.keys():
+            self.last_rated.clear()
+        return rowcount
+
+    async def delete_many(self, ids: Sequence[Any]) -> int:
+        deleted = await super().delete_many(ids)
+        self.last_rated.clear()
+        return deleted
+
+    async def delete_all(self) -> int:
+        rowcount = await super().delete_all()
+        self.last_rated.clear()
+        return rowcount
+
+
 aoq_crud = AssessmentOfQualityRepository()
@@ -1,27 +1,197 @@
-from typing import Type, TypeVar, Generic, List, Optional, Dict, Any
-from sqlalchemy import select, update, delete
+import os
+import enum
+from dataclasses import make_dataclass
+from functools import lru_cache
+from typing import Type, TypeVar, Generic, List, Optional, Dict, Any, Sequence, Tuple, Callable, AsyncIterator
+from sqlalchemy import select, update, delete, or_, literal, func
+from sqlalchemy.dialects.postgresql import insert
 
-from src.data.db import async_session
+from src.data.db import session_scope, after_commit, track_query_origin, read_with_fallback, stream_with_fallback
+from src.data.models import tz_now_naive
 
 ModelType = TypeVar("ModelType")
 Filter = Dict[str, Any]
 Update = Dict[str, Any]
 
+# Начиная с этого размера пакета create_many использует COPY вместо INSERT
+COPY_THRESHOLD = int(os.getenv("DB_COPY_THRESHOLD", "10000"))
+# Максимум id в одном запросе ... WHERE id IN (...)
+DELETE_CHUNK_SIZE = 5000
 
+
+@lru_cache(maxsize=None)
+def projection_type(model_name: str, columns: Tuple[str, ...]) -> type:
+    """
+    Неизменяемый dataclass со __slots__ для набора колонок модели.
+    Класс создаётся один раз на набор колонок.
+    """
+    return make_dataclass(f"{model_name}Row", columns, slots=True, frozen=True)
+
+
+@track_query_origin
 class CRUDRepository(Generic[ModelType]):
+    def __init_subclass__(cls, **kwargs):
+        # Запросы методов любого репозитория подписываются в метриках его именем
+        super().__init_subclass__(**kwargs)
+        track_query_origin(cls)
+
     def __init__(self, model: Type[ModelType]):
         self.model = model
+        self._write_listeners: List[Callable[[Optional[List[Any]]], None]] = []
+
+    def add_write_listener(self, callback: Callable[[Optional[List[Any]]], None]) -> None:
+        """
+        Подписывает callback на изменения таблицы. Вызывается после коммита записи
+        со списком id изменённых строк или None, если затронута вся таблица.
+        """
+        self._write_listeners.append(callback)
+
+    def _notify_write(self, ids: Optional[Sequence[Any]] = None) -> None:
+        ids = list(ids) if ids is not None else None
+        for callback in self._write_listeners:
+            after_commit(lambda callback=callback: callback(ids))
 
     async def create(self, **data: Any) -> ModelType:
         """
         Создает новый объект модели и возвращает его.
         """
-        async with async_session() as session:
-            async with session.begin():
-                instance = self.model(**data)
-                session.add(instance)
-            await session.refresh(instance)
-            return instance
+        async with session_scope(write=True) as session:
+            instance = self.model(**data)
+            session.add(instance)
+            await session.flush()
+        self._notify_write([instance.id])
+        return instance
+
+    def _upsert_stmt(self, conflict_cols: Sequence[str], data: Dict[str, Any], bulk: bool = False):
+        """
+        Строит INSERT ... ON CONFLICT DO UPDATE ... WHERE <значения изменились>.
+        При bulk=True значения передаются отдельно (executemany).
+        """
+        table = self.model.__table__
+        stmt = insert(table) if bulk else insert(self.model).values(**data)
+        update_cols = [col for col in data if col not in conflict_cols]
+        if not update_cols:
+            return stmt.on_conflict_do_nothing(index_elements=list(conflict_cols))
+
+        return stmt.on_conflict_do_update(
+            index_elements=list(conflict_cols),
+            set_={
+                **{col: stmt.excluded[col] for col in update_cols},
+                "modified_at": tz_now_naive(),
+            },
+            where=or_(*(table.c[col].is_distinct_from(stmt.excluded[col]) for col in update_cols)),
+        )
+
+    async def upsert(self, conflict_cols: Sequence[str], **data: Any) -> Optional[ModelType]:
+        """
+        Вставляет объект или обновляет существующий по conflict_cols одним запросом.
+        Возвращает вставленный/изменённый объект или None, если данные не изменились.
+        """
+        async with session_scope(write=True) as session:
+            stmt = (
+                self._upsert_stmt(conflict_cols, data)
+                .returning(self.model)
+                .execution_options(populate_existing=True)
+            )
+            result = await session.execute(stmt)
+            instance = result.scalars().first()
+        if instance is not None:
+            self._notify_write([instance.id])
+        return instance
+
+    def _with_defaults(self, rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Дополняет строки значениями по умолчанию из модели (id, created_at, ...),
+        чтобы id были известны до вставки.
+        """
+        table = self.model.__table__
+        defaults = [
+            (column.key, column.default)
+            for column in table.columns
+            if column.default is not None and not column.default.is_sequence
+        ]
+        prepared = []
+        for row in rows:
+            row = dict(row)
+            for key, default in defaults:
+                if key not in row:
+                    row[key] = default.arg(None) if default.is_callable else default.arg
+            prepared.append(row)
+        return prepared
+
+    async def create_many(self, rows: Sequence[Dict[str, Any]]) -> List[Any]:
+        """
+        Создает объекты пакетно (многострочный INSERT, для больших пакетов — COPY).
+        Возвращает id созданных объектов в порядке rows.
+        """
+        if not rows:
+            return []
+
+        table = self.model.__table__
+        rows = self._with_defaults(rows)
+        async with session_scope(write=True) as session:
+            if len(rows) >= COPY_THRESHOLD and session.bind.dialect.driver == "asyncpg":
+                await self._copy_rows(session, rows)
+            else:
+                await session.execute(insert(table), rows)
+        ids = [row["id"] for row in rows]
+        self._notify_write(ids)
+        return ids
+
+    async def _copy_rows(self, session, rows: List[Dict[str, Any]]) -> None:
+        """
+        Загружает строки через COPY в рамках текущей транзакции сессии.
+        """
+        table = self.model.__table__
+        columns = [column.key for column in table.columns if column.key in rows[0]]
+        # Первый запрос открывает транзакцию на соединении asyncpg
+        await session.execute(select(literal(1)))
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        records = [
+            tuple(value.name if isinstance(value, enum.Enum) else value for value in (row.get(col) for col in columns))
+            for row in rows
+        ]
+        await raw.driver_connection.copy_records_to_table(table.name, records=records, columns=columns)
+
+    async def upsert_many(self, rows: Sequence[Dict[str, Any]], conflict_cols: Sequence[str]) -> List[Any]:
+        """
+        Пакетный INSERT ... ON CONFLICT DO UPDATE по conflict_cols.
+        Возвращает id вставленных или изменённых строк (неизменённые не возвращаются).
+        """
+        if not rows:
+            return []
+
+        # Одна команда не может обновить строку дважды — оставляем последнюю версию ключа
+        unique_rows = {tuple(row[col] for col in conflict_cols): row for row in rows}
+        rows = list(unique_rows.values())
+
+        table = self.model.__table__
+        stmt = self._upsert_stmt(conflict_cols, rows[0], bulk=True).returning(table.c.id)
+        async with session_scope(write=True) as session:
+            result = await session.execute(stmt, self._with_defaults(rows))
+            ids = list(result.scalars().all())
+        self._notify_write(ids)
+        return ids
+
+    async def delete_many(self, ids: Sequence[Any]) -> int:
+        """
+        Удаляет объекты по списку id.
+        Возвращает число удалённых строк.
+        """
+        deleted = 0
+        ids = list(ids)
+        async with session_scope(write=True) as session:
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                stmt = (
+                    delete(self.model)
+                    .where(self.model.id.in_(ids[start:start + DELETE_CHUNK_SIZE]))
+                    .execution_options(synchronize_session=False)
+                )
+                result = await session.execute(stmt)
+                deleted += result.rowcount
+        self._notify_write(ids)
+        return deleted
 
     async def get(
         self,
@@ -31,7 +201,7 @@ class CRUDRepository(Generic[ModelType]):
         """
         Возвращает один объект по ID или фильтрам.
         """
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(self.model)
             if id is not None:
                 stmt = stmt.where(self.model.id == id)
@@ -47,11 +217,92 @@ class CRUDRepository(Generic[ModelType]):
         """
         Возвращает список объектов, подходящих под фильтры.
         """
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(self.model).filter_by(**filters)
             result = await session.execute(stmt)
             return result.scalars().all()
-        
+
+    def _projection(self, columns: Sequence[str]) -> Tuple[type, list]:
+        row_type = projection_type(self.model.__name__, tuple(columns))
+        return row_type, [getattr(self.model, name) for name in columns]
+
+    async def list_projection(
+        self,
+        columns: Sequence[str],
+        order_by: Sequence[str] = (),
+        replica: bool = False,
+        **filters: Any
+    ) -> List[Any]:
+        """
+        Возвращает только нужные колонки в виде лёгких неизменяемых строк
+        (dataclass со __slots__) без ORM-объектов и identity map.
+        Строки не привязаны к сессии, их можно кэшировать.
+        replica=True — аналитическое чтение с реплики (см. read_with_fallback).
+        """
+        row_type, selected = self._projection(columns)
+        stmt = select(*selected).filter_by(**filters)
+        if order_by:
+            stmt = stmt.order_by(*[getattr(self.model, name) for name in order_by])
+
+        async def query(session) -> List[Any]:
+            result = await session.execute(stmt)
+            return [row_type(*row) for row in result.all()]
+
+        if replica:
+            return await read_with_fallback(query)
+        async with session_scope() as session:
+            return await query(session)
+
+    async def list_projection_by_ids(self, columns: Sequence[str], ids: Sequence[Any]) -> List[Any]:
+        """
+        Как list_projection, но для строк с заданными id (в произвольном порядке).
+        """
+        row_type, selected = self._projection(columns)
+        rows = []
+        ids = list(ids)
+        async with session_scope() as session:
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                stmt = select(*selected).where(self.model.id.in_(ids[start:start + DELETE_CHUNK_SIZE]))
+                result = await session.execute(stmt)
+                rows.extend(row_type(*row) for row in result.all())
+        return rows
+
+    async def stream_rows(self, stmt, batch_size: int = 5000, replica: bool = True) -> AsyncIterator[List[Any]]:
+        """
+        Строки запроса пачками по batch_size через серверный курсор: в памяти
+        одновременно только одна пачка. Для выгрузок, читает с реплики
+        (см. stream_with_fallback); replica=False — из основной БД, когда важна полнота.
+        Курсор живёт в собственной сессии, а не в unit of work апдейта.
+        """
+        if replica:
+            async for partition in stream_with_fallback(stmt, batch_size):
+                yield partition
+            return
+        async with session_scope(standalone=True) as session:
+            result = await session.stream(stmt.execution_options(yield_per=batch_size))
+            async for partition in result.partitions():
+                yield partition
+
+    async def count(self, **filters: Any) -> int:
+        """
+        Возвращает число объектов, подходящих под фильтры.
+        """
+        async with session_scope() as session:
+            stmt = select(func.count()).select_from(self.model).filter_by(**filters)
+            result = await session.execute(stmt)
+            return result.scalar_one()
+
+    async def write_stamp(self) -> Tuple[Any, ...]:
+        """
+        Отпечаток таблицы для проверки кэшей на записи других процессов:
+        число строк, последний modified_at и сумма modified_at — она меняется при любом
+        обновлении, даже если его транзакция закоммичена позже более свежей записи.
+        """
+        modified_at = func.extract("epoch", self.model.modified_at)
+        async with session_scope() as session:
+            stmt = select(func.count(), func.max(self.model.modified_at), func.sum(modified_at)).select_from(self.model)
+            result = await session.execute(stmt)
+            return tuple(result.one())
 
     async def update(
         self,
@@ -62,39 +313,41 @@ class CRUDRepository(Generic[ModelType]):
         Обновляет поля объектов, подходящих под фильтры.
         Возвращает число затронутых строк.
         """
-        async with async_session() as session:
-            async with session.begin():
-                stmt = (
-                    update(self.model)
-                    .filter_by(**filters)
-                    .values(**updates)
-                    .execution_options(synchronize_session="fetch")
-                )
-                result = await session.execute(stmt)
-            return result.rowcount
+        async with session_scope(write=True) as session:
+            stmt = (
+                update(self.model)
+                .filter_by(**filters)
+                .values(**updates)
+                .returning(self.model.id)
+                .execution_options(synchronize_session="fetch")
+            )
+            ids = list((await session.execute(stmt)).scalars().all())
+        self._notify_write(ids)
+        return len(ids)
 
     async def delete(self, **filters: Any) -> int:
         """
         Удаляет объекты, подходящие под фильтры.
         Возвращает число удалённых строк.
         """
-        async with async_session() as session:
-            async with session.begin():
-                stmt = (
-                    delete(self.model)
-                    .filter_by(**filters)
-                    .execution_options(synchronize_session="fetch")
-                )
-                result = await session.execute(stmt)
-            return result.rowcount
+        async with session_scope(write=True) as session:
+            stmt = (
+                delete(self.model)
+                .filter_by(**filters)
+                .returning(self.model.id)
+                .execution_options(synchronize_session="fetch")
+            )
+            ids = list((await session.execute(stmt)).scalars().all())
+        self._notify_write(ids)
+        return len(ids)
 
     async def delete_all(self) -> int:
         """
         Удаляет все записи из таблицы.
         Возвращает число удалённых строк.
         """
-        async with async_session() as session:
-            async with session.begin():
-                stmt = delete(self.model)
-                result = await session.execute(stmt)
-            return result.rowcount
\ No newline at end of file
+        async with session_scope(write=True) as session:
+            stmt = delete(self.model)
+            result = await session.execute(stmt)
+        self._notify_write()
+        return result.rowcount
\ No newline at end of file
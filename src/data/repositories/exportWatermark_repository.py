@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from typing import Dict, Sequence
+
+from sqlalchemy import select, text
+
+from src.data.db import session_scope
+from src.data.repositories.base_repository import CRUDRepository
+from src.data.models import ExportWatermark, tz_now_naive
+
+
+class ExportWatermarkRepository(CRUDRepository[ExportWatermark]):
+    def __init__(self):
+        super().__init__(ExportWatermark)
+
+    async def get_many(self, tg_ids: Sequence[int]) -> Dict[int, datetime]:
+        """
+        Водяные знаки получателей: tg_id → момент, до которого статистика выгружена.
+        Получателей без выгрузок в результате нет.
+        """
+        async with session_scope() as session:
+            stmt = select(ExportWatermark.tg_id, ExportWatermark.exported_until).where(
+                ExportWatermark.tg_id.in_(list(tg_ids))
+            )
+            result = await session.execute(stmt)
+            return {tg_id: exported_until for tg_id, exported_until in result.all()}
+
+    async def advance(self, tg_id: int, exported_until: datetime) -> None:
+        """
+        Сдвигает водяной знак получателя после успешной отправки выгрузки.
+        """
+        await self.upsert(["tg_id"], tg_id=tg_id, exported_until=exported_until)
+
+    async def horizon(self, lag: timedelta) -> datetime:
+        """
+        Граница дельта-выгрузки: строки, созданные или изменённые до неё, уже зафиксированы.
+        created_at/modified_at ставятся при flush, а видны строки только после коммита, поэтому
+        граница отступает на возраст самой старой открытой пишущей транзакции в основной БД и ещё на lag.
+        """
+        async with session_scope() as session:
+            oldest = await session.scalar(text(
+                "SELECT coalesce(max(clock_timestamp() - xact_start), interval '0') "
+                "FROM pg_stat_activity WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()"
+            ))
+        return tz_now_naive() - oldest - lag
+
+
+export_watermark_crud = ExportWatermarkRepository()
@@ -1,24 +1,59 @@
-from typing import Optional
+from datetime import datetime
+from typing import Any, Optional, Sequence
 
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func, or_
 
-from src.data.repositories.base_repository import CRUDRepository, async_session
-from src.data.models import NetPromoterScore, AssessmentOfQuality, User
+from src.data.db import session_scope
+from src.data.repositories.ratingRollup_repository import RolledUpRepository, rating_rollup_crud, NPS_COLUMNS
+from src.data.models import NetPromoterScore, AssessmentOfQuality, Specialist, User
 
 
-class NetPromoterScoreRepository(CRUDRepository[NetPromoterScore]):
+class NetPromoterScoreRepository(RolledUpRepository[NetPromoterScore]):
+    rollup_columns = frozenset({"aoq_id", "score", "created_at"})
+    rollup_measures = NPS_COLUMNS
+
     def __init__(self):
         super().__init__(NetPromoterScore)
 
-    async def get_list_with_relations(self):
-        async with async_session() as session:
-            stmt = select(NetPromoterScore)
-            stmt = stmt.options(
-                selectinload(NetPromoterScore.user).selectinload(User.socialsubcategory),
-                selectinload(NetPromoterScore.aoq).selectinload(AssessmentOfQuality.specialist),
+    def _tracking(self, session, ids: Sequence[Any], new: bool = False):
+        return rating_rollup_crud.tracking(session, nps_ids=ids, new=new)
+
+    def export_statement(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """
+        NPS для выгрузки статистики: id оценки качества, специалист, пользователь,
+        балл, дата — в порядке создания.
+        since/until — только созданные или изменённые в [since, until) (выгрузка изменений).
+        """
+        stmt = (
+            select(
+                NetPromoterScore.aoq_id,
+                Specialist.fullname,
+                func.coalesce(User.full_name, User.username),
+                NetPromoterScore.score,
+                NetPromoterScore.created_at,
             )
-            result = await session.execute(stmt)
-            return result.scalars().all()
-    
+            .outerjoin(AssessmentOfQuality, AssessmentOfQuality.id == NetPromoterScore.aoq_id)
+            .outerjoin(Specialist, Specialist.id == AssessmentOfQuality.specialist_id)
+            .outerjoin(User, User.id == NetPromoterScore.user_id)
+            .order_by(NetPromoterScore.created_at, NetPromoterScore.id)
+        )
+        if since is not None:
+            stmt = stmt.where(or_(NetPromoterScore.created_at >= since, NetPromoterScore.modified_at >= since))
+        if until is not None:
+            stmt = stmt.where(NetPromoterScore.created_at < until, NetPromoterScore.modified_at < until)
+        return stmt
+
+    async def create(self, **data: Any) -> NetPromoterScore:
+        """
+        Создаёт NPS вместе со строкой дневной сводки в одной транзакции.
+        """
+        async with session_scope(write=True) as session:
+            instance = NetPromoterScore(**data)
+            session.add(instance)
+            await session.flush()
+            await rating_rollup_crud.record_nps(session, instance)
+        self._notify_write([instance.id])
+        return instance
+
+
 nps_crud = NetPromoterScoreRepository()
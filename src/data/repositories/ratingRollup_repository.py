@@ -0,0 +1,420 @@
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from sqlalchemy import select, delete, update, func, literal, tuple_, cast, or_, text, Date, Uuid
+from sqlalchemy.dialects.postgresql import insert
+
+from src.data.db import session_scope, transaction, read_with_fallback
+from src.data.repositories.base_repository import CRUDRepository, ModelType, DELETE_CHUNK_SIZE
+from src.data.models import RatingDailyRollup, AssessmentOfQuality, NetPromoterScore, tz_now_naive
+
+KEY_COLUMNS = ("day", "specialist_id", "service_id", "social_subcategory_id")
+SCORE_BUCKETS = ("score_1", "score_2", "score_3", "score_4", "score_5")
+AOQ_MEASURES = ("aoq_count", "score_sum", *SCORE_BUCKETS)
+NPS_COLUMNS = ("nps_promoters", "nps_passives", "nps_detractors")
+MEASURES = (*AOQ_MEASURES, *NPS_COLUMNS)
+INSERT_COLUMNS = ("id", *KEY_COLUMNS, *MEASURES, "created_at", "modified_at")
+
+# NPS по шкале 1–5: 5 — промоутер, 4 — нейтральный, 1–3 — критик
+NPS_PROMOTER_MIN = 5
+NPS_PASSIVE_MIN = 4
+
+# Строк сводки в одном INSERT ... VALUES
+APPLY_CHUNK_SIZE = 1000
+
+# Ключ строки сводки (день, специалист, услуга, подкатегория) → показатели в порядке MEASURES
+Deltas = Dict[Tuple[date, str, Optional[str], Optional[str]], List[int]]
+
+
+def _nps_bucket(score: int) -> str:
+    if score >= NPS_PROMOTER_MIN:
+        return "nps_promoters"
+    if score >= NPS_PASSIVE_MIN:
+        return "nps_passives"
+    return "nps_detractors"
+
+
+def _chunks(ids: List[Any]):
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        yield ids[start:start + DELETE_CHUNK_SIZE]
+
+
+class RatingRollupRepository(CRUDRepository[RatingDailyRollup]):
+    def __init__(self):
+        super().__init__(RatingDailyRollup)
+
+    def _add_on_conflict(self, stmt):
+        """
+        ON CONFLICT по ключу сводки: показатели прибавляются к существующей строке.
+        """
+        table = RatingDailyRollup.__table__
+        return stmt.on_conflict_do_update(
+            index_elements=list(KEY_COLUMNS),
+            set_={
+                **{column: table.c[column] + stmt.excluded[column] for column in MEASURES},
+                "modified_at": stmt.excluded.modified_at,
+            },
+        )
+
+    def _increment(self, source):
+        """
+        INSERT ... SELECT, который прибавляет показатели к строке сводки с тем же ключом.
+        source возвращает колонки в порядке INSERT_COLUMNS.
+        """
+        return self._add_on_conflict(insert(RatingDailyRollup.__table__).from_select(list(INSERT_COLUMNS), source))
+
+    @staticmethod
+    def _uuid(value: Optional[str]):
+        return literal(value, Uuid(as_uuid=False))
+
+    def _aoq_source(self, *where):
+        """
+        Показатели оценок качества по ключам сводки (колонки в порядке INSERT_COLUMNS).
+        """
+        now = tz_now_naive()
+        aoq = AssessmentOfQuality
+        day = cast(aoq.created_at, Date)
+        return (
+            select(
+                func.gen_random_uuid(),
+                day, aoq.specialist_id, aoq.service_id, aoq.social_subcategory_id,
+                func.count(), func.sum(aoq.score),
+                *[func.count().filter(aoq.score == bucket) for bucket in range(1, 6)],
+                *[literal(0) for _ in NPS_COLUMNS],
+                literal(now), literal(now),
+            )
+            .where(*where)
+            .group_by(day, aoq.specialist_id, aoq.service_id, aoq.social_subcategory_id)
+        )
+
+    def _nps_source(self, *where):
+        """
+        Показатели NPS по ключам сводки: специалист, услуга и подкатегория — из его оценки качества.
+        """
+        now = tz_now_naive()
+        aoq = AssessmentOfQuality
+        nps = NetPromoterScore
+        day = cast(nps.created_at, Date)
+        return (
+            select(
+                func.gen_random_uuid(),
+                day, aoq.specialist_id, aoq.service_id, aoq.social_subcategory_id,
+                *[literal(0) for _ in AOQ_MEASURES],
+                func.count().filter(nps.score >= NPS_PROMOTER_MIN),
+                func.count().filter(nps.score >= NPS_PASSIVE_MIN, nps.score < NPS_PROMOTER_MIN),
+                func.count().filter(nps.score < NPS_PASSIVE_MIN),
+                literal(now), literal(now),
+            )
+            .select_from(nps)
+            .join(aoq, aoq.id == nps.aoq_id)
+            .where(*where)
+            .group_by(day, aoq.specialist_id, aoq.service_id, aoq.social_subcategory_id)
+        )
+
+    async def record_aoq(self, session, aoq: AssessmentOfQuality) -> None:
+        """
+        Добавляет оценку в сводку в транзакции сессии, в которой она создана.
+        """
+        key = (aoq.created_at.date(), aoq.specialist_id, aoq.service_id, aoq.social_subcategory_id)
+        measures = [1, aoq.score, *[int(aoq.score == bucket) for bucket in range(1, 6)], *[0 for _ in NPS_COLUMNS]]
+        await self.apply(session, {key: measures})
+
+    async def record_nps(self, session, nps: NetPromoterScore) -> None:
+        """
+        Добавляет NPS в сводку (ключ — специалист, услуга и подкатегория его оценки качества).
+        """
+        now = tz_now_naive()
+        bucket = _nps_bucket(nps.score)
+        aoq = AssessmentOfQuality
+        source = (
+            select(
+                func.gen_random_uuid(),
+                literal(nps.created_at.date(), Date),
+                aoq.specialist_id, aoq.service_id, aoq.social_subcategory_id,
+                *[literal(0) for _ in AOQ_MEASURES],
+                *[literal(int(column == bucket)) for column in NPS_COLUMNS],
+                literal(now),
+                literal(now),
+            )
+            .where(aoq.id == nps.aoq_id)
+        )
+        await session.execute(self._increment(source))
+
+    async def apply(self, session, deltas: Deltas) -> None:
+        """
+        Прибавляет к сводке показатели со знаком; строки, в которых не осталось
+        ни оценок, ни NPS, удаляются.
+        """
+        rows = [(key, measures) for key, measures in deltas.items() if any(measures)]
+        if not rows:
+            return
+        # Один порядок ключей во всех транзакциях — без взаимоблокировок на строках сводки
+        rows.sort(key=lambda row: tuple("" if part is None else str(part) for part in row[0]))
+        now = tz_now_naive()
+        for start in range(0, len(rows), APPLY_CHUNK_SIZE):
+            values = [
+                {"id": str(uuid4()), **dict(zip(KEY_COLUMNS, key)), **dict(zip(MEASURES, measures)),
+                 "created_at": now, "modified_at": now}
+                for key, measures in rows[start:start + APPLY_CHUNK_SIZE]
+            ]
+            await session.execute(self._add_on_conflict(insert(RatingDailyRollup.__table__).values(values)))
+
+        if any(value < 0 for _, measures in rows for value in measures):
+            rollup = RatingDailyRollup
+            stmt = (
+                delete(rollup)
+                .where(rollup.day.in_({key[0] for key, _ in rows}), *[getattr(rollup, column) == 0 for column in MEASURES])
+                .execution_options(synchronize_session=False)
+            )
+            await session.execute(stmt)
+
+    async def _lock(self, session, aoq_ids: List[Any], nps_ids: List[Any]) -> None:
+        """
+        Блокирует оценки и их NPS до конца транзакции: параллельная запись
+        не изменит их вклад в сводку между подсчётами «до» и «после».
+        """
+        aoq, nps = AssessmentOfQuality, NetPromoterScore
+        for chunk in _chunks(aoq_ids):
+            await session.execute(select(aoq.id).where(aoq.id.in_(chunk)).with_for_update())
+            await session.execute(select(nps.id).where(nps.aoq_id.in_(chunk)).with_for_update())
+        for chunk in _chunks(nps_ids):
+            await session.execute(select(nps.id).where(nps.id.in_(chunk)).with_for_update())
+
+    async def _contributions(self, session, aoq_ids: List[Any], nps_ids: List[Any]) -> Deltas:
+        """
+        Вклад строк в сводку: оценки aoq_ids вместе с их NPS и NPS nps_ids.
+        """
+        aoq, nps = AssessmentOfQuality, NetPromoterScore
+        sources = []
+        for chunk in _chunks(aoq_ids):
+            sources += [self._aoq_source(aoq.id.in_(chunk)), self._nps_source(nps.aoq_id.in_(chunk))]
+        for chunk in _chunks(nps_ids):
+            sources.append(self._nps_source(nps.id.in_(chunk)))
+
+        totals: Deltas = {}
+        for source in sources:
+            for row in (await session.execute(source)).all():
+                total = totals.setdefault(tuple(row[1:1 + len(KEY_COLUMNS)]), [0] * len(MEASURES))
+                for i, value in enumerate(row[1 + len(KEY_COLUMNS):1 + len(KEY_COLUMNS) + len(MEASURES)]):
+                    total[i] += value
+        return totals
+
+    @asynccontextmanager
+    async def tracking(
+        self, session, aoq_ids: Sequence[Any] = (), nps_ids: Sequence[Any] = (), new: bool = False
+    ) -> AsyncIterator[None]:
+        """
+        Правит сводку под запись оценок внутри блока: вклад затронутых строк (оценок aoq_ids
+        с их NPS и NPS nps_ids) считается до и после блока, разница прибавляется со знаком
+        в той же транзакции. new=True — строк ещё нет, вклад «до» не считается.
+        """
+        aoq_ids, nps_ids = list(aoq_ids), list(nps_ids)
+        before: Deltas = {}
+        if not new:
+            await self._lock(session, aoq_ids, nps_ids)
+            before = await self._contributions(session, aoq_ids, nps_ids)
+        yield
+        deltas = await self._contributions(session, aoq_ids, nps_ids)
+        for key, measures in before.items():
+            total = deltas.setdefault(key, [0] * len(MEASURES))
+            for i, value in enumerate(measures):
+                total[i] -= value
+        await self.apply(session, deltas)
+
+    async def clear(self, session, columns: Sequence[str]) -> None:
+        """
+        Обнуляет показатели columns во всей сводке (удалены все оценки качества или все NPS)
+        и удаляет опустевшие строки.
+        """
+        rollup = RatingDailyRollup
+        await session.execute(
+            update(rollup)
+            .where(or_(*[getattr(rollup, column) != 0 for column in columns]))
+            .values({column: 0 for column in columns})
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(
+            delete(rollup)
+            .where(*[getattr(rollup, column) == 0 for column in MEASURES])
+            .execution_options(synchronize_session=False)
+        )
+
+    async def detach_services(self, session, service_ids: Optional[Sequence[Any]] = None) -> None:
+        """
+        Переносит показатели удалённых услуг в строки без услуги — как и их оценки
+        (ON DELETE SET NULL). service_ids=None — все услуги. Вызывается после удаления услуг
+        в той же транзакции: новые оценки по ним уже не появятся.
+        """
+        rollup = RatingDailyRollup
+        if service_ids is None:
+            condition = rollup.service_id.is_not(None)
+        else:
+            condition = rollup.service_id.in_(list(service_ids))
+        moved = delete(rollup).where(condition).returning(
+            rollup.day, rollup.specialist_id, rollup.social_subcategory_id, *[getattr(rollup, column) for column in MEASURES]
+        ).cte("moved")
+        now = tz_now_naive()
+        source = (
+            select(
+                func.gen_random_uuid(),
+                moved.c.day, moved.c.specialist_id, self._uuid(None), moved.c.social_subcategory_id,
+                *[func.sum(moved.c[column]) for column in MEASURES],
+                literal(now), literal(now),
+            )
+            .group_by(moved.c.day, moved.c.specialist_id, moved.c.social_subcategory_id)
+        )
+        await session.execute(self._increment(source))
+
+    def backfill_statements(self) -> list:
+        """
+        Заполнение сводки по всем оценкам: очистка и два INSERT ... SELECT ... GROUP BY.
+        Блокировка таблицы дожидается транзакций, которые уже пишут в сводку, и не даёт
+        новым прибавить оценку, попавшую в пересчёт, второй раз. Сканирует все оценки —
+        только для миграций и команды rollups, текущие записи правят сводку сами (см. tracking).
+        """
+        return [
+            text(f"LOCK TABLE {RatingDailyRollup.__tablename__} IN EXCLUSIVE MODE"),
+            delete(RatingDailyRollup),
+            self._increment(self._aoq_source()),
+            self._increment(self._nps_source()),
+        ]
+
+    async def backfill(self) -> int:
+        """
+        Пересчитывает сводку по всем оценкам. Возвращает число строк сводки.
+        """
+        async with session_scope(write=True) as session:
+            for stmt in self.backfill_statements():
+                await session.execute(stmt)
+            result = await session.execute(select(func.count()).select_from(RatingDailyRollup))
+            rows = result.scalar_one()
+        self._notify_write()
+        return rows
+
+    async def score_windows(
+        self, since: Sequence[date], until: Optional[date] = None
+    ) -> List[Tuple[str, Optional[str], List[Tuple[int, Optional[float], int]]]]:
+        """
+        Оценки за несколько окон (дни с since[i] по until включительно) одним запросом
+        по сводке: GROUPING SETS по специалисту, по услуге и итог, окна — агрегаты с FILTER.
+        Возвращает [(группа "specialist" | "service" | "total", id или None,
+        [(число оценок, средний балл, число NPS) по окнам])].
+        """
+        rollup = RatingDailyRollup
+        nps_count = rollup.nps_promoters + rollup.nps_passives + rollup.nps_detractors
+        aggregates = []
+        for window_start in since:
+            in_window = rollup.day >= window_start
+            aggregates += [
+                func.sum(rollup.aoq_count).filter(in_window),
+                func.sum(rollup.score_sum).filter(in_window),
+                func.sum(nps_count).filter(in_window),
+            ]
+        stmt = select(
+            func.grouping(rollup.specialist_id),
+            func.grouping(rollup.service_id),
+            rollup.specialist_id,
+            rollup.service_id,
+            *aggregates,
+        ).where(rollup.day >= min(since))
+        if until is not None:
+            stmt = stmt.where(rollup.day <= until)
+        stmt = stmt.group_by(func.grouping_sets(
+            tuple_(rollup.specialist_id),
+            tuple_(rollup.service_id),
+            tuple_(),
+        ))
+        async def query(session) -> List[Any]:
+            return (await session.execute(stmt)).all()
+
+        rows = await read_with_fallback(query)
+
+        windows = []
+        for by_specialist, by_service, specialist_id, service_id, *values in rows:
+            if not by_specialist:
+                group, key = "specialist", specialist_id
+            elif not by_service:
+                group, key = "service", service_id
+            else:
+                group, key = "total", None
+            stats = []
+            for i in range(0, len(values), 3):
+                count, score_sum, nps = (int(value or 0) for value in values[i:i + 3])
+                stats.append((count, score_sum / count if count else None, nps))
+            windows.append((group, str(key) if key is not None else None, stats))
+        return windows
+
+
+rating_rollup_crud = RatingRollupRepository()
+
+
+class RolledUpRepository(CRUDRepository[ModelType]):
+    """
+    Репозиторий оценок, по которым ведётся дневная сводка: пакетные записи, изменения
+    и удаления правят её разницей вклада затронутых строк в той же транзакции.
+    """
+    # Колонки, от которых зависит сводка, и показатели сводки из этой таблицы
+    rollup_columns: frozenset = frozenset()
+    rollup_measures: Tuple[str, ...] = ()
+
+    def _tracking(self, session, ids: Sequence[Any], new: bool = False):
+        raise NotImplementedError
+
+    async def _ids(self, session, **filters: Any) -> List[Any]:
+        return list((await session.execute(select(self.model.id).filter_by(**filters))).scalars().all())
+
+    async def create_many(self, rows: Sequence[Dict[str, Any]]) -> List[Any]:
+        rows = self._with_defaults(rows)
+        async with transaction() as session:
+            async with self._tracking(session, [row["id"] for row in rows], new=True):
+                return await super().create_many(rows)
+
+    async def upsert_many(self, rows: Sequence[Dict[str, Any]], conflict_cols: Sequence[str]) -> List[Any]:
+        rows = self._with_defaults(rows)
+        keys = [tuple(row[col] for col in conflict_cols) for row in rows]
+        columns = tuple_(*[getattr(self.model, col) for col in conflict_cols])
+        async with transaction() as session:
+            # Строки, которые upsert может изменить: существующие с теми же ключами и новые
+            ids = [row["id"] for row in rows]
+            for start in range(0, len(keys), DELETE_CHUNK_SIZE):
+                stmt = select(self.model.id).where(columns.in_(keys[start:start + DELETE_CHUNK_SIZE]))
+                ids += (await session.execute(stmt)).scalars().all()
+            async with self._tracking(session, ids):
+                return await super().upsert_many(rows, conflict_cols)
+
+    async def update(self, filters: Dict[str, Any], updates: Dict[str, Any]) -> int:
+        if not self.rollup_columns & updates.keys():
+            return await super().update(filters, updates)
+
+        updated = 0
+        async with transaction() as session:
+            ids = await self._ids(session, **filters)
+            async with self._tracking(session, ids):
+                for chunk in _chunks(ids):
+                    stmt = (
+                        update(self.model)
+                        .where(self.model.id.in_(chunk))
+                        .values(**updates)
+                        .execution_options(synchronize_session=False)
+                    )
+                    updated += (await session.execute(stmt)).rowcount
+            self._notify_write(ids)
+        return updated
+
+    async def delete(self, **filters: Any) -> int:
+        async with transaction() as session:
+            return await self.delete_many(await self._ids(session, **filters))
+
+    async def delete_many(self, ids: Sequence[Any]) -> int:
+        ids = list(ids)
+        async with transaction() as session:
+            async with self._tracking(session, ids):
+                return await super().delete_many(ids)
+
+    async def delete_all(self) -> int:
+        async with transaction() as session:
+            rowcount = await super().delete_all()
+            await rating_rollup_crud.clear(session, self.rollup_measures)
+        return rowcount
@@ -1,13 +1,37 @@
-from typing import Optional
-
-
+from typing import Any, Sequence
+from sqlalchemy import select
 
+from src.data.db import transaction
 from src.data.repositories.base_repository import CRUDRepository
+from src.data.repositories.ratingRollup_repository import rating_rollup_crud
 from src.data.models import Service
 
 class ServiceRepository(CRUDRepository[Service]):
     def __init__(self):
         super().__init__(Service)
 
+    # Удаление услуги обнуляет service_id в оценках (ON DELETE SET NULL) —
+    # в той же транзакции её строки сводки переносятся в строки без услуги
+
+    async def delete(self, **filters: Any) -> int:
+        async with transaction() as session:
+            ids = (await session.execute(select(Service.id).filter_by(**filters))).scalars().all()
+            return await self.delete_many(ids)
+
+    async def delete_many(self, ids: Sequence[Any]) -> int:
+        ids = list(ids)
+        async with transaction() as session:
+            deleted = await super().delete_many(ids)
+            if deleted:
+                await rating_rollup_crud.detach_services(session, ids)
+        return deleted
+
+    async def delete_all(self) -> int:
+        async with transaction() as session:
+            rowcount = await super().delete_all()
+            if rowcount:
+                await rating_rollup_crud.detach_services(session)
+        return rowcount
+
 
 service_crud = ServiceRepository()
@@ -1,9 +1,20 @@
-from typing import Optional, List
-from sqlalchemy import select, distinct
+import os
+from typing import Any, Optional, List, Set, Tuple
+from sqlalchemy import select, distinct, func, String, cast, literal, tuple_, or_
 
 from src.data.repositories.base_repository import CRUDRepository
-from src.data.models import Specialist
-from src.data.db import async_session
+from src.data.models import Specialist, search_fold, specialist_search_document
+from src.data.db import session_scope
+
+
+# Порог word_similarity: ниже — строка не считается совпадением (опечатки допускаются)
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv("SPECIALIST_SEARCH_THRESHOLD", "0.4"))
+SEARCH_COLUMNS = ("id", "fullname", "position", "organization")
+
+
+def _like_pattern(query: str) -> str:
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
 
 
 class SpecialistRepository(CRUDRepository[Specialist]):
@@ -14,10 +25,134 @@ class SpecialistRepository(CRUDRepository[Specialist]):
         """
         Возвращает список уникальных организаций.
         """
-        async with async_session() as session:
+        async with session_scope() as session:
             stmt = select(distinct(Specialist.organization)).order_by(Specialist.organization)
             result = await session.execute(stmt)
             return [org for org in result.scalars().all() if org]
+
+    async def get_organizations(self) -> List[Tuple[str, str]]:
+        """
+        Уникальные организации по алфавиту, каждой сопоставлен id одного из её
+        специалистов (ключ в callback_data).
+        Возвращает [(организация, id специалиста)].
+        """
+        stmt = (
+            select(Specialist.organization, func.min(cast(Specialist.id, String)))
+            .where(Specialist.organization != "")
+            .group_by(Specialist.organization)
+            .order_by(Specialist.organization)
+        )
+        async with session_scope() as session:
+            result = await session.execute(stmt)
+            return [tuple(row) for row in result.all()]
+
+    async def get_organization(self, specialist_id: str) -> Optional[str]:
+        """
+        Возвращает организацию специалиста по его id.
+        """
+        async with session_scope() as session:
+            stmt = select(Specialist.organization).where(Specialist.id == specialist_id)
+            result = await session.execute(stmt)
+            return result.scalar_one_or_none()
+
+    def _search_filter(self, query: str):
+        """
+        Совпадение подстрокой или по триграммам (с опечатками);
+        оба условия обслуживаются индексом ix_specialists_search_trgm.
+        """
+        return or_(
+            specialist_search_document.like(_like_pattern(query)),
+            literal(query).op("<%")(specialist_search_document),
+        )
+
+    async def _set_search_threshold(self, session) -> None:
+        await session.execute(
+            select(func.set_config("pg_trgm.word_similarity_threshold", str(SEARCH_SIMILARITY_THRESHOLD), True))
+        )
+
+    async def search(
+        self,
+        query: str,
+        limit: int = 10,
+        after: Optional[str] = None,
+        before: Optional[str] = None,
+    ) -> Tuple[List[Any], bool]:
+        """
+        Поиск специалистов по ФИО, должности и организации без учёта регистра и ё/е.
+        Результаты упорядочены по похожести на запрос (затем по ФИО),
+        after/before — id строки, после/перед которой начинается страница.
+        Возвращает (строки с колонками SEARCH_COLUMNS, есть ли ещё в направлении листания).
+        """
+        query = search_fold(query.strip())
+        row_type, selected = self._projection(SEARCH_COLUMNS)
+        # Похожесть со знаком минус, чтобы весь ключ сортировки шёл по возрастанию
+        rank = -func.word_similarity(query, specialist_search_document)
+        columns = [rank, Specialist.fullname, Specialist.id]
+        key = after if after is not None else before
+
+        stmt = select(*selected).where(self._search_filter(query))
+        if key is not None:
+            boundary = tuple_(
+                *[select(column).where(Specialist.id == key).scalar_subquery() for column in columns[:-1]],
+                literal(key, Specialist.id.type),
+            )
+            stmt = stmt.where(tuple_(*columns) > boundary if after is not None else tuple_(*columns) < boundary)
+        stmt = stmt.order_by(*[column.desc() for column in columns] if before is not None else columns)
+
+        async with session_scope() as session:
+            await self._set_search_threshold(session)
+            result = await session.execute(stmt.limit(limit + 1))
+            items = [row_type(*row) for row in result.all()]
+
+        if key is not None and not items:
+            # Граничная строка удалена — начинаем с первой страницы
+            return await self.search(query, limit)
+
+        has_more = len(items) > limit
+        items = items[:limit]
+        if before is not None:
+            items.reverse()
+        return items, has_more
+
+    async def search_ids(self, query: str, limit: int) -> List[str]:
+        """
+        id первых limit найденных специалистов в порядке search.
+        query уже нормализован (SearchCache.normalize) — повторно не сворачивается.
+        """
+        rank = -func.word_similarity(query, specialist_search_document)
+        stmt = (
+            select(Specialist.id)
+            .where(self._search_filter(query))
+            .order_by(rank, Specialist.fullname, Specialist.id)
+            .limit(limit)
+        )
+        async with session_scope() as session:
+            await self._set_search_threshold(session)
+            result = await session.execute(stmt)
+            return [str(specialist_id) for specialist_id in result.scalars().all()]
+
+    async def search_count(self, query: str) -> int:
+        """
+        Число специалистов, найденных search.
+        """
+        query = search_fold(query.strip())
+        async with session_scope() as session:
+            await self._set_search_threshold(session)
+            stmt = select(func.count()).select_from(Specialist).where(self._search_filter(query))
+            result = await session.execute(stmt)
+            return result.scalar_one()
+
+    async def get_natural_keys(self) -> Set[Tuple[str, Optional[str], str, Optional[str]]]:
+        """
+        Возвращает множество (организация, должность, ФИО, отдел) всех специалистов.
+        Используется при импорте, чтобы не проверять каждую строку отдельным запросом.
+        """
+        async with session_scope() as session:
+            stmt = select(
+                Specialist.organization, Specialist.position, Specialist.fullname, Specialist.department
+            )
+            result = await session.execute(stmt)
+            return {tuple(row) for row in result.all()}
     
     
 specialist_crud = SpecialistRepository()
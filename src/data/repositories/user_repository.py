@@ -1,12 +1,234 @@
-from typing import Optional
+import os
+from typing import Optional, Any, Dict, List, Sequence
 
+from cachetools import TTLCache
+from sqlalchemy import update, delete, func
+
+from src.data.db import session_scope, on_rollback
 from src.data.repositories.base_repository import CRUDRepository
-from src.data.models import User
+from src.data.models import User, UserRole
+
+
+def profile_hash(username: str, full_name: Optional[str]) -> int:
+    """
+    Хэш профиля Telegram, по которому решаем, нужно ли обновлять пользователя.
+    """
+    return hash((username, full_name))
+
+
+class UserSnapshot:
+    """
+    Компактный снимок пользователя для кэша. Не привязан к сессии.
+    """
+    __slots__ = ("id", "tg_id", "username", "full_name", "role", "social_subcategory_id", "profile_hash")
+
+    def __init__(self, id: str, tg_id: int, username: str, full_name: Optional[str],
+                 role: UserRole, social_subcategory_id: Optional[str]):
+        self.id = id
+        self.tg_id = tg_id
+        self.username = username
+        self.full_name = full_name
+        self.role = role
+        self.social_subcategory_id = social_subcategory_id
+        self.profile_hash = profile_hash(username, full_name)
+
+    @classmethod
+    def from_model(cls, user: User) -> "UserSnapshot":
+        return cls(user.id, user.tg_id, user.username, user.full_name, user.role, user.social_subcategory_id)
+
+    def __repr__(self) -> str:
+        return f"UserSnapshot(tg_id={self.tg_id}, username={self.username!r}, role={self.role})"
+
+
+class UserCache:
+    """
+    LRU+TTL кэш снимков пользователей с индексами по tg_id и username.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.by_tg_id: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.by_username: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tg_id: int = None, username: str = None) -> Optional[UserSnapshot]:
+        snapshot = self.by_tg_id.get(tg_id) if tg_id is not None else self.by_username.get(username)
+        if snapshot is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return snapshot
+
+    def put(self, snapshot: UserSnapshot) -> UserSnapshot:
+        old = self.by_tg_id.get(snapshot.tg_id)
+        if old is not None and old.username != snapshot.username:
+            self.by_username.pop(old.username, None)
+        self.by_tg_id[snapshot.tg_id] = snapshot
+        if snapshot.username:
+            self.by_username[snapshot.username] = snapshot
+        return snapshot
+
+    def discard(self, tg_id: int) -> None:
+        snapshot = self.by_tg_id.pop(tg_id, None)
+        if snapshot is not None:
+            self.by_username.pop(snapshot.username, None)
+
+    def clear(self) -> None:
+        self.by_tg_id.clear()
+        self.by_username.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.by_tg_id),
+            "maxsize": self.by_tg_id.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
 
 
 class UserRepository(CRUDRepository[User]):
     def __init__(self):
         super().__init__(User)
+        self.cache = UserCache(
+            maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+        )
+
+    async def get_by_tg_id(self, tg_id: int) -> Optional[UserSnapshot]:
+        """
+        Возвращает снимок пользователя по tg_id, при промахе кэша — из БД.
+        """
+        snapshot = self.cache.get(tg_id=tg_id)
+        if snapshot is not None:
+            return snapshot
+
+        user = await self.get(tg_id=tg_id)
+        return self.cache.put(UserSnapshot.from_model(user)) if user else None
+
+    async def get_by_username(self, username: str) -> Optional[UserSnapshot]:
+        """
+        Возвращает снимок пользователя по username, при промахе кэша — из БД.
+        """
+        snapshot = self.cache.get(username=username)
+        if snapshot is not None:
+            return snapshot
+
+        user = await self.get(username=username)
+        return self.cache.put(UserSnapshot.from_model(user)) if user else None
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Счётчики попаданий/промахов кэша пользователей.
+        """
+        return self.cache.stats()
+
+    def _remember(self, snapshot: UserSnapshot) -> UserSnapshot:
+        """
+        Кладёт снимок в кэш; при откате unit of work запись будет сброшена.
+        """
+        on_rollback(lambda: self.cache.discard(snapshot.tg_id))
+        return self.cache.put(snapshot)
+
+    async def create(self, **data: Any) -> User:
+        """
+        Создает пользователя и сразу кладёт его снимок в кэш.
+        """
+        instance = await super().create(**data)
+        self._remember(UserSnapshot.from_model(instance))
+        return instance
+
+    async def upsert_profile(self, tg_id: int, username: str, full_name: Optional[str]) -> Optional[UserSnapshot]:
+        """
+        Регистрирует пользователя или обновляет его username/full_name одним запросом
+        (INSERT ... ON CONFLICT (tg_id) DO UPDATE ... WHERE изменилось).
+        Возвращает актуальный снимок пользователя.
+        """
+        async with session_scope(write=True) as session:
+            stmt = (
+                self._upsert_stmt(["tg_id"], {"tg_id": tg_id, "username": username, "full_name": full_name})
+                .returning(User)
+                .execution_options(populate_existing=True)
+            )
+            result = await session.execute(stmt)
+            user = result.scalars().first()
+            snapshot = UserSnapshot.from_model(user) if user else None
+        self._notify_write([snapshot.id] if snapshot else [])
+
+        if snapshot is None:
+            # Профиль в БД уже совпадает — перечитываем его без записи
+            self.cache.discard(tg_id)
+            return await self.get_by_tg_id(tg_id)
+        return self._remember(snapshot)
+
+    async def update(self, filters: Dict[str, Any], updates: Dict[str, Any]) -> int:
+        """
+        Обновляет пользователей и освежает их снимки в кэше.
+        Возвращает число затронутых строк.
+        """
+        return await self._update(update(User).filter_by(**filters), updates)
+
+    async def update_by_username(self, username: str, updates: Dict[str, Any]) -> int:
+        """
+        Обновляет пользователя по username без учёта регистра (индекс по lower(username)).
+        """
+        return await self._update(update(User).where(func.lower(User.username) == username.lower()), updates)
+
+    async def _update(self, stmt, updates: Dict[str, Any]) -> int:
+        async with session_scope(write=True) as session:
+            stmt = (
+                stmt
+                .values(**updates)
+                .returning(User)
+                .execution_options(synchronize_session="fetch", populate_existing=True)
+            )
+            result = await session.execute(stmt)
+            snapshots = [UserSnapshot.from_model(user) for user in result.scalars().all()]
+        self._notify_write([snapshot.id for snapshot in snapshots])
+        for snapshot in snapshots:
+            self._remember(snapshot)
+        return len(snapshots)
+
+    async def delete(self, **filters: Any) -> int:
+        """
+        Удаляет пользователей и убирает их из кэша.
+        Возвращает число удалённых строк.
+        """
+        async with session_scope(write=True) as session:
+            stmt = (
+                delete(User)
+                .filter_by(**filters)
+                .returning(User.tg_id)
+                .execution_options(synchronize_session="fetch")
+            )
+            tg_ids = (await session.execute(stmt)).scalars().all()
+        self._notify_write()
+        for tg_id in tg_ids:
+            self.cache.discard(tg_id)
+        return len(tg_ids)
+
+    async def create_many(self, rows: Sequence[Dict[str, Any]]) -> List[Any]:
+        ids = await super().create_many(rows)
+        self.cache.clear()
+        return ids
+
+    async def upsert_many(self, rows: Sequence[Dict[str, Any]], conflict_cols: Sequence[str]) -> List[Any]:
+        ids = await super().upsert_many(rows, conflict_cols)
+        self.cache.clear()
+        return ids
+
+    async def delete_many(self, ids: Sequence[Any]) -> int:
+        deleted = await super().delete_many(ids)
+        self.cache.clear()
+        return deleted
+
+    async def delete_all(self) -> int:
+        """
+        Удаляет всех пользователей и очищает кэш.
+        """
+        rowcount = await super().delete_all()
+        self.cache.clear()
+        return rowcount
 
 
 user_crud = UserRepository()
@@ -0,0 +1,113 @@
+import os
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from cachetools import TTLCache
+
+from src.data.models import search_fold
+from src.data.repositories.specialist_repository import specialist_crud
+
+# Больше результатов не кэшируется — такие запросы листаются keyset-поиском в БД
+SEARCH_CACHE_MAX_RESULTS = int(os.getenv("SEARCH_CACHE_MAX_RESULTS", "1000"))
+SEARCH_CACHE_QUERIES_PER_USER = int(os.getenv("SEARCH_CACHE_QUERIES_PER_USER", "5"))
+
+UUID_SIZE = 16
+
+
+class SearchResult:
+    """
+    id найденных специалистов в порядке выдачи, упакованные по 16 байт.
+    """
+    __slots__ = ("packed",)
+
+    def __init__(self, ids: Sequence[str]):
+        self.packed = b"".join(UUID(specialist_id).bytes for specialist_id in ids)
+
+    def __len__(self) -> int:
+        return len(self.packed) // UUID_SIZE
+
+    def _id(self, index: int) -> str:
+        return str(UUID(bytes=self.packed[index * UUID_SIZE:(index + 1) * UUID_SIZE]))
+
+    def _index(self, specialist_id: str) -> Optional[int]:
+        key = UUID(specialist_id).bytes
+        start = self.packed.find(key)
+        while start != -1 and start % UUID_SIZE:
+            start = self.packed.find(key, start + 1)
+        return start // UUID_SIZE if start != -1 else None
+
+    def page(self, after_key: Optional[str] = None, before_key: Optional[str] = None,
+             limit: int = 10) -> Tuple[List[str], bool]:
+        """
+        Страница id по тем же курсорам, что и page_from_list.
+        """
+        total = len(self)
+        after = self._index(after_key) if after_key is not None else None
+        before = self._index(before_key) if before_key is not None else None
+        if after is not None:
+            start, end = after + 1, min(total, after + 1 + limit)
+            has_more = end < total
+        elif before is not None:
+            start, end = max(0, before - limit), before
+            has_more = start > 0
+        else:
+            start, end = 0, min(total, limit)
+            has_more = total > limit
+        return [self._id(index) for index in range(start, end)], has_more
+
+
+class SearchCache:
+    """
+    Результаты поиска специалистов по пользователям: для каждого пользователя
+    последние SEARCH_CACHE_QUERIES_PER_USER запросов (LRU), ключ — нормализованный запрос.
+    Пользователи вытесняются по TTL и по размеру кэша. Любая запись в таблицу
+    специалистов очищает кэш; результат поиска, начатого до записи, не кэшируется.
+    """
+    def __init__(self):
+        self.users: TTLCache = TTLCache(
+            maxsize=int(os.getenv("SEARCH_CACHE_USERS", "1000")),
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", "600")),
+        )
+        # Номер сброса, как в AnalyticsCache
+        self._version = 0
+        specialist_crud.add_write_listener(self.invalidate)
+
+    def invalidate(self, ids: Optional[Sequence[Any]] = None) -> None:
+        self._version += 1
+        self.users.clear()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return search_fold(" ".join(query.split()))
+
+    async def get(self, user_id: int, query: str) -> Optional[SearchResult]:
+        """
+        Результаты поиска из кэша или из БД. None — результатов больше
+        SEARCH_CACHE_MAX_RESULTS, их нужно листать через specialist_crud.search.
+        """
+        key = self.normalize(query)
+        queries = self.users.get(user_id)
+        if queries is not None and key in queries:
+            queries.move_to_end(key)
+            return queries[key]
+
+        version = self._version
+        ids = await specialist_crud.search_ids(key, SEARCH_CACHE_MAX_RESULTS + 1)
+        if len(ids) > SEARCH_CACHE_MAX_RESULTS:
+            return None
+
+        result = SearchResult(ids)
+        if version != self._version:
+            # Пока шёл запрос, специалисты изменились: ответ отдаём, но не кэшируем
+            return result
+        # Заново кладём пользователя, чтобы продлить TTL
+        queries = self.users.pop(user_id, None) or OrderedDict()
+        queries[key] = result
+        while len(queries) > SEARCH_CACHE_QUERIES_PER_USER:
+            queries.popitem(last=False)
+        self.users[user_id] = queries
+        return result
+
+
+search_cache = SearchCache()
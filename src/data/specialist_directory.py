@@ -0,0 +1,246 @@
+import sys
+import asyncio
+import bisect
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from src.data.repositories.base_repository import projection_type
+from src.data.repositories.specialist_repository import specialist_crud
+from src.utils.misc.bot_logging import bot_logger
+
+
+CARD_COLUMNS = ("id", "fullname", "position", "organization", "department", "link", "qr")
+SpecialistRow = projection_type("Specialist", CARD_COLUMNS)
+
+# Доля удалённых строк, после которой колонки пересобираются без пропусков
+COMPACT_RATIO = 0.25
+
+
+class SpecialistDirectory:
+    """
+    Справочник специалистов в памяти по колонкам: списки id, ФИО, должностей,
+    организаций, отделов, ссылок и file_id QR-кодов, где строка — позиция в списках.
+    Индексы: id → строка и организация → строки в порядке ФИО.
+    Загружается при запуске; запись в таблицу специалистов помечает изменённые id,
+    они перечитываются одним запросом при следующем обращении. Записи других процессов
+    находит периодическая проверка refresh.
+    """
+    def __init__(self):
+        self.ids: List[Optional[str]] = []
+        self.fullnames: List[Optional[str]] = []
+        self.positions: List[Optional[str]] = []
+        self.organizations: List[Optional[str]] = []
+        self.departments: List[Optional[str]] = []
+        self.links: List[Optional[str]] = []
+        self.qrs: List[Optional[str]] = []
+        self.row_by_id: Dict[str, int] = {}
+        self.rows_by_organization: Dict[str, List[int]] = {}
+        self._sorted_rows: Optional[List[int]] = None
+        self._deleted = 0
+        self._loaded = False
+        # id, изменённые после загрузки; None — перечитать всё
+        self._pending: Optional[Set[str]] = set()
+        # Отпечаток таблицы на момент последней загрузки (write_stamp)
+        self._stamp: Optional[Tuple[Any, ...]] = None
+        self._lock = asyncio.Lock()
+
+        specialist_crud.add_write_listener(self.invalidate)
+
+    def invalidate(self, ids: Optional[Sequence[Any]] = None) -> None:
+        if ids is None or self._pending is None:
+            self._pending = None
+        else:
+            self._pending.update(str(specialist_id) for specialist_id in ids)
+
+    def _columns(self) -> Tuple[List[Any], ...]:
+        return self.ids, self.fullnames, self.positions, self.organizations, self.departments, self.links, self.qrs
+
+    def _sort_key(self, row: int) -> Tuple[str, str]:
+        return self.fullnames[row], self.ids[row]
+
+    async def load(self) -> None:
+        """
+        Загружает справочник целиком (при запуске бота).
+        """
+        # Отпечаток до чтения: запись между ними лишь вызовет ещё одну перезагрузку
+        self._stamp = await specialist_crud.write_stamp()
+        rows = await specialist_crud.list_projection(CARD_COLUMNS)
+        self._rebuild(rows)
+        self._loaded = True
+        stats = self.stats()
+        bot_logger.info(f"📇 Справочник специалистов: {stats['rows']} строк, {stats['memory_kb']} КБ")
+
+    def _rebuild(self, rows: Sequence[Any]) -> None:
+        for column in self._columns():
+            column.clear()
+        self.row_by_id = {}
+        self.rows_by_organization = {}
+        self._sorted_rows = None
+        self._deleted = 0
+        for row in rows:
+            self._append(row, sort=False)
+        for organization_rows in self.rows_by_organization.values():
+            organization_rows.sort(key=self._sort_key)
+
+    def _append(self, row: Any, sort: bool = True) -> None:
+        # Одинаковые названия организаций и должностей хранятся одной строкой
+        index = len(self.ids)
+        specialist_id = str(row.id)
+        self.ids.append(specialist_id)
+        self.fullnames.append(row.fullname)
+        self.positions.append(sys.intern(row.position) if row.position else row.position)
+        self.organizations.append(sys.intern(row.organization))
+        self.departments.append(sys.intern(row.department) if row.department else row.department)
+        self.links.append(row.link)
+        self.qrs.append(row.qr)
+        self.row_by_id[specialist_id] = index
+        rows = self.rows_by_organization.setdefault(self.organizations[index], [])
+        if sort:
+            bisect.insort(rows, index, key=self._sort_key)
+        else:
+            rows.append(index)
+
+    def _remove(self, index: int) -> None:
+        rows = self.rows_by_organization[self.organizations[index]]
+        del rows[bisect.bisect_left(rows, self._sort_key(index), key=self._sort_key)]
+        if not rows:
+            del self.rows_by_organization[self.organizations[index]]
+        del self.row_by_id[self.ids[index]]
+        for column in self._columns():
+            column[index] = None
+        self._deleted += 1
+
+    async def _ensure(self) -> None:
+        if self._loaded and self._pending is not None and not self._pending:
+            return
+        async with self._lock:
+            pending, self._pending = self._pending, set()
+            if not self._loaded or pending is None:
+                try:
+                    await self.load()
+                except Exception:
+                    self._pending = None
+                    raise
+                return
+            if not pending:
+                return
+            try:
+                rows = await specialist_crud.list_projection_by_ids(CARD_COLUMNS, list(pending))
+            except Exception:
+                self._pending = None
+                raise
+            # Изменённые строки удаляются и добавляются заново, удалённые из БД — только удаляются
+            for specialist_id in pending:
+                index = self.row_by_id.get(specialist_id)
+                if index is not None:
+                    self._remove(index)
+            for row in rows:
+                self._append(row)
+            self._sorted_rows = None
+            if self._deleted > len(self.ids) * COMPACT_RATIO:
+                self._compact()
+
+    async def refresh(self) -> None:
+        """
+        Проверка по расписанию: если таблица изменилась с последней загрузки (в том числе
+        другим процессом — переименование, удаление), справочник перечитывается целиком.
+        """
+        if not self._loaded:
+            return
+        if await specialist_crud.write_stamp() != self._stamp:
+            self.invalidate(None)
+            await self._ensure()
+
+    def _compact(self) -> None:
+        """
+        Пересобирает колонки без удалённых строк.
+        """
+        self._rebuild([self._row(index) for index in range(len(self.ids)) if self.ids[index] is not None])
+
+    def _row(self, index: int) -> Any:
+        return SpecialistRow(*(column[index] for column in self._columns()))
+
+    async def get(self, specialist_id: str) -> Optional[Any]:
+        """
+        Специалист по id (карточка, проверка ссылки из QR-кода) или None.
+        Если в справочнике его нет (запись из другого процесса), строка читается из БД
+        и добавляется в справочник.
+        """
+        await self._ensure()
+        specialist_id = str(specialist_id)
+        index = self.row_by_id.get(specialist_id)
+        if index is not None:
+            return self._row(index)
+
+        rows = await specialist_crud.list_projection_by_ids(CARD_COLUMNS, [specialist_id])
+        if not rows:
+            return None
+        async with self._lock:
+            # Пока шёл запрос, строку могла добавить перезагрузка или другой промах
+            if specialist_id not in self.row_by_id:
+                self._append(rows[0])
+                self._sorted_rows = None
+        return rows[0]
+
+    async def count(self, organization: Optional[str] = None) -> int:
+        await self._ensure()
+        if organization is None:
+            return len(self.row_by_id)
+        return len(self.rows_by_organization.get(organization, ()))
+
+    async def get_page(
+        self,
+        organization: Optional[str] = None,
+        after_key: Optional[str] = None,
+        before_key: Optional[str] = None,
+        limit: int = 10,
+    ) -> Tuple[List[Any], bool]:
+        """
+        Страница специалистов организации (или всех) в порядке ФИО.
+        after_key/before_key — id строки, после/перед которой начинается страница.
+        Возвращает (строки, есть ли ещё строки в направлении листания).
+        """
+        await self._ensure()
+        if organization is not None:
+            rows = self.rows_by_organization.get(organization, [])
+        else:
+            if self._sorted_rows is None:
+                self._sorted_rows = sorted(self.row_by_id.values(), key=self._sort_key)
+            rows = self._sorted_rows
+
+        key = after_key if after_key is not None else before_key
+        index = self.row_by_id.get(key) if key is not None else None
+        if index is not None and organization is not None and self.organizations[index] != organization:
+            index = None
+        if index is None:
+            page, has_more = rows[:limit], len(rows) > limit
+        else:
+            position = bisect.bisect_left(rows, self._sort_key(index), key=self._sort_key)
+            if after_key is not None:
+                page, has_more = rows[position + 1:position + 1 + limit], position + 1 + limit < len(rows)
+            else:
+                start = max(0, position - limit)
+                page, has_more = rows[start:position], start > 0
+        return [self._row(row) for row in page], has_more
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Размер справочника: число строк и память под колонки, индексы и строки (с учётом
+        того, что одинаковые строки хранятся один раз).
+        """
+        seen: Set[int] = set()
+        size = 0
+        for container in (*self._columns(), self.row_by_id, self.rows_by_organization):
+            size += sys.getsizeof(container)
+        for column in self._columns():
+            for value in column:
+                if value is not None and id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        for rows in self.rows_by_organization.values():
+            size += sys.getsizeof(rows)
+        # Номер строки — один объект int на строку, общий для обоих индексов
+        size += sum(sys.getsizeof(index) for index in self.row_by_id.values())
+        return {"rows": len(self.row_by_id), "memory_kb": round(size / 1024)}
+
+
+specialist_directory = SpecialistDirectory()
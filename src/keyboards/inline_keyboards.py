@@ -2,15 +2,62 @@ from typing import Any, Sequence, Callable, TypeVar, Optional
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from src.utils.const_functions import ikb
+from src.utils.const_functions import ikb, short_id, page_cursor, parse_page_cursor
 
-from src.data.repositories.socialCategory_repository import social_category_crud
-from src.data.repositories.socialSubcategory_repository import social_subcategory_crud
-from src.data.repositories.service_repository import service_crud
+from src.data.reference_data import reference_data
+from src.data.search_cache import search_cache
+from src.data.specialist_directory import specialist_directory
+from src.utils.statistics_export import EXPORT_FORMATS
 
 
 T = TypeVar("T")
 
+PER_PAGE = 10
+
+
+def pagination_buttons(
+    prefix: str,
+    first_id: Optional[str],
+    last_id: Optional[str],
+    has_more: bool,
+    after_key: Optional[str] = None,
+    before_key: Optional[str] = None,
+    suffix: str = "",
+) -> list:
+    """
+    Кнопки ⬅️/➡️ для keyset-пагинации: курсоры — id первой и последней строки страницы.
+    """
+    if first_id is None:
+        return []
+    if before_key is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after_key is not None, has_more
+
+    buttons = []
+    if has_prev:
+        buttons.append(ikb(text="⬅️", callback_data=f'{prefix}{page_cursor("p", first_id)}{suffix}'))
+    if has_next:
+        buttons.append(ikb(text="➡️", callback_data=f'{prefix}{page_cursor("n", last_id)}{suffix}'))
+    return buttons
+
+
+def page_from_list(items: Sequence[T], after_key: Optional[str] = None, before_key: Optional[str] = None,
+                   limit: int = PER_PAGE) -> tuple:
+    """
+    Страница уже загруженного списка (справочники, результаты поиска)
+    по тем же курсорам, что и specialist_directory.get_page.
+    """
+    ids = [str(item.id) for item in items]
+    if after_key is not None and after_key in ids:
+        start = ids.index(after_key) + 1
+        return list(items[start:start + limit]), start + limit < len(items)
+    if before_key is not None and before_key in ids:
+        end = ids.index(before_key)
+        start = max(0, end - limit)
+        return list(items[start:end]), start > 0
+    return list(items[:limit]), len(items) > limit
+
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup
 
@@ -20,9 +67,9 @@ async def social_category_actions_kb() -> InlineKeyboardMarkup:
     """
     Клавиатура для управления социальными категориями и подкатегориями.
     """
-    catergories = await social_category_crud.get_list()
+    categories = await reference_data.get_categories()
     
-    if len(catergories) > 0:
+    if len(categories) > 0:
         buttons = (
             ikb(text="Импорт категорий JSON", callback_data='import_categories'),
             ikb(text="Добавить категорию", callback_data='add_category'),
@@ -48,47 +95,36 @@ async def social_category_actions_kb() -> InlineKeyboardMarkup:
 async def social_category_selection_kb(
     _type: str, 
     action: str, 
-    page: int = 1, 
-    category_id: int = None
+    cursor: str = None, 
+    category_id: str = None
 ) -> InlineKeyboardMarkup:
     """
     Клавиатура для выбора социальной категории или подкатегории с пагинацией.
     """
-    per_page = 10
+    after_key, before_key = parse_page_cursor(cursor)
     if _type == "ctg":
-        categories = await social_category_crud.get_list()
+        categories = await reference_data.get_categories()
     else:
-        categories = await social_subcategory_crud.get_list(category_id=category_id)
+        categories = await reference_data.get_subcategories(category_id)
+    categories, has_more = page_from_list(categories, after_key, before_key)
 
-    total = len(categories)
-    start = (page - 1) * per_page
-    end = start + per_page
-    sliced = categories[start:end]
     builder = InlineKeyboardBuilder()
-    for category in sliced:
+    for category in categories:
         builder.row(
             ikb(
                 text=category.name, 
-                callback_data=f'select@{_type}:{category.id}_{action}'
+                callback_data=f'select@{_type}:{short_id(category.id)}_{action}'
             )
         )
 
     # --- пагинация ---
-    buttons = []
-    if page > 1:
-        buttons.append(
-            ikb(
-                text="⬅️", 
-                callback_data=f'change_page@{_type}:{page-1}_{action}_{category_id or 0}'
-            )
-        )
-    if end < total:
-        buttons.append(
-            ikb(
-                text="➡️", 
-                callback_data=f'change_page@{_type}:{page+1}_{action}_{category_id or 0}'
-            )
-        )
+    buttons = pagination_buttons(
+        f'pg@{_type}:',
+        categories[0].id if categories else None,
+        categories[-1].id if categories else None,
+        has_more, after_key, before_key,
+        suffix=f'_{action}_{short_id(category_id) if category_id else 0}',
+    )
     if buttons:
         builder.row(*buttons)
     builder.row(ikb(text="🏠 Главное меню", callback_data='main_menu'))
@@ -112,20 +148,17 @@ async def service_menu_kb() -> InlineKeyboardMarkup:
     builder.adjust(1)
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
-async def service_actions_kb(action: str, page: int = 1) -> InlineKeyboardMarkup:
+async def service_actions_kb(action: str, cursor: str = None) -> InlineKeyboardMarkup:
     """
     Клавиатура для действий с услугами с пагинацией.
     """
-    services = await service_crud.get_list()
-    per_page = 10
-    total = len(services)
-    start = (page - 1) * per_page
-    end = start + per_page
+    after_key, before_key = parse_page_cursor(cursor)
+    services, has_more = page_from_list(await reference_data.get_services(), after_key, before_key)
 
     builder = InlineKeyboardBuilder()
     
     # Кнопки для услуг на текущей странице
-    for service in services[start:end]:
+    for service in services:
         builder.row(
             ikb(
                 text=service.name, 
@@ -134,23 +167,14 @@ async def service_actions_kb(action: str, page: int = 1) -> InlineKeyboardMarkup
         )
 
     # --- пагинация ---
-    pagination_buttons = []
-    if page > 1:
-        pagination_buttons.append(
-            ikb(
-                text="⬅️",
-                callback_data=f'change_page@service:{action}_{page-1}'
-            )
-        )
-    if end < total:
-        pagination_buttons.append(
-            ikb(
-                text="➡️",
-                callback_data=f'change_page@service:{action}_{page+1}'
-            )
-        )
-    if pagination_buttons:
-        builder.row(*pagination_buttons)
+    buttons = pagination_buttons(
+        f'change_page@service:{action}_',
+        services[0].id if services else None,
+        services[-1].id if services else None,
+        has_more, after_key, before_key,
+    )
+    if buttons:
+        builder.row(*buttons)
 
     # Главная кнопка
     builder.row(ikb(text="🏠 Главное меню", callback_data='main_menu'))
@@ -228,47 +252,45 @@ async def export_specialists_kb():
     builder.adjust(1)
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
-async def organizations_list_kb(page: int = 1) -> InlineKeyboardMarkup:
+async def statistics_export_kb():
+    """
+    Клавиатура для выбора формата выгрузки статистики: только новое с прошлой выгрузки или всё.
+    """
+    builder = InlineKeyboardBuilder()
+    for export_format, label in EXPORT_FORMATS.items():
+        builder.row(
+            ikb(text=f"{label}: новое", callback_data=f'export_statistics:{export_format}:delta'),
+            ikb(text=f"{label}: всё", callback_data=f'export_statistics:{export_format}:full'),
+        )
+    return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
+
+async def organizations_list_kb(cursor: str = None) -> InlineKeyboardMarkup:
     """
     Клавиатура для списка организаций с пагинацией.
     """
-    from src.data.repositories.specialist_repository import specialist_crud
-    
-    organizations = await specialist_crud.get_unique_organizations()
-    per_page = 10
-    total = len(organizations)
-    start = (page - 1) * per_page
-    end = start + per_page
+    after_key, before_key = parse_page_cursor(cursor)
+    organizations, has_more = page_from_list(await reference_data.get_organizations(), after_key, before_key)
 
     builder = InlineKeyboardBuilder()
     
-    # Кнопки для организаций на текущей странице
-    for idx, org in enumerate(organizations[start:end], start=start):
+    # Кнопки для организаций на текущей странице: организация передаётся id одного из её специалистов
+    for org in organizations:
         builder.row(
             ikb(
-                text=org, 
-                callback_data=f'select_org:{idx}'
+                text=org.name, 
+                callback_data=f'select_org:{short_id(org.id)}'
             )
         )
 
     # --- пагинация ---
-    pagination_buttons = []
-    if page > 1:
-        pagination_buttons.append(
-            ikb(
-                text="⬅️",
-                callback_data=f'change_page@organizations:{page-1}'
-            )
-        )
-    if end < total:
-        pagination_buttons.append(
-            ikb(
-                text="➡️",
-                callback_data=f'change_page@organizations:{page+1}'
-            )
-        )
-    if pagination_buttons:
-        builder.row(*pagination_buttons)
+    buttons = pagination_buttons(
+        'change_page@organizations:',
+        organizations[0].id if organizations else None,
+        organizations[-1].id if organizations else None,
+        has_more, after_key, before_key,
+    )
+    if buttons:
+        builder.row(*buttons)
 
     # Кнопки навигации
     builder.row(ikb(text="🔙 Назад", callback_data='back_to_specialists_menu'))
@@ -276,56 +298,53 @@ async def organizations_list_kb(page: int = 1) -> InlineKeyboardMarkup:
 
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
-async def specialists_list_kb(organization: str = None, page: int = 1, specialists_list=None, search_query: str = None) -> InlineKeyboardMarkup:
+async def specialists_list_kb(organization: str = None, cursor: str = None, search_query: str = None,
+                              user_id: int = None) -> InlineKeyboardMarkup:
     """
     Клавиатура для списка специалистов с пагинацией.
+    С search_query страница — результаты поиска пользователя user_id (из кэша поиска,
+    строки — из справочника в памяти), иначе — специалисты организации (или все).
     """
     from src.data.repositories.specialist_repository import specialist_crud
     
-    if specialists_list is None:
-        if organization:
-            specialists = await specialist_crud.get_list(organization=organization)
+    after_key, before_key = parse_page_cursor(cursor)
+    if search_query:
+        result = await search_cache.get(user_id, search_query)
+        if result is not None:
+            ids, has_more = result.page(after_key, before_key, PER_PAGE)
+            specialists = [spec for spec in [await specialist_directory.get(spec_id) for spec_id in ids] if spec]
         else:
-            specialists = await specialist_crud.get_list()
+            specialists, has_more = await specialist_crud.search(
+                search_query, limit=PER_PAGE, after=after_key, before=before_key
+            )
     else:
-        specialists = specialists_list
-        
-    per_page = 10
-    total = len(specialists)
-    start = (page - 1) * per_page
-    end = start + per_page
+        specialists, has_more = await specialist_directory.get_page(
+            organization=organization, after_key=after_key, before_key=before_key, limit=PER_PAGE
+        )
 
     builder = InlineKeyboardBuilder()
     
     # Кнопки для специалистов на текущей странице
-    for spec in specialists[start:end]:
-        button_text = f"{spec.fullname} — {spec.position}"
+    current = cursor or ""
+    for spec in specialists:
+        button_text = f"{spec.fullname} — {spec.position}" if spec.position else spec.fullname
         # Используем только ID специалиста, остальное в state
         builder.row(
             ikb(
                 text=button_text, 
-                callback_data=f'vsc:{spec.id}:{page}'
+                callback_data=f'vsc:{short_id(spec.id)}:{current}'
             )
         )
 
     # --- пагинация ---
-    pagination_buttons = []
-    if page > 1:
-        pagination_buttons.append(
-            ikb(
-                text="⬅️",
-                callback_data=f'pg@s:{page-1}'
-            )
-        )
-    if end < total:
-        pagination_buttons.append(
-            ikb(
-                text="➡️",
-                callback_data=f'pg@s:{page+1}'
-            )
-        )
-    if pagination_buttons:
-        builder.row(*pagination_buttons)
+    buttons = pagination_buttons(
+        'pg@s:',
+        specialists[0].id if specialists else None,
+        specialists[-1].id if specialists else None,
+        has_more, after_key, before_key,
+    )
+    if buttons:
+        builder.row(*buttons)
 
     # Кнопки навигации
     if search_query:
@@ -338,13 +357,13 @@ async def specialists_list_kb(organization: str = None, page: int = 1, specialis
 
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
-async def specialist_card_kb(specialist_id: str, page: int = 1) -> InlineKeyboardMarkup:
+async def specialist_card_kb(specialist_id: str, cursor: str = None) -> InlineKeyboardMarkup:
     """
     Клавиатура для карточки специалиста.
     """
     builder = InlineKeyboardBuilder()
     
-    builder.row(ikb(text="🔙 К списку специалистов", callback_data=f'btsl:{page}'))
+    builder.row(ikb(text="🔙 К списку специалистов", callback_data=f'btsl:{cursor or ""}'))
     builder.row(ikb(text="🏠 Главное меню", callback_data='main_menu'))
     
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
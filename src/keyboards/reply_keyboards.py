@@ -1,12 +1,13 @@
 from aiogram.types import ReplyKeyboardMarkup
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
-from src.data.repositories.user_repository import user_crud
+from src.data.repositories.user_repository import UserSnapshot
 from src.utils.const_functions import rkb
 
-async def main_menu_kb(tg_id: int) -> ReplyKeyboardMarkup:
-    _user = await user_crud.get(tg_id=tg_id)
-    
+async def main_menu_kb(_user: UserSnapshot) -> ReplyKeyboardMarkup:
+    if _user is None:
+        return None
+
     builder = ReplyKeyboardBuilder()
     
     if _user.role == "moderator":
@@ -1,8 +1,10 @@
+import os
 from aiogram import Dispatcher
 
-from src.data.db import async_session
-
+from src.middlewares.instrumentation_middleware import InstrumentationMiddleware, HandlerTraceMiddleware
 from src.middlewares.error_logging_middleware import ErrorLoggingMiddleware
+from src.middlewares.unit_of_work_middleware import UnitOfWorkMiddleware, UnitOfWorkFlagMiddleware
+from src.middlewares.user_context_middleware import UserContextMiddleware
 from src.middlewares.user_middleware import ExistsUserMiddleware
 from src.middlewares.throttling_middleware import ThrottlingMiddleware
 from src.middlewares.ban_middleware import BanCheckMiddleware
@@ -10,17 +12,34 @@ from src.middlewares.main_admin_middleware import AdminCheckMiddleware
 
 
 def register_all_middlwares(dp: Dispatcher):
+    dp.update.outer_middleware(InstrumentationMiddleware())
+
     dp.callback_query.outer_middleware(ErrorLoggingMiddleware())
     dp.message.outer_middleware(ErrorLoggingMiddleware())
 
+    if os.getenv("DB_UNIT_OF_WORK", "0") == "1":
+        dp.callback_query.outer_middleware(UnitOfWorkMiddleware())
+        dp.message.outer_middleware(UnitOfWorkMiddleware())
+
+    dp.callback_query.outer_middleware(UserContextMiddleware())
+    dp.message.outer_middleware(UserContextMiddleware())
+
     dp.callback_query.outer_middleware(ExistsUserMiddleware())
     dp.message.outer_middleware(ExistsUserMiddleware())
     
     dp.callback_query.outer_middleware(AdminCheckMiddleware())
     dp.message.middleware(AdminCheckMiddleware())
 
-    dp.callback_query.outer_middleware(ThrottlingMiddleware())
-    dp.message.middleware(ThrottlingMiddleware())
+    throttling = ThrottlingMiddleware()
+    dp.callback_query.middleware(throttling)
+    dp.message.middleware(throttling)
 
     dp.callback_query.outer_middleware(BanCheckMiddleware())
     dp.message.middleware(BanCheckMiddleware())
+
+    if os.getenv("DB_UNIT_OF_WORK", "0") == "1":
+        dp.callback_query.middleware(UnitOfWorkFlagMiddleware())
+        dp.message.middleware(UnitOfWorkFlagMiddleware())
+
+    dp.callback_query.middleware(HandlerTraceMiddleware())
+    dp.message.middleware(HandlerTraceMiddleware())
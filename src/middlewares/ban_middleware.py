@@ -1,8 +1,6 @@
 from typing import Callable, Dict, Any, Union
 from aiogram import BaseMiddleware
-from aiogram.types import User, Message, CallbackQuery
-
-from src.data.repositories.user_repository import user_crud
+from aiogram.types import Message, CallbackQuery
 
 
 class BanCheckMiddleware(BaseMiddleware):
@@ -14,9 +12,7 @@ class BanCheckMiddleware(BaseMiddleware):
         event: Union[Message, CallbackQuery],
         data: Dict[str, Any],
     ) -> Any:
-        this_user: User = data.get("event_from_user")
-
-        user_ = await user_crud.get(tg_id=this_user.id)
+        user_ = data.get("user")
         if not user_:
             return await handler(event, data)
 
@@ -3,6 +3,7 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
 from src.utils.misc.bot_logging import bot_logger
+from src.utils.misc.metrics import metrics
 
 
 class ErrorLoggingMiddleware(BaseMiddleware):
@@ -15,6 +16,7 @@ class ErrorLoggingMiddleware(BaseMiddleware):
         try:
             return await handler(event, data)
         except Exception as e:
+            metrics.mark_error()
             bot_logger.exception(f"❌ Ошибка в хэндлере {getattr(handler, '__name__', repr(handler))}", exc_info=e)
             message = data.get("message")
             if message:
@@ -0,0 +1,72 @@
+import time
+from typing import Callable, Dict, Any
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from src.utils.misc.metrics import metrics, current_trace
+
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """
+    Самый внешний middleware: замеряет полное время обработки апдейта
+    и сохраняет его в гистограмму хэндлера.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        trace = metrics.start_update()
+        try:
+            return await handler(event, data)
+        except Exception:
+            trace.error = True
+            raise
+        finally:
+            metrics.finish_update(trace)
+
+
+class HandlerTraceMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware: запоминает имя выбранного хэндлера
+    и время выполнения его тела.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        trace = current_trace.get()
+        if trace is None:
+            return await handler(event, data)
+
+        handler_object = data.get("handler")
+        trace.handler = getattr(getattr(handler_object, "callback", None), "__name__", None) or repr(handler_object)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            trace.handler_ms += (time.perf_counter() - started) * 1000
+
+
+class ApiCallCounterMiddleware(BaseRequestMiddleware):
+    """
+    Считает вызовы Bot API и их длительность в рамках текущего апдейта.
+    """
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            metrics.record_api_call((time.perf_counter() - started) * 1000)
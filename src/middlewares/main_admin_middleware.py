@@ -1,8 +1,9 @@
 import os
 from typing import Callable, Dict, Any, Union
 from aiogram import BaseMiddleware
-from aiogram.types import User, Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery
 
+from src.data.models import UserRole
 from src.data.repositories.user_repository import user_crud
 
 
@@ -13,12 +14,12 @@ class AdminCheckMiddleware(BaseMiddleware):
         event: Union[Message, CallbackQuery],
         data: Dict[str, Any],
     ) -> Any:
-        this_user: User = data.get("event_from_user")
-        get_user = await user_crud.get(tg_id=this_user.id)
+        get_user = data.get("user")
         main_admin_id = int(os.getenv("ADMIN"))
 
-        if get_user.tg_id == main_admin_id and (get_user is None or get_user.role != "ADMIN"):
-            await user_crud.update(filters={"tg_id": this_user.id},
-                                    updates={"role": "ADMIN"})
+        if get_user is not None and get_user.tg_id == main_admin_id and get_user.role != UserRole.ADMIN:
+            await user_crud.update(filters={"tg_id": get_user.tg_id},
+                                    updates={"role": UserRole.ADMIN})
+            data["user"] = await user_crud.get_by_tg_id(get_user.tg_id)
 
         return await handler(event, data)
@@ -1,63 +1,241 @@
+import os
 import time
-from typing import Any, Awaitable, Callable, Dict, Union
+import heapq
+import struct
+from array import array
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
 
 from aiogram import BaseMiddleware
 from aiogram.dispatcher.flags import get_flag
-from aiogram.types import Message, User
-from cachetools import TTLCache
+from aiogram.types import Message, CallbackQuery, User
+
+
+class LocalBucketStore:
+    """
+    Состояние token bucket'ов в плоских массивах: один слот на пользователя.
+    """
+    def __init__(self, capacity: int = 100_000, idle_ttl: float = 600):
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self.slots: Dict[int, int] = {}
+        self.tokens = array("d", bytes(8 * capacity))
+        self.stamps = array("d", bytes(8 * capacity))
+        self.strikes = array("B", bytes(capacity))
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def _reclaim(self, now: float) -> None:
+        """
+        Освобождает слоты пользователей, которые давно не писали.
+        Если таких нет — вытесняет четверть самых старых.
+        """
+        stale = [key for key, slot in self.slots.items() if now - self.stamps[slot] > self.idle_ttl]
+        if not stale:
+            stale = heapq.nsmallest(
+                max(1, self.capacity // 4), self.slots, key=lambda key: self.stamps[self.slots[key]]
+            )
+        for key in stale:
+            self.free.append(self.slots.pop(key))
+
+    def consume(self, key: int, rate: float, burst: int, now: float) -> int:
+        """
+        Списывает токен. Возвращает 0, если событие пропускается,
+        иначе номер подряд идущего отказа.
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            if not self.free:
+                self._reclaim(now)
+            slot = self.free.pop()
+            self.slots[key] = slot
+            self.strikes[slot] = 0
+            tokens = float(burst)
+        else:
+            tokens = min(float(burst), self.tokens[slot] + (now - self.stamps[slot]) / rate)
+
+        self.stamps[slot] = now
+        if tokens >= 1:
+            self.tokens[slot] = tokens - 1
+            self.strikes[slot] = 0
+            return 0
+
+        self.tokens[slot] = tokens
+        strikes = min(self.strikes[slot] + 1, 255)
+        self.strikes[slot] = strikes
+        return strikes
+
+
+class SharedMemoryBucketStore:
+    """
+    Те же бакеты в разделяемой памяти, чтобы несколько процессов бота
+    соблюдали один общий лимит. Открытая адресация по tg_id.
+    Записи не защищены блокировкой: гонка двух процессов может пропустить
+    лишнее событие, но не ломает таблицу.
+
+    В заголовке сегмента — метка формата и число слотов: процесс с другим
+    THROTTLING_CAPACITY не подключится к чужой таблице, а получит ошибку.
+    Сегмент не привязан к процессу, который его создал (resource_tracker его
+    не удаляет), и живёт до close(unlink=True) или перезагрузки системы.
+    """
+    probe_limit = 16
+    # Метка формата и число слотов; 16 байт сохраняют выравнивание массивов
+    header = struct.Struct("<8sq")
+    magic = b"TBUCKET1"
+    # Сколько ждать, пока создавший сегмент процесс запишет заголовок
+    attach_timeout = 1.0
+
+    def __init__(self, name: str, capacity: int = 100_000):
+        size = 1
+        while size < capacity * 2:
+            size <<= 1
+        self.size = size
+        self.mask = size - 1
+        offset = self.header.size
+        nbytes = offset + size * (8 + 8 + 8 + 1)
+
+        try:
+            self.shm = self._open(name, create=True, size=nbytes)
+            self.header.pack_into(self.shm.buf, 0, self.magic, size)
+        except FileExistsError:
+            self.shm = self._open(name, create=False)
+            self._check_header(name)
+
+        buf = self.shm.buf
+        self.keys = buf[offset:offset + 8 * size].cast("q")
+        self.tokens = buf[offset + 8 * size:offset + 16 * size].cast("d")
+        self.stamps = buf[offset + 16 * size:offset + 24 * size].cast("d")
+        self.strikes = buf[offset + 24 * size:offset + 25 * size].cast("B")
+
+    def _open(self, name: str, create: bool, size: int = 0):
+        """
+        Сегмент без учёта в resource_tracker: иначе на выходе создавшего процесса
+        трекер удалит сегмент, которым ещё пользуются остальные.
+        """
+        from multiprocessing import shared_memory, resource_tracker
+
+        try:
+            # Python 3.13+
+            shm = shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+            self._untracked = False
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self._untracked = True
+        return shm
+
+    def _check_header(self, name: str) -> None:
+        deadline = time.monotonic() + self.attach_timeout
+        while True:
+            if len(self.shm.buf) >= self.header.size:
+                magic, size = self.header.unpack_from(self.shm.buf, 0)
+                if magic == self.magic:
+                    break
+                if magic.strip(b"\0") or time.monotonic() > deadline:
+                    self.shm.close()
+                    raise ValueError(f"Сегмент {name} не является таблицей антиспама — удалите его или смените THROTTLING_SHM_NAME")
+            time.sleep(0.01)
+        if size != self.size:
+            self.shm.close()
+            raise ValueError(
+                f"Сегмент {name} создан на {size} слотов, а THROTTLING_CAPACITY задаёт {self.size}: "
+                f"задайте одинаковую ёмкость во всех процессах или удалите сегмент"
+            )
+
+    def close(self, unlink: bool = False) -> None:
+        """
+        Отключается от сегмента; unlink=True — ещё и удаляет его (последний процесс, бенчмарки).
+        """
+        for view in (self.keys, self.tokens, self.stamps, self.strikes):
+            view.release()
+        self.shm.close()
+        if unlink:
+            if self._untracked:
+                # До 3.13 unlink() снимает сегмент с учёта в трекере — возвращаем учёт, чтобы не было ошибки
+                from multiprocessing import resource_tracker
+                resource_tracker.register(self.shm._name, "shared_memory")
+            self.shm.unlink()
+
+    def _slot(self, key: int) -> tuple[int, bool]:
+        start = (key * 0x9E3779B1) & self.mask
+        oldest = start
+        for i in range(self.probe_limit):
+            slot = (start + i) & self.mask
+            slot_key = self.keys[slot]
+            if slot_key == key:
+                return slot, False
+            if slot_key == 0:
+                self.keys[slot] = key
+                return slot, True
+            if self.stamps[slot] < self.stamps[oldest]:
+                oldest = slot
+        self.keys[oldest] = key
+        return oldest, True
+
+    def consume(self, key: int, rate: float, burst: int, now: float) -> int:
+        slot, created = self._slot(key)
+        if created:
+            self.strikes[slot] = 0
+            tokens = float(burst)
+        else:
+            tokens = min(float(burst), self.tokens[slot] + (now - self.stamps[slot]) / rate)
+
+        self.stamps[slot] = now
+        if tokens >= 1:
+            self.tokens[slot] = tokens - 1
+            self.strikes[slot] = 0
+            return 0
+
+        self.tokens[slot] = tokens
+        strikes = min(self.strikes[slot] + 1, 255)
+        self.strikes[slot] = strikes
+        return strikes
+
+
+def make_bucket_store() -> Union[LocalBucketStore, SharedMemoryBucketStore]:
+    capacity = int(os.getenv("THROTTLING_CAPACITY", "100000"))
+    shm_name = os.getenv("THROTTLING_SHM_NAME")
+    if shm_name:
+        return SharedMemoryBucketStore(shm_name, capacity=capacity)
+    return LocalBucketStore(capacity=capacity)
 
 
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, default_rate: Union[int, float] = 1) -> None:
+    """
+    Token bucket на пользователя, общий для сообщений и колбэков.
+    Флаг хэндлера rate (секунд на событие) действует только на текущий вызов.
+    """
+    def __init__(
+        self,
+        default_rate: Union[int, float] = 1,
+        burst: int = 2,
+        store: Optional[Union[LocalBucketStore, SharedMemoryBucketStore]] = None,
+    ) -> None:
         self.default_rate = default_rate
-
-        self.users = TTLCache(maxsize=10_000, ttl=600)
+        self.burst = burst
+        self.store = store or make_bucket_store()
 
     async def __call__(
-        self, 
-        handler: Callable[[Message, Dict[str, Any]],
-        Awaitable[Any]], 
-        event: Message, data) -> Any:
+        self,
+        handler: Callable[[Union[Message, CallbackQuery], Dict[str, Any]],
+        Awaitable[Any]],
+        event: Union[Message, CallbackQuery], data) -> Any:
         this_user: User = data.get("event_from_user")
 
-        if get_flag(data, "rate") is not None:
-            self.default_rate = get_flag(data, "rate")
+        rate = get_flag(data, "rate", default=self.default_rate)
+        if not rate or this_user is None:
+            return await handler(event, data)
 
-        if self.default_rate == 0:
+        strikes = self.store.consume(this_user.id, rate, self.burst, time.monotonic())
+        if strikes == 0:
             return await handler(event, data)
 
-        if this_user.id not in self.users:
-            self.users[this_user.id] = {
-                'last_throttled': int(time.time()),
-                'count_throttled': 0,
-                'now_rate': self.default_rate,
-            }
+        if strikes == 1:
+            await self._warn(event, "❗ Пожалуйста, не спамьте.")
+        elif strikes == 2:
+            await self._warn(event, "❗ Бот не будет отвечать до прекращения спама.")
 
-            return await handler(event, data)
+    @staticmethod
+    async def _warn(event: Union[Message, CallbackQuery], text: str) -> None:
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
         else:
-            if int(time.time()) - self.users[this_user.id]['last_throttled'] >= self.users[this_user.id]['now_rate']:
-                self.users.pop(this_user.id)
-
-                return await handler(event, data)
-            else:
-                self.users[this_user.id]['last_throttled'] = int(time.time())
-
-                if self.users[this_user.id]['count_throttled'] == 0:
-                    self.users[this_user.id]['count_throttled'] = 1
-                    self.users[this_user.id]['now_rate'] = self.default_rate + 2
-
-                    return await handler(event, data)
-                elif self.users[this_user.id]['count_throttled'] == 1:
-                    self.users[this_user.id]['count_throttled'] = 2
-                    self.users[this_user.id]['now_rate'] = self.default_rate + 3
-
-                    await event.reply(
-                        "❗ Пожалуйста, не спамьте.",
-                    )
-                elif self.users[this_user.id]['count_throttled'] == 2:
-                    self.users[this_user.id]['count_throttled'] = 3
-                    self.users[this_user.id]['now_rate'] = self.default_rate + 5
-
-                    await event.reply(
-                        "❗ Бот не будет отвечать до прекращения спама.",
-                    )
+            await event.reply(text)
@@ -0,0 +1,69 @@
+from typing import Callable, Dict, Any
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from src.data.db import UnitOfWork, commit_unit_of_work, current_uow
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Привязывает к апдейту одну сессию БД: репозитории используют её автоматически,
+    а все изменения фиксируются одним коммитом после хэндлера
+    или перед первым вызовом Bot API (UnitOfWorkCommitMiddleware).
+    """
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        uow = UnitOfWork()
+        token = current_uow.set(uow)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await uow.rollback()
+            raise
+        else:
+            await uow.commit()
+            return result
+        finally:
+            current_uow.reset(token)
+
+
+class UnitOfWorkFlagMiddleware(BaseMiddleware):
+    """
+    Хэндлеры с флагом unit_of_work=False (рассылка, выгрузки, аналитика) работают без
+    общей сессии: сделанное внешними middleware фиксируется до хэндлера, а каждый
+    вызов репозитория открывает и сразу возвращает своё соединение.
+    Флаги хэндлера видны только во внутренних middleware, поэтому это отдельный слой.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not get_flag(data, "unit_of_work", default=True):
+            await commit_unit_of_work()
+        return await handler(event, data)
+
+
+class UnitOfWorkCommitMiddleware(BaseRequestMiddleware):
+    """
+    Фиксирует unit of work апдейта перед первым вызовом Bot API: пользователь не увидит
+    сообщение об успехе до коммита, а блокировки строк не держатся на время сетевого запроса.
+    Дальнейшие запросы хэндлера идут в собственных сессиях.
+    """
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        await commit_unit_of_work()
+        return await make_request(bot, method)
@@ -0,0 +1,24 @@
+from typing import Callable, Dict, Any, Union
+from aiogram import BaseMiddleware
+from aiogram.types import User, Message, CallbackQuery
+
+from src.data.repositories.user_repository import user_crud
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает пользователя один раз на апдейт и кладёт его снимок в data["user"].
+    Остальные middleware, хэндлеры и клавиатуры используют этот объект.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Any],
+        event: Union[Message, CallbackQuery],
+        data: Dict[str, Any],
+    ) -> Any:
+        this_user: User = data.get("event_from_user")
+
+        if "user" not in data:
+            data["user"] = await user_crud.get_by_tg_id(this_user.id) if this_user else None
+
+        return await handler(event, data)
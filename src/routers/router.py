@@ -1,7 +1,7 @@
 import os, asyncio, json
 import pandas as pd
-from typing import Union
-from uuid import UUID
+from typing import Set, Union
+from uuid import UUID, uuid4
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandObject, StateFilter
@@ -11,20 +11,40 @@ from datetime import datetime, timedelta
 import src.keyboards.inline_keyboards as ikb
 import src.keyboards.reply_keyboards as rkb
 import src.states as st
+from src.data.db import after_commit
+from src.data.reference_data import reference_data
+from src.data.search_cache import search_cache
+from src.data.specialist_directory import specialist_directory
 from src.data.models import UserRole, tz_now_naive
-from src.data.repositories.user_repository import user_crud
+from src.data.repositories.user_repository import user_crud, UserSnapshot
 from src.data.repositories.specialist_repository import specialist_crud
 from src.data.repositories.service_repository import service_crud
 from src.data.repositories.assessmentOfQuality_repository import aoq_crud
 from src.data.repositories.netPromoterScore_repository import nps_crud
 from src.data.repositories.socialCategory_repository import social_category_crud
 from src.data.repositories.socialSubcategory_repository import social_subcategory_crud
-from src.utils.misc_functions import spam_message, backup_db, send_backup_file, send_analytics, send_full_statistics_excel
+from src.utils.const_functions import full_id, is_uuid
+from src.utils.misc_functions import spam_message, backup_db, send_backup_file, send_analytics, send_full_statistics, send_requested_statistics
+from src.utils.statistics_export import EXPORT_FORMATS
 
 router = Router(name="user_router")
 
 select_menu_item = "Выберите пункт меню:"
 
+# Фоновые выгрузки статистики: ссылка держится до завершения, иначе задачу может собрать GC
+export_tasks: Set[asyncio.Task] = set()
+# Фоновая генерация QR-кодов — по той же причине
+qr_tasks: Set[asyncio.Task] = set()
+
+def start_qr_generation(bot, specialist_ids, user_id) -> None:
+    """
+    Запускает генерацию QR-кодов в фоновом режиме (после коммита специалистов).
+    """
+    from src.utils.qr_generator import generate_qr_for_specialists
+    task = asyncio.create_task(generate_qr_for_specialists(bot, specialist_ids, user_id))
+    qr_tasks.add(task)
+    task.add_done_callback(qr_tasks.discard)
+
 async def safe_edit_message(event: CallbackQuery, text: str, reply_markup=None, parse_mode: str = None):
     """
     Безопасное редактирование сообщения. Если не удается отредактировать (например, сообщение с фото),
@@ -44,35 +64,26 @@ async def safe_edit_message(event: CallbackQuery, text: str, reply_markup=None,
 @router.callback_query(F.data.in_(['main_menu']))
 @router.message(F.text.in_('🏠 Главное меню'))
 @router.message(Command("start"))
-async def start(event: Union[Message,CallbackQuery], state: FSMContext, command: CommandObject = None):
+async def start(event: Union[Message,CallbackQuery], state: FSMContext, user: UserSnapshot, command: CommandObject = None):
     await state.clear()
-    user = await user_crud.get(tg_id=event.from_user.id)
     if isinstance(event, CallbackQuery):
         await event.message.delete()
-        await event.message.answer(select_menu_item, reply_markup=await rkb.main_menu_kb(user.tg_id))
+        await event.message.answer(select_menu_item, reply_markup=await rkb.main_menu_kb(user))
     
     elif isinstance(event, Message):
         if command.args:
-            aoq_list = await aoq_crud.get_list(user_id=user.id)
-            now = tz_now_naive()
-            last_week = now - timedelta(days=7)
-            specialist = await specialist_crud.get(id=command.args)
-            aoq_on_last_7_days = False
-            for aoq in aoq_list:
-                if aoq.created_at > last_week:
-                    aoq_on_last_7_days = True
-                    break
+            specialist = await specialist_directory.get(command.args) if is_uuid(command.args) else None
 
-            # если была оценка за последние 7 дней → запрещаем
-            if aoq_on_last_7_days:
+            if specialist is None:
                 await event.answer(
-                    "Вы уже оставляли оценку за последние 7 дней. Спасибо!",
-                    reply_markup=await rkb.main_menu_kb(user.tg_id)
+                    "Ошибка: специалист не найден.",
+                    reply_markup=await rkb.main_menu_kb(user)
                 )
-            elif not specialist:
+            # если была оценка за последние 7 дней → запрещаем
+            elif await aoq_crud.rated_recently(user.id):
                 await event.answer(
-                    "Ошибка: специалист не найден.",
-                    reply_markup=await rkb.main_menu_kb(user.tg_id)
+                    "Вы уже оставляли оценку за последние 7 дней. Спасибо!",
+                    reply_markup=await rkb.main_menu_kb(user)
                 )
             else:
                 await event.answer(
@@ -83,12 +94,12 @@ async def start(event: Union[Message,CallbackQuery], state: FSMContext, command:
                 await state.update_data(specialist_id=command.args)
 
         else:
-            await event.answer(f"Привет! Я помощник ГКЗН", reply_markup=await rkb.main_menu_kb(user.tg_id))
+            await event.answer(f"Привет! Я помощник ГКЗН", reply_markup=await rkb.main_menu_kb(user))
 
 @router.message(Command("cancel_input"))
-async def cancel_input(event: Message, state: FSMContext):
+async def cancel_input(event: Message, state: FSMContext, user: UserSnapshot):
     await state.clear()
-    await event.answer("Ввод отменен", reply_markup=await rkb.main_menu_kb(event.from_user.id))
+    await event.answer("Ввод отменен", reply_markup=await rkb.main_menu_kb(user))
 
 #####################################################################################################################################
 ############################################################## Доступы ##############################################################
@@ -108,35 +119,34 @@ async def manage_access_callback(event: CallbackQuery, state: FSMContext):
     await state.set_state(st.UserStates.waiting_for_username)
 
 @router.message(st.UserStates.waiting_for_username)
-async def process_username(event: Message, state: FSMContext):
+async def process_username(event: Message, state: FSMContext, user: UserSnapshot):
     await state.update_data(username=event.text)
     data = await state.get_data()
     await state.clear()
     if data['action'] in ['add_admin', 'remove_admin', 'add_moderator', 'remove_moderator']:
-        username = event.text.strip().lstrip('@')
+        username = event.text.strip().lstrip('@').lower()
         action = "added" if data['action'].startswith(("add")) else "removed"
         role = "admin" if "admin" in data['action'] else "moderator"
 
         if action == "removed":
-            await user_crud.update(
-                filters={"username": username},
+            await user_crud.update_by_username(
+                username,
                 updates={"role": UserRole.USER.value}
             )
         else:
-            await user_crud.update(
-                filters={"username": username},
+            await user_crud.update_by_username(
+                username,
                 updates={"role": role}
             )
 
+        user = await user_crud.get_by_tg_id(user.tg_id)
 
-        await event.answer(f"Пользователь @{username} был {"удален" if action == "removed" else "добавлен"} как {"администратор" if role == "admin" else "модератор"}.", reply_markup=await rkb.main_menu_kb(event.from_user.id))
+        await event.answer(f"Пользователь @{username} был {"удален" if action == "removed" else "добавлен"} как {"администратор" if role == "admin" else "модератор"}.", reply_markup=await rkb.main_menu_kb(user))
         await state.clear()
 
 @router.message(F.text.in_(['🗑 Сброс статистики']))
-async def confirm_reset_statistics(event: Message, state: FSMContext):
+async def confirm_reset_statistics(event: Message, state: FSMContext, user: UserSnapshot):
     """Показать подтверждение сброса статистики (только для админов)"""
-    user = await user_crud.get(tg_id=event.from_user.id)
-    
     if user.role != UserRole.ADMIN:
         await event.answer("⛔ Доступ запрещен!")
         return
@@ -153,10 +163,8 @@ async def confirm_reset_statistics(event: Message, state: FSMContext):
     )
 
 @router.callback_query(F.data == 'reset_statistics_confirm')
-async def reset_statistics(event: CallbackQuery, state: FSMContext):
+async def reset_statistics(event: CallbackQuery, state: FSMContext, user: UserSnapshot):
     """Выполнить сброс статистики (только для админов)"""
-    user = await user_crud.get(tg_id=event.from_user.id)
-    
     if user.role != UserRole.ADMIN:
         await event.answer("⛔ Доступ запрещен!", show_alert=True)
         return
@@ -164,7 +172,7 @@ async def reset_statistics(event: CallbackQuery, state: FSMContext):
     try:
         # Сначала удаляем NPS (из-за foreign key)
         nps_deleted = await nps_crud.delete_all()
-        # Затем удаляем оценки качества
+        # Затем удаляем оценки качества (дневная сводка очищается вместе с ними)
         aoq_deleted = await aoq_crud.delete_all()
         
         await event.message.edit_text(
@@ -207,7 +215,7 @@ async def manage_specialists_callback(event: CallbackQuery, state: FSMContext):
         await state.set_state(st.SpecialistStates.waiting_for_specialist_import)
     
     elif event.data == 'view_specialists':
-        organizations = await specialist_crud.get_unique_organizations()
+        organizations = await reference_data.get_organizations()
         if not organizations:
             try:
                 await event.message.edit_text("Список организаций пуст.", reply_markup=await ikb.specialist_action_kb())
@@ -223,7 +231,7 @@ async def manage_specialists_callback(event: CallbackQuery, state: FSMContext):
         try:
             await event.message.edit_text(
                 "🏢 <b>Выберите организацию:</b>",
-                reply_markup=await ikb.organizations_list_kb(page=1),
+                reply_markup=await ikb.organizations_list_kb(),
                 parse_mode="HTML"
             )
         except:
@@ -231,7 +239,7 @@ async def manage_specialists_callback(event: CallbackQuery, state: FSMContext):
             await event.bot.send_message(
                 chat_id=event.from_user.id,
                 text="🏢 <b>Выберите организацию:</b>",
-                reply_markup=await ikb.organizations_list_kb(page=1),
+                reply_markup=await ikb.organizations_list_kb(),
                 parse_mode="HTML"
             )
 
@@ -278,14 +286,14 @@ async def export_word_callback(event: CallbackQuery, state: FSMContext):
         asyncio.create_task(export_specialists_to_word(event.bot, event.from_user.id))
         
     elif export_type == 'by_org':
-        organizations = await specialist_crud.get_unique_organizations()
+        organizations = await reference_data.get_organizations()
         if not organizations:
             await event.answer("❌ Нет организаций", show_alert=True)
             return
         
         await event.message.edit_text(
             "🏢 <b>Выберите организацию для экспорта:</b>",
-            reply_markup=await ikb.organizations_list_kb(page=1),
+            reply_markup=await ikb.organizations_list_kb(),
             parse_mode="HTML"
         )
         await state.update_data(export_mode=True)
@@ -293,11 +301,11 @@ async def export_word_callback(event: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith('change_page@organizations:'))
 async def change_organizations_page(event: CallbackQuery, state: FSMContext):
     """Обработчик пагинации для списка организаций"""
-    page = int(event.data.split(':')[1])
+    cursor = event.data.split(':')[1]
     
     await event.message.edit_text(
         "🏢 <b>Выберите организацию:</b>",
-        reply_markup=await ikb.organizations_list_kb(page=page),
+        reply_markup=await ikb.organizations_list_kb(cursor=cursor),
         parse_mode="HTML"
     )
     await event.answer()
@@ -305,16 +313,18 @@ async def change_organizations_page(event: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith('select_org:'))
 async def select_organization(event: CallbackQuery, state: FSMContext):
     """Показать список специалистов выбранной организации или экспортировать"""
-    org_idx = int(event.data.split(':')[1])
+    token = event.data.split(':')[1]
     
-    # Получаем список организаций
-    organizations = await specialist_crud.get_unique_organizations()
-    if org_idx >= len(organizations):
+    if token.isdigit():
+        # Кнопки старых сообщений передают номер организации в списке
+        organizations = await reference_data.get_organizations()
+        organization = organizations[int(token)].name if int(token) < len(organizations) else None
+    else:
+        organization = await reference_data.get_organization(full_id(token))
+    if not organization:
         await event.answer("❌ Организация не найдена", show_alert=True)
         return
     
-    organization = organizations[org_idx]
-    
     # Проверяем режим экспорта
     data = await state.get_data()
     if data.get('export_mode'):
@@ -336,16 +346,16 @@ async def select_organization(event: CallbackQuery, state: FSMContext):
     # Сохраняем организацию в состояние
     await state.update_data(current_organization=organization)
     
-    specialists = await specialist_crud.get_list(organization=organization)
-    if not specialists:
+    specialists_count = await specialist_directory.count(organization=organization)
+    if not specialists_count:
         await event.answer("В данной организации нет специалистов", show_alert=True)
         return
     
     await event.message.edit_text(
         f"🏢 <b>{organization}</b>\n\n"
-        f"Специалистов: {len(specialists)}\n\n"
+        f"Специалистов: {specialists_count}\n\n"
         f"Выберите специалиста для просмотра карточки:",
-        reply_markup=await ikb.specialists_list_kb(organization=organization, page=1),
+        reply_markup=await ikb.specialists_list_kb(organization=organization),
         parse_mode="HTML"
     )
     await event.answer()
@@ -353,7 +363,7 @@ async def select_organization(event: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith('pg@s:'))
 async def change_specialists_page(event: CallbackQuery, state: FSMContext):
     """Обработчик пагинации для списка специалистов"""
-    page = int(event.data.split(':')[1])
+    cursor = event.data.split(':')[1]
     
     # Получаем данные из состояния
     data = await state.get_data()
@@ -361,30 +371,16 @@ async def change_specialists_page(event: CallbackQuery, state: FSMContext):
     search_query = data.get('search_query')
     
     if search_query:
-        # Поиск специалистов
-        all_specialists = await specialist_crud.get_list()
-        specialists = [
-            spec for spec in all_specialists
-            if search_query.lower() in spec.fullname.lower() or
-               search_query.lower() in spec.position.lower() or
-               search_query.lower() in spec.organization.lower()
-        ]
-        message_text = f"🔍 <b>Результаты поиска:</b> \"{search_query}\"\n\n"
-        if specialists:
-            message_text += "Выберите специалиста для просмотра карточки:"
-        else:
-            message_text += "Ничего не найдено"
+        message_text = f"🔍 <b>Результаты поиска:</b> \"{search_query}\"\n\nВыберите специалиста для просмотра карточки:"
     elif organization:
-        specialists = await specialist_crud.get_list(organization=organization)
         message_text = f"🏢 <b>{organization}</b>\n\nВыберите специалиста для просмотра карточки:"
     else:
-        specialists = None
         message_text = "📋 <b>Список специалистов:</b>\n\nВыберите специалиста для просмотра карточки:"
     
     await safe_edit_message(
         event,
         message_text,
-        reply_markup=await ikb.specialists_list_kb(organization=organization, page=page, specialists_list=specialists, search_query=search_query),
+        reply_markup=await ikb.specialists_list_kb(organization=organization, cursor=cursor, search_query=search_query, user_id=event.from_user.id),
         parse_mode="HTML"
     )
     await event.answer()
@@ -393,22 +389,22 @@ async def change_specialists_page(event: CallbackQuery, state: FSMContext):
 async def view_specialist_card(event: CallbackQuery, state: FSMContext):
     """Показать карточку специалиста"""
     parts = event.data.split(':')
-    specialist_id = parts[1]
-    page = int(parts[2]) if len(parts) > 2 else 1
+    specialist_id = full_id(parts[1])
+    cursor = parts[2] if len(parts) > 2 else None
     
-    specialist = await specialist_crud.get(id=specialist_id)
+    specialist = await specialist_directory.get(specialist_id)
     if not specialist:
         await event.answer("❌ Специалист не найден", show_alert=True)
         return
     
     # Сохраняем страницу в состояние
-    await state.update_data(current_page=page)
+    await state.update_data(current_cursor=cursor)
     
     # Формируем карточку специалиста
     card_text = (
         f"👤 <b>Карточка специалиста</b>\n\n"
         f"<b>ФИО:</b> {specialist.fullname}\n"
-        f"<b>Должность:</b> {specialist.position}\n"
+        f"<b>Должность:</b> {specialist.position or '-'}\n"
         f"<b>Организация:</b> {specialist.organization}\n"
     )
     
@@ -425,13 +421,13 @@ async def view_specialist_card(event: CallbackQuery, state: FSMContext):
             chat_id=event.from_user.id,
             photo=specialist.qr,
             caption=card_text,
-            reply_markup=await ikb.specialist_card_kb(specialist_id, page),
+            reply_markup=await ikb.specialist_card_kb(specialist_id, cursor),
             parse_mode="HTML"
         )
     else:
         await event.message.edit_text(
             card_text,
-            reply_markup=await ikb.specialist_card_kb(specialist_id, page),
+            reply_markup=await ikb.specialist_card_kb(specialist_id, cursor),
             parse_mode="HTML"
         )
     await event.answer()
@@ -446,16 +442,11 @@ async def process_search_query(event: Message, state: FSMContext):
         await state.clear()
         return
     
-    # Поиск специалистов
-    all_specialists = await specialist_crud.get_list()
-    specialists = [
-        spec for spec in all_specialists
-        if query.lower() in spec.fullname.lower() or
-           query.lower() in spec.position.lower() or
-           query.lower() in spec.organization.lower()
-    ]
+    # Поиск специалистов (повторный запрос берётся из кэша поиска)
+    result = await search_cache.get(event.from_user.id, query)
+    found = len(result) if result is not None else await specialist_crud.search_count(query)
     
-    if not specialists:
+    if not found:
         await event.answer(
             f"🔍 <b>Результаты поиска:</b> \"{query}\"\n\n"
             f"❌ Ничего не найдено.\n\n"
@@ -471,24 +462,25 @@ async def process_search_query(event: Message, state: FSMContext):
     
     await event.answer(
         f"🔍 <b>Результаты поиска:</b> \"{query}\"\n\n"
-        f"Найдено специалистов: {len(specialists)}\n\n"
+        f"Найдено специалистов: {found}\n\n"
         f"Выберите специалиста для просмотра карточки:",
-        reply_markup=await ikb.specialists_list_kb(page=1, specialists_list=specialists, search_query=query),
+        reply_markup=await ikb.specialists_list_kb(search_query=query, user_id=event.from_user.id),
         parse_mode="HTML"
     )
 
 @router.callback_query(F.data.startswith('btsl:'))
 async def back_to_specialists_list(event: CallbackQuery, state: FSMContext):
     """Вернуться к списку специалистов"""
-    page = int(event.data.split(':')[1])
+    cursor = event.data.split(':')[1]
     
     # Получаем данные из состояния
     data = await state.get_data()
     organization = data.get('current_organization')
     search_query = data.get('search_query')
     
-    if organization:
-        specialists = await specialist_crud.get_list(organization=organization)
+    if search_query:
+        message_text = f"🔍 <b>Результаты поиска:</b> \"{search_query}\"\n\nВыберите специалиста для просмотра карточки:"
+    elif organization:
         message_text = f"🏢 <b>{organization}</b>\n\nВыберите специалиста для просмотра карточки:"
     else:
         message_text = "📋 <b>Список специалистов:</b>\n\nВыберите специалиста для просмотра карточки:"
@@ -496,7 +488,7 @@ async def back_to_specialists_list(event: CallbackQuery, state: FSMContext):
     await safe_edit_message(
         event,
         message_text,
-        reply_markup=await ikb.specialists_list_kb(organization=organization, page=page, search_query=search_query),
+        reply_markup=await ikb.specialists_list_kb(organization=organization, cursor=cursor, search_query=search_query, user_id=event.from_user.id),
         parse_mode="HTML"
     )
     await event.answer()
@@ -541,7 +533,8 @@ async def process_specialist_import(event: Message, state: FSMContext):
     # === 4. Кэшируем username бота ===
     bot_username = (await event.bot.get_me()).username
 
-    created_count = 0
+    # === 5. Отбираем новых специалистов (существующие ключи — одним запросом) ===
+    existing_keys = await specialist_crud.get_natural_keys()
     specialists_to_create = []
 
     for _, row in df.iterrows():
@@ -552,23 +545,22 @@ async def process_specialist_import(event: Message, state: FSMContext):
             "department": row["Отдел"],
         }
 
-        existing = await specialist_crud.get(**row_data)
-        if not existing:
-            specialists_to_create.append(row_data)
-
-    new_specialist_ids = []
-    for spec in specialists_to_create:
-        spec_obj = await specialist_crud.create(**spec)
-        await specialist_crud.update(
-            filters={
-                "organization": spec["organization"],
-                "position": spec["position"],
-                "fullname": spec["fullname"]
-            },
-            updates={"link": f"https://t.me/{bot_username}?start={spec_obj.id}"}
-        )
-        new_specialist_ids.append(spec_obj.id)
-        created_count += 1
+        key = (row_data["organization"], row_data["position"], row_data["fullname"], row_data["department"])
+        if key in existing_keys:
+            continue
+        existing_keys.add(key)
+
+        # id генерируем заранее, чтобы ссылка попала в тот же INSERT
+        spec_id = str(uuid4())
+        specialists_to_create.append({
+            **row_data,
+            "id": spec_id,
+            "link": f"https://t.me/{bot_username}?start={spec_id}",
+        })
+
+    # === 6. Пакетная вставка ===
+    new_specialist_ids = await specialist_crud.create_many(specialists_to_create)
+    created_count = len(new_specialist_ids)
 
     try:
         os.remove(file_path)
@@ -582,13 +574,12 @@ async def process_specialist_import(event: Message, state: FSMContext):
     )
     await state.clear()
     
-    # Запускаем генерацию QR-кодов в фоновом режиме
+    # Запускаем генерацию QR-кодов в фоновом режиме, когда специалисты будут сохранены
     if new_specialist_ids:
-        from src.utils.qr_generator import generate_qr_for_specialists
-        asyncio.create_task(generate_qr_for_specialists(event.bot, new_specialist_ids, event.from_user.id))
+        after_commit(lambda: start_qr_generation(event.bot, new_specialist_ids, event.from_user.id))
 
 @router.message(st.SpecialistStates.waiting_for_specialist_fio)
-async def process_specialist_fio(event: Message, state: FSMContext):
+async def process_specialist_fio(event: Message, state: FSMContext, user: UserSnapshot):
     await state.update_data(fullname=event.text)
     data = await state.get_data()
     
@@ -597,7 +588,7 @@ async def process_specialist_fio(event: Message, state: FSMContext):
     if current_state == st.SpecialistStates.waiting_for_specialist_fio:
         if 'remove_specialist' in (await state.get_data()).get('action', ''):
             await specialist_crud.delete(fullname=data['fullname'])
-            await event.answer(f"Специалист {data['fullname']} был удален.", reply_markup=await rkb.main_menu_kb(event.from_user.id))
+            await event.answer(f"Специалист {data['fullname']} был удален.", reply_markup=await rkb.main_menu_kb(user))
             await state.clear()
         else:
             await event.answer("Напишите организацию, в которой работает специалист:")
@@ -616,32 +607,29 @@ async def process_specialist_department(event: Message, state: FSMContext):
     await state.set_state(st.SpecialistStates.waiting_for_specialist_position)
     
 @router.message(st.SpecialistStates.waiting_for_specialist_position)
-async def process_specialist_position(event: Message, state: FSMContext):
+async def process_specialist_position(event: Message, state: FSMContext, user: UserSnapshot):
     await state.update_data(position=event.text)
     data = await state.get_data()
     bot = await event.bot.get_me()
+    specialist_id = str(uuid4())
     specialist = await specialist_crud.create(
+            id=specialist_id,
             organization=data['organization'],
             position=data['position'],
             fullname=data['fullname'],
             department=data.get('department'),
-        )
-        
-    await specialist_crud.update(
-            filters={"fullname": data['fullname'], "organization": data['organization']},
-            updates={"link": f"https://t.me/{bot.username}?start={specialist.id}"}
+            link=f"https://t.me/{bot.username}?start={specialist_id}",
         )
         
     await event.answer(
         f"Специалист {data['fullname']} был добавлен.\n\n"
         f"QR-код генерируется в фоновом режиме...",
-        reply_markup=await rkb.main_menu_kb(event.from_user.id)
+        reply_markup=await rkb.main_menu_kb(user)
     )
     await state.clear()
     
-    # Запускаем генерацию QR-кода в фоновом режиме
-    from src.utils.qr_generator import generate_qr_for_specialists
-    asyncio.create_task(generate_qr_for_specialists(event.bot, [specialist.id], event.from_user.id))
+    # Запускаем генерацию QR-кода в фоновом режиме, когда специалист будет сохранён
+    after_commit(lambda: start_qr_generation(event.bot, [specialist.id], event.from_user.id))
     
 #############################################################################################################################################
 ############################################################## Оценка качества ##############################################################
@@ -653,10 +641,10 @@ async def change_service_page(event: CallbackQuery, state: FSMContext):
     parts = data_parts[1].split('_')
 
     action = parts[0]
-    page = parts[1]
+    cursor = parts[1]
         
     await event.message.edit_text("Выберите услугу для оценки:", 
-                                 reply_markup=await ikb.service_actions_kb(action=action, page=int(page)))
+                                 reply_markup=await ikb.service_actions_kb(action=action, cursor=cursor))
 
 @router.callback_query(F.data.startswith(('service_action:')))
 async def process_assessment_service(event: CallbackQuery, state: FSMContext):
@@ -674,18 +662,18 @@ async def process_assessment_service(event: CallbackQuery, state: FSMContext):
         return
 
 @router.callback_query(F.data.startswith(('assessment_score@')), StateFilter(st.UserStates.waiting_for_assessment_score))
-async def process_assessment_score(event: CallbackQuery, state: FSMContext):
+async def process_assessment_score(event: CallbackQuery, state: FSMContext, user: UserSnapshot):
     state_data = await state.get_data()
     data_parts = event.data.split('@') # ['assessment_score', 'aoq:5']
     _type = data_parts[-1].split(':')[0]
     score = int(data_parts[-1].split(':')[-1])
-    user = await user_crud.get(tg_id=event.from_user.id)
     
     if _type == "aoq":
         aoq = await aoq_crud.create(
             user_id=user.id,
             specialist_id=state_data.get('specialist_id'),
             service_id=state_data.get('assessment_service_id'),
+            social_subcategory_id=user.social_subcategory_id,
             score=score,
         )
         await event.message.edit_text("Напишите предложения по улучшению", reply_markup=None)
@@ -703,7 +691,7 @@ async def process_assessment_score(event: CallbackQuery, state: FSMContext):
         await event.message.edit_text("Спасибо за вашу оценку!", reply_markup=None)
 
 @router.message(st.UserStates.waiting_for_assessment_comment)
-async def process_assessment_comment(event: Message, state: FSMContext):
+async def process_assessment_comment(event: Message, state: FSMContext, user: UserSnapshot):
     data = await state.get_data()
     aoq_id = data.get('aoq_id')
     if aoq_id:
@@ -711,7 +699,7 @@ async def process_assessment_comment(event: Message, state: FSMContext):
             filters={"id": aoq_id},
             updates={"comment": event.text}
         )
-        await event.answer("Спасибо за ваши предложения по улучшению!", reply_markup=await rkb.main_menu_kb(event.from_user.id))
+        await event.answer("Спасибо за ваши предложения по улучшению!", reply_markup=await rkb.main_menu_kb(user))
     await state.clear()
 
 
@@ -739,26 +727,26 @@ async def process_spam_message(event: Message, state: FSMContext):
 async def process_spam_text(event: Message, state: FSMContext):
     await state.update_data(spam_message=event)
     
-    users = await user_crud.get_list()
+    users_count = await user_crud.count()
 
-    await event.answer(f"Вы уверены, что хотите отправить это сообщение {len(users)} пользователям?", reply_markup=await ikb.spam_confirmation_kb())
+    await event.answer(f"Вы уверены, что хотите отправить это сообщение {users_count} пользователям?", reply_markup=await ikb.spam_confirmation_kb())
 
-@router.callback_query(F.data.startswith(('spam_confirmation')))
-async def process_spam_confirmation(event: CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.startswith(('spam_confirmation')), flags={"unit_of_work": False})
+async def process_spam_confirmation(event: CallbackQuery, state: FSMContext, user: UserSnapshot):
     status = event.data.split(':')[-1]
     data = await state.get_data()
     send_message = data.get('spam_message')
     await state.clear()
     
     if status == 'yes':
-        users = await user_crud.get_list()
+        users_count = await user_crud.count()
 
-        await event.message.edit_text(f"Рассылка началась... (0/{len(users)})", reply_markup=None)
+        await event.message.edit_text(f"Рассылка началась... (0/{users_count})", reply_markup=None)
 
         await asyncio.create_task(spam_message(event, send_message))
 
     else:
-        await event.answer("Рассылка отменена.", reply_markup=await rkb.main_menu_kb(event.from_user.id))
+        await event.answer("Рассылка отменена.", reply_markup=await rkb.main_menu_kb(user))
 
 
 ############################################################################################################################################
@@ -826,22 +814,15 @@ async def process_category_import(event: Message, state: FSMContext):
     await social_subcategory_crud.delete_all()
     await social_category_crud.delete_all()
     
-    # === 5. Импортируем в БД ===
-    created_count = 0
-    for category in data:
-        # Создаём категорию
-        new_category = await social_category_crud.create(
-            name=category["name"]
-        )
-        created_count += 1
-
-        # Создаём подкатегории
-        for sub in category.get("subcategories", []):
-            await social_subcategory_crud.create(
-                name=sub["name"],
-                category_id=new_category.id
-            )
-            created_count += 1
+    # === 5. Импортируем в БД пакетами ===
+    category_ids = await social_category_crud.create_many([{"name": category["name"]} for category in data])
+    subcategories = [
+        {"name": sub["name"], "category_id": category_id}
+        for category, category_id in zip(data, category_ids)
+        for sub in category.get("subcategories", [])
+    ]
+    await social_subcategory_crud.create_many(subcategories)
+    created_count = len(category_ids) + len(subcategories)
     os.remove(file_path)
     await event.answer(f"✅ Импорт завершён! Создано {created_count} записей.", reply_markup=await ikb.social_category_actions_kb())
     await state.clear()
@@ -854,22 +835,22 @@ async def process_category_name(event: Message, state: FSMContext):
     await event.answer(f'Категория "{event.text}" была добавлена.', reply_markup=await ikb.social_category_actions_kb())
     await state.clear()
 
-@router.callback_query(F.data.startswith(('change_page@ctg:', 'change_page@subctg:')))
+@router.callback_query(F.data.startswith(('pg@ctg:', 'pg@subctg:', 'change_page@ctg:', 'change_page@subctg:')))
 async def categories_process(event: CallbackQuery, state: FSMContext):
     data_parts = event.data.split(':')
     _type = data_parts[0].split('@')[-1]
     
     parts = data_parts[1].split('_')
     
-    page = parts[0]
+    cursor = parts[0]
     action = parts[1]
-    category_id = parts[2] if len(parts) > 2 else None
+    category_id = full_id(parts[2]) if len(parts) > 2 and parts[2] != "0" else None
     if _type == "ctg":
        await event.message.edit_text("Выберите категорию:", 
-                                        reply_markup=await ikb.social_category_selection_kb(_type=_type, action=action, page=int(page)))
+                                        reply_markup=await ikb.social_category_selection_kb(_type=_type, action=action, cursor=cursor))
     else:
        await event.message.edit_text("Выберите подкатегорию:", 
-                                        reply_markup=await ikb.social_category_selection_kb(_type=_type, action=action, page=int(page), category_id=category_id))
+                                        reply_markup=await ikb.social_category_selection_kb(_type=_type, action=action, cursor=cursor, category_id=category_id))
 
 @router.callback_query(F.data.startswith(('select@')))
 async def select_category_process(event: CallbackQuery, state: FSMContext):    
@@ -877,7 +858,7 @@ async def select_category_process(event: CallbackQuery, state: FSMContext):
     parts = data_parts[-1].split(':')
     _type = parts[0]
     parts = parts[1].split('_') 
-    id = parts[0] 
+    id = full_id(parts[0]) 
     action = parts[1]
     
     if _type == "ctg":
@@ -985,13 +966,9 @@ async def process_service_import(event: Message, state: FSMContext):
     # === 4. Удаляем старые записи ===
     await service_crud.delete_all()
 
-    # === 5. Импортируем в БД ===
-    created_count = 0
-    for service in data:
-        await service_crud.create(
-            name=service["name"]
-        )
-        created_count += 1
+    # === 5. Импортируем в БД одним пакетом ===
+    service_ids = await service_crud.create_many([{"name": service["name"]} for service in data])
+    created_count = len(service_ids)
     os.remove(file_path)
     await event.answer(f"✅ Импорт завершён! Создано {created_count} записей.")
     await state.clear()
@@ -1000,21 +977,46 @@ async def process_service_import(event: Message, state: FSMContext):
 ############################################################## backup_db ##############################################################
 #######################################################################################################################################
 
-@router.message(F.text.in_('💾 Выгрузить данные'))
+@router.message(F.text.in_('💾 Выгрузить данные'), flags={"unit_of_work": False})
 async def process_backup_db(event: Message, state: FSMContext):
     await state.clear()
     
     await event.answer("Выгрузка данных начата...")
     await backup_db(bot=event.bot)
     await send_backup_file(bot=event.bot)
+    await event.answer("Выберите формат полной статистики:", reply_markup=await ikb.statistics_export_kb())
+
+@router.callback_query(F.data.startswith('export_statistics:'), flags={"unit_of_work": False})
+async def export_statistics_callback(event: CallbackQuery, state: FSMContext, user: UserSnapshot):
+    """Обработчик выгрузки полной статистики в выбранном формате (администраторы и модераторы)"""
+    if user.role == UserRole.USER:
+        await event.answer("⛔ Доступ запрещен!", show_alert=True)
+        return
+
+    parts = event.data.split(':')
+    if len(parts) != 3 or parts[1] not in EXPORT_FORMATS or parts[2] not in ("delta", "full"):
+        await event.answer("❌ Неизвестный формат выгрузки", show_alert=True)
+        return
+    _, export_format, mode = parts
+
+    await event.answer()
+    await event.message.edit_text(
+        "⏳ <b>Готовим статистику...</b>" if mode == "delta" else "⏳ <b>Готовим полную статистику...</b>",
+        parse_mode="HTML",
+    )
+
+    # Выгрузка может занять минуты — запускаем в фоновом режиме, ошибку получит запросивший
+    task = asyncio.create_task(send_requested_statistics(event.bot, event.from_user.id, export_format, delta=mode == "delta"))
+    export_tasks.add(task)
+    task.add_done_callback(export_tasks.discard)
     
 #######################################################################################################################################
 ############################################################## Аналитика ##############################################################
 #######################################################################################################################################
 
-@router.message(F.text.in_('📊 Аналитика'))
+@router.message(F.text.in_('📊 Аналитика'), flags={"unit_of_work": False})
 async def process_analytics(event: Message, state: FSMContext):
     await state.clear()
     
     await send_analytics(bot=event.bot, user_tg_id=event.from_user.id)
-    await send_full_statistics_excel(bot=event.bot, user_tg_id=event.from_user.id)
\ No newline at end of file
+    await send_full_statistics(bot=event.bot, user_tg_id=event.from_user.id)
\ No newline at end of file
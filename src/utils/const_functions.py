@@ -1,4 +1,6 @@
 import re
+import uuid
+import base64
 from aiogram.types import (InlineKeyboardButton, KeyboardButton, InlineKeyboardMarkup,
                            CopyTextButton)
 
@@ -19,3 +21,50 @@ def ikb(
         return InlineKeyboardButton(text=text, url=url)
     elif copy is not None:
         return InlineKeyboardButton(text=text, copy_text=CopyTextButton(text=copy))
+
+
+def short_id(value: str) -> str:
+    """
+    Сжимает UUID до 22 символов base64url, чтобы уложиться в 64 байта callback_data.
+    '_' заменяется на '.', так как '_' служит разделителем в callback_data.
+    """
+    encoded = base64.urlsafe_b64encode(uuid.UUID(str(value)).bytes).decode().rstrip("=")
+    return encoded.replace("_", ".")
+
+
+def full_id(value: str) -> str:
+    """
+    Разворачивает id из callback_data. Полные UUID (старые кнопки) возвращает как есть.
+    """
+    if len(value) == 22:
+        return str(uuid.UUID(bytes=base64.urlsafe_b64decode(value.replace(".", "_") + "==")))
+    return value
+
+
+def is_uuid(value: str) -> bool:
+    """
+    Проверяет, что строка — UUID (id записей, в том числе в deep link /start).
+    """
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+def page_cursor(direction: str, value: str) -> str:
+    """
+    Курсор страницы для callback_data: 'n<id>' — после строки, 'p<id>' — перед строкой.
+    """
+    return f"{direction}{short_id(value)}"
+
+
+def parse_page_cursor(cursor: str) -> tuple:
+    """
+    Возвращает (after_key, before_key). Пустой курсор и номера страниц
+    из старых сообщений означают первую страницу.
+    """
+    if cursor and cursor[0] in ("n", "p") and len(cursor) == 23:
+        key = full_id(cursor[1:])
+        return (key, None) if cursor[0] == "n" else (None, key)
+    return None, None
@@ -18,7 +18,7 @@ admin_commands = [
 
 async def set_commands(bot: Bot):
     await bot.set_my_commands(user_commands, scope=BotCommandScopeDefault())
-    admins = await user_crud.get_list(role="admin")
+    admins = await user_crud.list_projection(["tg_id"], role="admin")
     for admin in admins:
         try:
             await bot.set_my_commands(admin_commands, scope=BotCommandScopeChat(chat_id=admin.tg_id))
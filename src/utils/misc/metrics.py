@@ -0,0 +1,419 @@
+import os
+import re
+import time
+import bisect
+import asyncio
+from array import array
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Any, List, Tuple
+
+from src.utils.misc.bot_logging import bot_logger
+
+
+def _bucket_bounds(start_ms: float = 0.5, factor: float = 1.25, limit_ms: float = 60_000) -> List[float]:
+    bounds = []
+    bound = start_ms
+    while bound < limit_ms:
+        bounds.append(round(bound, 3))
+        bound *= factor
+    bounds.append(limit_ms)
+    return bounds
+
+
+BUCKET_BOUNDS_MS = _bucket_bounds()
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек с логарифмическими корзинами (шаг 25%).
+    Перцентили оцениваются по верхней границе корзины.
+    """
+    __slots__ = ("counts", "count", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = array("L", bytes(array("L").itemsize * (len(BUCKET_BOUNDS_MS) + 1)))
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms: float) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                bound = BUCKET_BOUNDS_MS[idx] if idx < len(BUCKET_BOUNDS_MS) else self.max_ms
+                return round(min(bound, self.max_ms), 1)
+        return round(self.max_ms, 1)
+
+
+class UpdateTrace:
+    """
+    Счётчики одного апдейта: хэндлер, запросы к БД и к Bot API, ошибка.
+    """
+    __slots__ = ("handler", "started", "handler_ms", "db_queries", "db_ms", "api_calls", "api_ms", "error", "statements")
+
+    def __init__(self):
+        self.handler: Optional[str] = None
+        self.started = time.perf_counter()
+        self.handler_ms = 0.0
+        self.db_queries = 0
+        self.db_ms = 0.0
+        self.api_calls = 0
+        self.api_ms = 0.0
+        self.error = False
+        # (метод репозитория, SQL) → сколько раз выполнен за апдейт
+        self.statements: Dict[Tuple[str, str], int] = {}
+
+
+class HandlerStats:
+    __slots__ = ("latency", "handler_ms", "db_queries", "db_ms", "api_calls", "api_ms", "errors", "n_plus_one")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.handler_ms = 0.0
+        self.db_queries = 0
+        self.db_ms = 0.0
+        self.api_calls = 0
+        self.api_ms = 0.0
+        self.errors = 0
+        self.n_plus_one = 0
+
+
+class StatementStats:
+    """
+    Счётчики одного SQL-выражения, вызванного из одного метода репозитория.
+    """
+    __slots__ = ("latency", "rows")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.rows = 0
+
+
+class PoolStats:
+    """
+    Счётчики пула соединений: занятые соединения, ожидание выдачи, переполнение.
+    """
+    def __init__(self):
+        self.wait = LatencyHistogram()
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.connects = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def observe_wait(self, elapsed_ms: float, overflow: bool, timed_out: bool = False) -> None:
+        self.wait.observe(elapsed_ms)
+        self.overflow_events += overflow
+        self.timeouts += timed_out
+
+    def checkout(self) -> None:
+        self.checked_out += 1
+        if self.checked_out > self.peak_checked_out:
+            self.peak_checked_out = self.checked_out
+
+    def checkin(self) -> None:
+        self.checked_out = max(0, self.checked_out - 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "checked_out": self.checked_out,
+            "peak_checked_out": self.peak_checked_out,
+            "connects": self.connects,
+            "checkouts": self.wait.count,
+            "wait_p50_ms": self.wait.percentile(0.50),
+            "wait_p99_ms": self.wait.percentile(0.99),
+            "wait_max_ms": round(self.wait.max_ms, 1),
+            "overflow_events": self.overflow_events,
+            "timeouts": self.timeouts,
+        }
+
+
+current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("current_trace", default=None)
+# Выполняющийся метод репозитория (задаёт track_query_origin)
+query_origin: ContextVar[Optional[str]] = ContextVar("query_origin", default=None)
+
+# Одинаковый запрос из одного метода столько раз за апдейт считается N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "10"))
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# Снимать EXPLAIN (ANALYZE, BUFFERS) при первом медленном выполнении SELECT
+EXPLAIN_SLOW_QUERIES = os.getenv("DB_EXPLAIN_SLOW", "0") == "1"
+# Сколько разных выражений хранить в статистике
+MAX_STATEMENTS = 1000
+
+
+class Metrics:
+    """
+    Метрики хэндлеров в памяти процесса.
+    """
+    def __init__(self):
+        self.handlers: Dict[str, HandlerStats] = {}
+        self.statements: Dict[Tuple[str, str], StatementStats] = {}
+        self.pool = PoolStats()
+        self.since = time.time()
+
+    def start_update(self) -> UpdateTrace:
+        trace = UpdateTrace()
+        current_trace.set(trace)
+        return trace
+
+    def finish_update(self, trace: UpdateTrace) -> None:
+        elapsed_ms = (time.perf_counter() - trace.started) * 1000
+        name = trace.handler or "<unhandled>"
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        stats.latency.observe(elapsed_ms)
+        stats.handler_ms += trace.handler_ms
+        stats.db_queries += trace.db_queries
+        stats.db_ms += trace.db_ms
+        stats.api_calls += trace.api_calls
+        stats.api_ms += trace.api_ms
+        stats.errors += trace.error
+        stats.n_plus_one += self._check_n_plus_one(name, trace)
+
+    @staticmethod
+    def _check_n_plus_one(name: str, trace: UpdateTrace) -> bool:
+        """
+        Пишет в лог запросы, повторённые за апдейт N_PLUS_ONE_THRESHOLD раз и больше.
+        """
+        repeated = [(key, count) for key, count in trace.statements.items() if count >= N_PLUS_ONE_THRESHOLD]
+        for (origin, statement), count in repeated:
+            bot_logger.warning(f"⚠️ N+1 в {name}: {origin} выполнил запрос {count} раз: {' '.join(statement.split())[:200]}")
+        return bool(repeated)
+
+    @asynccontextmanager
+    async def background(self, name: str):
+        """
+        Отдельная трасса для фоновой задачи, чтобы её запросы не попадали
+        в апдейт, из которого она запущена.
+        """
+        trace = UpdateTrace()
+        trace.handler = name
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        except Exception:
+            trace.error = True
+            raise
+        finally:
+            current_trace.reset(token)
+            self.finish_update(trace)
+
+    def record_db_query(self, elapsed_ms: float, statement: Optional[str] = None, rows: int = -1) -> None:
+        origin = query_origin.get() or "<без репозитория>"
+        trace = current_trace.get()
+        if trace is not None:
+            trace.db_queries += 1
+            trace.db_ms += elapsed_ms
+            if statement is not None:
+                key = (origin, statement)
+                trace.statements[key] = trace.statements.get(key, 0) + 1
+
+        if statement is None:
+            return
+        key = (origin, statement)
+        stats = self.statements.get(key)
+        if stats is None:
+            if len(self.statements) >= MAX_STATEMENTS:
+                key = (origin, "<прочие запросы>")
+                stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+        stats.latency.observe(elapsed_ms)
+        if rows > 0:
+            stats.rows += rows
+
+    def statements_snapshot(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Самые затратные по суммарному времени запросы: метод репозитория,
+        число выполнений, перцентили задержки, строк в среднем (по cursor.rowcount).
+        """
+        top = sorted(self.statements.items(), key=lambda item: item[1].latency.total_ms, reverse=True)[:limit]
+        return [
+            {
+                "origin": origin,
+                "statement": statement,
+                "count": stats.latency.count,
+                "total_ms": round(stats.latency.total_ms, 1),
+                "p50_ms": stats.latency.percentile(0.50),
+                "p99_ms": stats.latency.percentile(0.99),
+                "rows_avg": round(stats.rows / (stats.latency.count or 1), 1),
+            }
+            for (origin, statement), stats in top
+        ]
+
+    @staticmethod
+    def record_api_call(elapsed_ms: float) -> None:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.api_calls += 1
+            trace.api_ms += elapsed_ms
+
+    @staticmethod
+    def mark_error() -> None:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.error = True
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Сводка по хэндлерам: перцентили задержки, среднее число запросов к БД/API
+        на апдейт, доля ошибок.
+        """
+        result = {}
+        for name, stats in self.handlers.items():
+            count = stats.latency.count or 1
+            result[name] = {
+                "count": stats.latency.count,
+                "p50_ms": stats.latency.percentile(0.50),
+                "p95_ms": stats.latency.percentile(0.95),
+                "p99_ms": stats.latency.percentile(0.99),
+                "max_ms": round(stats.latency.max_ms, 1),
+                "handler_ms_avg": round(stats.handler_ms / count, 1),
+                "db_queries_avg": round(stats.db_queries / count, 2),
+                "db_ms_avg": round(stats.db_ms / count, 1),
+                "api_calls_avg": round(stats.api_calls / count, 2),
+                "api_ms_avg": round(stats.api_ms / count, 1),
+                "error_rate": round(stats.errors / count, 4),
+                "n_plus_one": stats.n_plus_one,
+            }
+        return result
+
+    def dump_to_log(self) -> None:
+        snapshot = self.snapshot()
+        if not snapshot:
+            return
+        lines = [f"📈 Метрики хэндлеров с {time.strftime('%d-%m-%Y %H:%M:%S', time.localtime(self.since))}:"]
+        if self.pool.wait.count:
+            pool = self.pool.snapshot()
+            lines.append(
+                f"pool: checked_out={pool['checked_out']} peak={pool['peak_checked_out']} "
+                f"connects={pool['connects']} wait p50={pool['wait_p50_ms']}ms p99={pool['wait_p99_ms']}ms "
+                f"max={pool['wait_max_ms']}ms overflow={pool['overflow_events']} timeouts={pool['timeouts']}"
+            )
+        for name, row in sorted(snapshot.items(), key=lambda item: item[1]["p95_ms"], reverse=True):
+            lines.append(
+                f"{name}: n={row['count']} p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+                f"handler={row['handler_ms_avg']}ms db={row['db_queries_avg']}q/{row['db_ms_avg']}ms "
+                f"api={row['api_calls_avg']}/{row['api_ms_avg']}ms errors={row['error_rate']:.2%}"
+                + (f" n+1={row['n_plus_one']}" if row["n_plus_one"] else "")
+            )
+        statements = self.statements_snapshot()
+        if statements:
+            lines.append("🐢 Самые затратные запросы:")
+            for row in statements:
+                lines.append(
+                    f"{row['origin']}: n={row['count']} total={row['total_ms']}ms p50={row['p50_ms']}ms "
+                    f"p99={row['p99_ms']}ms rows={row['rows_avg']} | {' '.join(row['statement'].split())[:160]}"
+                )
+        bot_logger.info("\n".join(lines))
+
+
+metrics = Metrics()
+
+# Выражения, для которых уже снят EXPLAIN
+_explained: set = set()
+# EXPLAIN ANALYZE выполняет запрос повторно: блокировки строк и вызовы функций без FROM
+# (pg_advisory_lock, pg_sleep, ...) могут иметь последствия, которые не откатываются
+_NOT_EXPLAINABLE = re.compile(
+    r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b|^\s*SELECT\s+[\w.]+\s*\((?!.*\bFROM\b)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _row_count(cursor) -> int:
+    """
+    Число строк по DB-API (cursor.rowcount); -1, если драйвер его не сообщил
+    (например, для серверного курсора).
+    """
+    rowcount = getattr(cursor, "rowcount", -1)
+    return rowcount if rowcount is not None else -1
+
+
+def _log_slow_query(engine, statement: str, parameters, executemany: bool, elapsed_ms: float) -> None:
+    origin = query_origin.get()
+    shown = "<executemany>" if executemany else repr(parameters)[:500]
+    bot_logger.warning(
+        f"🐢 Медленный запрос {elapsed_ms:.1f}ms из {origin or '<без репозитория>'}: "
+        f"{' '.join(statement.split())[:500]} | {shown}"
+    )
+
+    # План снимается только для чтений из репозиториев: служебные запросы (миграции, блокировки) не повторяются
+    if (
+        EXPLAIN_SLOW_QUERIES and not executemany and origin is not None
+        and statement.lstrip().upper().startswith("SELECT")
+        and not _NOT_EXPLAINABLE.search(statement)
+        and statement not in _explained and len(_explained) < MAX_STATEMENTS
+    ):
+        _explained.add(statement)
+        try:
+            asyncio.get_running_loop().create_task(_explain(engine, statement, parameters, origin))
+        except RuntimeError:
+            pass
+
+
+async def _explain(engine, statement: str, parameters, origin: str) -> None:
+    """
+    EXPLAIN (ANALYZE, BUFFERS) медленного SELECT на отдельном соединении
+    в транзакции только для чтения, которая затем откатывается.
+    """
+    try:
+        async with engine.connect() as conn:
+            async with conn.begin() as transaction:
+                await conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+                result = await conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", tuple(parameters or ()))
+                rows = result.all()
+                await transaction.rollback()
+        plan = "\n".join(row[0] for row in rows)
+        bot_logger.warning(f"🔎 План медленного запроса из {origin}:\n{plan}")
+    except Exception as e:
+        bot_logger.warning(f"Не удалось получить план медленного запроса из {origin}: {e}")
+
+
+def instrument_engine(engine, track_pool: bool = True) -> None:
+    """
+    Подписывает движок SQLAlchemy на подсчёт запросов текущего апдейта,
+    статистику по выражениям, журнал медленных запросов
+    и, если track_pool, на счётчики пула соединений.
+    """
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._metrics_started) * 1000
+        metrics.record_db_query(elapsed_ms, statement, _row_count(cursor))
+        if elapsed_ms >= SLOW_QUERY_MS:
+            _log_slow_query(engine, statement, parameters, executemany, elapsed_ms)
+
+    if not track_pool:
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        metrics.pool.connects += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.pool.checkout()
+
+    @event.listens_for(sync_engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        metrics.pool.checkin()
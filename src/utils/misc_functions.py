@@ -1,24 +1,25 @@
 import os
+import html
 import asyncio
 import aiofiles.os
 import subprocess
 import json
 import tempfile
-import pandas as pd
-from datetime import datetime, timedelta
-from typing import Union
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from urllib.parse import urlparse
-from openpyxl import Workbook
 
 from aiogram import Bot
 from aiogram.types import FSInputFile, CallbackQuery, Message
 
 from src.data.repositories.user_repository import user_crud
-from src.data.repositories.specialist_repository import specialist_crud
-from src.data.repositories.service_repository import service_crud
-from src.data.repositories.assessmentOfQuality_repository import aoq_crud
-from src.data.repositories.netPromoterScore_repository import nps_crud
+from src.data.repositories.exportWatermark_repository import export_watermark_crud
+from src.data.repositories.ratingRollup_repository import rating_rollup_crud
 from src.data.db import db_url
+from src.data.analytics_cache import analytics_cache
+from src.utils.statistics_export import XLSX, EXPORT_WATERMARK_LAG, export_statistics, statistics_sheets
+from src.data.reference_data import reference_data
+from src.data.specialist_directory import specialist_directory
 from src.data.models import tz_now_naive
 # # Автоматическая очистка ежедневной статистики после 00:00:15
 # async def update_profit_day(bot: Bot):
@@ -72,7 +73,7 @@ async def cleanup_old_backups(folder_path="src/data/backups", keep_latest=7):
             print(f"Ошибка при удалении {file_path}: {e}")
 
 async def backup_db(bot: Bot):
-    admins = await user_crud.get_list(role="admin")
+    admins = await user_crud.list_projection(["tg_id"], role="admin")
     now = tz_now_naive().date()
     filepath = f"src/data/backups/backup_{now}.dump"
 
@@ -110,7 +111,7 @@ async def backup_db(bot: Bot):
     await cleanup_old_backups()
 
 async def send_backup_file(bot: Bot):
-    admins = await user_crud.get_list(role="admin")
+    admins = await user_crud.list_projection(["tg_id"], role="admin")
     path = "src/data/backups"
 
     dump_files = [
@@ -145,7 +146,7 @@ async def send_backup_file(bot: Bot):
 async def spam_message(event: CallbackQuery, message: Message):
     users_receive, users_block, users_count = 0, 0, 0
 
-    users = await user_crud.get_list()
+    users = await user_crud.list_projection(["tg_id"])
 
     for user in users:
         try:
@@ -174,135 +175,127 @@ async def spam_message(event: CallbackQuery, message: Message):
     )
 
 async def send_analytics(bot: Bot, user_tg_id: int):
-    now = tz_now_naive()
-    last_month = now - timedelta(days=30)
-    last_week = now - timedelta(days=7)
-
-    specialists = await specialist_crud.get_list()
-    services = await service_crud.get_list()
-    all_aoqs = await aoq_crud.get_list()
-    all_nps = await nps_crud.get_list()
-
-    # --- АНАЛИТИКА ЗА МЕСЯЦ ---
-    avg_score_by_specialist_month = {}
-    avg_score_by_service_month = {}
-
-    for spec in specialists:
-        scores = [aoq.score for aoq in all_aoqs if aoq.specialist_id == spec.id and aoq.created_at >= last_month]
-        if scores:
-            avg_score_by_specialist_month[spec.fullname] = float(sum(scores)/len(scores))
-
-    for service in services:
-        scores = [aoq.score for aoq in all_aoqs if aoq.service_id == service.id and aoq.created_at >= last_month]
-        if scores:
-            avg_score_by_service_month[service.name] = float(sum(scores)/len(scores))
-
-    total_aoq_month = len([aoq for aoq in all_aoqs if aoq.created_at >= last_month])
-    total_nps_month = len([nps for nps in all_nps if nps.created_at >= last_month])
-
-    top_5_specialists_month = sorted(
-        [{'fullname': k, 'avg_score': v} for k, v in avg_score_by_specialist_month.items()],
-        key=lambda x: x['avg_score'], reverse=True
-    )[:5]
-
-    message_lines_month = [
-        "<b>📊 Аналитика системы за последний месяц:</b>",
-        f"📝 <b>Оценок качества:</b> {total_aoq_month}",
-        f"⭐ <b>NPS:</b> {total_nps_month}\n",
-        "<b>🏆 Топ-5 специалистов по среднему баллу:</b>"
-    ]
-    for i, spec in enumerate(top_5_specialists_month, start=1):
-        message_lines_month.append(f"{i}. <b>{spec['fullname']}</b> — {spec['avg_score']:.2f}")
-
-    if avg_score_by_service_month:
-        message_lines_month.append("\n<b>📌 Средний балл по услугам:</b>")
-        for name, avg in avg_score_by_service_month.items():
-            message_lines_month.append(f"- {name}: {avg:.2f}")
-
-    await bot.send_message(user_tg_id, "\n".join(message_lines_month), parse_mode="HTML")
-
-    # --- АНАЛИТИКА ЗА НЕДЕЛЮ ---
-    avg_score_by_specialist_week = {}
-    avg_score_by_service_week = {}
-
-    for spec in specialists:
-        scores = [aoq.score for aoq in all_aoqs if aoq.specialist_id == spec.id and aoq.created_at >= last_week]
-        if scores:
-            avg_score_by_specialist_week[spec.fullname] = float(sum(scores)/len(scores))
-
-    for service in services:
-        scores = [aoq.score for aoq in all_aoqs if aoq.service_id == service.id and aoq.created_at >= last_week]
-        if scores:
-            avg_score_by_service_week[service.name] = float(sum(scores)/len(scores))
-
-    total_aoq_week = len([aoq for aoq in all_aoqs if aoq.created_at >= last_week])
-    total_nps_week = len([nps for nps in all_nps if nps.created_at >= last_week])
-
-    top_5_specialists_week = sorted(
-        [{'fullname': k, 'avg_score': v} for k, v in avg_score_by_specialist_week.items()],
-        key=lambda x: x['avg_score'], reverse=True
-    )[:5]
-
-    message_lines_week = [
-        "<b>📊 Аналитика системы за последнюю неделю:</b>",
-        f"📝 <b>Оценок качества:</b> {total_aoq_week}",
-        f"⭐ <b>NPS:</b> {total_nps_week}\n",
-        "<b>🏆 Топ-5 специалистов по среднему баллу:</b>"
-    ]
-    for i, spec in enumerate(top_5_specialists_week, start=1):
-        message_lines_week.append(f"{i}. <b>{spec['fullname']}</b> — {spec['avg_score']:.2f}")
+    today = tz_now_naive().date()
+    # Окна в календарных днях включая сегодняшний: 30 и 7 дней
+    windows = (
+        ("за последний месяц", today - timedelta(days=29)),
+        ("за последнюю неделю", today - timedelta(days=6)),
+    )
+    messages = await analytics_cache.get(windows, lambda: render_analytics(windows))
+    for message in messages:
+        await bot.send_message(user_tg_id, message, parse_mode="HTML")
+
+
+async def render_analytics(windows: Sequence[Tuple[str, date]]) -> List[str]:
+    """
+    Тексты аналитики по окнам (заголовок, дата начала окна), по сообщению на окно.
+    """
+    since = [window_start for _, window_start in windows]
+
+    # Оба окна считаются одним запросом по дневной сводке, возвращаются только агрегаты
+    score_windows = await rating_rollup_crud.score_windows(since)
+    service_names = {str(service.id): service.name for service in await reference_data.get_services()}
+
+    messages = []
+    for index, (title, _) in enumerate(windows):
+        total_aoq = total_nps = 0
+        avg_score_by_specialist = []
+        avg_score_by_service = {}
+        for group, key, stats in score_windows:
+            count, avg, nps = stats[index]
+            if group == "total":
+                total_aoq, total_nps = count, nps
+            elif not count:
+                continue
+            elif group == "specialist":
+                specialist = await specialist_directory.get(key)
+                if specialist:
+                    avg_score_by_specialist.append((specialist.fullname, avg))
+            elif key in service_names:
+                avg_score_by_service[key] = avg
+
+        top_5_specialists = sorted(avg_score_by_specialist, key=lambda item: item[1], reverse=True)[:5]
+
+        message_lines = [
+            f"<b>📊 Аналитика системы {title}:</b>",
+            f"📝 <b>Оценок качества:</b> {total_aoq}",
+            f"⭐ <b>NPS:</b> {total_nps}\n",
+            "<b>🏆 Топ-5 специалистов по среднему баллу:</b>"
+        ]
+        for i, (fullname, avg) in enumerate(top_5_specialists, start=1):
+            message_lines.append(f"{i}. <b>{fullname}</b> — {avg:.2f}")
+
+        if avg_score_by_service:
+            message_lines.append("\n<b>📌 Средний балл по услугам:</b>")
+            for service_id, name in service_names.items():
+                if service_id in avg_score_by_service:
+                    message_lines.append(f"- {name}: {avg_score_by_service[service_id]:.2f}")
+
+        messages.append("\n".join(message_lines))
+    return messages
+
+async def send_full_statistics(bot: Bot, user_tg_id: int = None, export_format: str = XLSX, delta: bool = False):
+    """
+    Статистика AOQ и NPS пользователю user_tg_id или всем администраторам.
+    delta=True — только строки, созданные или изменённые после прошлой успешной
+    выгрузки этому получателю; без прошлой выгрузки отправляется вся статистика.
+    После отправки дельта-выгрузки водяной знак получателя сдвигается на её границу.
+    """
+    export_date = tz_now_naive().date()
+    # Строки ещё не завершённых транзакций попадут в следующую выгрузку
+    until = await export_watermark_crud.horizon(EXPORT_WATERMARK_LAG) if delta else None
+    if user_tg_id:
+        recipients = [user_tg_id]
+    else:
+        recipients = [admin.tg_id for admin in await user_crud.list_projection(["tg_id"], role="admin")]
+
+    # Получатели с одинаковым водяным знаком получают одну выгрузку
+    watermarks = await export_watermark_crud.get_many(recipients) if delta else {}
+    groups: Dict[Optional[datetime], List[int]] = {}
+    for tg_id in recipients:
+        groups.setdefault(watermarks.get(tg_id), []).append(tg_id)
+
+    for since, tg_ids in groups.items():
+        if since is None:
+            sheets = statistics_sheets(replica=not delta)
+            name = f"full_statistics-{export_date}"
+            caption = "📊 Полная статистика AOQ и NPS"
+        else:
+            sheets = statistics_sheets(since, until, replica=False)
+            name = f"statistics-{since.date()}-{export_date}"
+            caption = f"📊 Статистика AOQ и NPS: новое и изменённое с {since:%d.%m.%Y %H:%M}"
 
-    if avg_score_by_service_week:
-        message_lines_week.append("\n<b>📌 Средний балл по услугам:</b>")
-        for name, avg in avg_score_by_service_week.items():
-            message_lines_week.append(f"- {name}: {avg:.2f}")
+        # Файлы создаются во временной папке: строки идут из БД потоком, файлы пишутся в отдельном потоке
+        with tempfile.TemporaryDirectory() as directory:
+            paths, rows = await export_statistics(directory, name, export_format, sheets)
 
-    await bot.send_message(user_tg_id, "\n".join(message_lines_week), parse_mode="HTML")
-    
-async def send_full_statistics_excel(bot: Bot, user_tg_id: int = None):
-    # Получаем все AOQ и NPS с предзагрузкой связей
-    aoqs = await aoq_crud.get_list_with_relations()
-    nps_list = await nps_crud.get_list_with_relations()
-
-    # Формируем данные для Excel
-    aoq_data = []
-    for aoq in aoqs:
-        aoq_data.append({
-            "AOQ ID": aoq.id,
-            "Специалист": aoq.specialist.fullname if aoq.specialist else None,
-            "Услуга": aoq.service.name if aoq.service else None,
-            "Пользователь": aoq.user.full_name if aoq.user else aoq.user.username if aoq.user else None,
-            "Социальная категория": aoq.user.socialsubcategory.name if aoq.user and aoq.user.socialsubcategory and aoq.user else None,
-            "Score": aoq.score,
-            "Комментарий": aoq.comment,
-            "Дата": aoq.created_at,
-        })
-
-    nps_data = []
-    for nps in nps_list:
-        nps_data.append({
-            "AOQ NAME": nps.aoq.id if nps.aoq else None,
-            "Специалист": nps.aoq.specialist.fullname if nps.aoq and nps.aoq.specialist else None,
-            "Пользователь": nps.user.full_name if nps.user else nps.user.username if nps.user else None,
-            "Score": nps.score,
-            "Дата": nps.created_at,
-        })
-    date = tz_now_naive().date()
-    # Создаем Excel в временном файле
-    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
-        with pd.ExcelWriter(tmp.name, engine="openpyxl") as writer:
-            pd.DataFrame(aoq_data).to_excel(writer, sheet_name="AOQ", index=False)
-            pd.DataFrame(nps_data).to_excel(writer, sheet_name="NPS", index=False)
-
-        # Передаем в Telegram как InputFile
-        file = FSInputFile(tmp.name, filename=f"full_statistics-{date}.xlsx")
-        if user_tg_id:
-            await bot.send_document(user_tg_id, file, caption="📊 Полная статистика AOQ и NPS")
-        else:
-            admins = await user_crud.get_list(role="admin")
-            for admin in admins:
+            # Передаем в Telegram как InputFile
+            for tg_id in tg_ids:
                 try:
-                    await bot.send_document(admin.tg_id, file, caption="📊 Полная статистика AOQ и NPS")
+                    if rows or since is None:
+                        for path in paths:
+                            await bot.send_document(tg_id, FSInputFile(path), caption=caption)
+                    else:
+                        await bot.send_message(tg_id, f"📊 Новых и изменённых оценок с {since:%d.%m.%Y %H:%M} нет")
                 except Exception as e:
-                    print(f"❌ Ошибка при отправке статистики администратору {admin.tg_id}: {e}")
-    os.remove(tmp.name)
\ No newline at end of file
+                    if user_tg_id:
+                        raise
+                    print(f"❌ Ошибка при отправке статистики администратору {tg_id}: {e}")
+                    continue
+                if delta:
+                    await export_watermark_crud.advance(tg_id, until)
+
+
+async def send_requested_statistics(bot: Bot, user_tg_id: int, export_format: str, delta: bool):
+    """
+    Выгрузка статистики по кнопке (в фоновой задаче): ошибка сообщается в чат запросившего.
+    """
+    try:
+        await send_full_statistics(bot, user_tg_id, export_format, delta=delta)
+    except Exception as e:
+        print(f'Ошибка выгрузки статистики: {e}')
+        await bot.send_message(
+            chat_id=user_tg_id,
+            text=f"❌ <b>Ошибка при выгрузке статистики:</b>\n\n<code>{html.escape(str(e))}</code>",
+            parse_mode="HTML",
+        )
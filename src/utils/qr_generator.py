@@ -5,6 +5,8 @@ from aiogram import Bot
 from aiogram.types import BufferedInputFile, Message
 
 from src.data.repositories.specialist_repository import specialist_crud
+from src.data.specialist_directory import specialist_directory
+from src.utils.misc.metrics import metrics
 
 
 async def generate_and_upload_qr(bot: Bot, specialist_id: str, link: str, admin_chat_id: int) -> Optional[str]:
@@ -71,12 +73,18 @@ async def generate_and_upload_qr(bot: Bot, specialist_id: str, link: str, admin_
 async def generate_qr_for_specialists(bot: Bot, specialist_ids: list[str], admin_chat_id: int):
     """
     Фоновая генерация QR-кодов для списка специалистов с отображением прогресса.
+    Запросы задачи учитываются в метриках отдельно от запустившего её апдейта.
     
     Args:
         bot: Экземпляр бота
         specialist_ids: Список ID специалистов
         admin_chat_id: ID чата администратора
     """
+    async with metrics.background("generate_qr_for_specialists"):
+        await _generate_qr_for_specialists(bot, specialist_ids, admin_chat_id)
+
+
+async def _generate_qr_for_specialists(bot: Bot, specialist_ids: list[str], admin_chat_id: int):
     if not specialist_ids:
         return
     
@@ -94,8 +102,11 @@ async def generate_qr_for_specialists(bot: Bot, specialist_ids: list[str], admin
         parse_mode="HTML"
     )
     
-    for idx, spec_id in enumerate(specialist_ids, 1):
-        specialist = await specialist_crud.get(id=spec_id)
+    # Все специалисты читаются из справочника до генерации: запись QR-кода
+    # помечает строку изменённой, и чтение внутри цикла шло бы в БД на каждой итерации
+    specialists = [await specialist_directory.get(spec_id) for spec_id in specialist_ids]
+    
+    for idx, (spec_id, specialist) in enumerate(zip(specialist_ids, specialists), 1):
         if specialist and specialist.link and not specialist.qr:
             result = await generate_and_upload_qr(bot, spec_id, specialist.link, admin_chat_id)
             if result:
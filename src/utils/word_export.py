@@ -9,6 +9,10 @@ from aiogram.types import FSInputFile
 from src.data.repositories.specialist_repository import specialist_crud
 
 
+# Колонки специалиста, которые попадают в документ
+WORD_COLUMNS = ["id", "fullname", "position", "organization", "department", "link", "qr"]
+
+
 async def download_qr_image(bot: Bot, file_id: str) -> bytes:
     """
     Скачивает QR-код по file_id из Telegram.
@@ -40,10 +44,10 @@ async def generate_specialists_word(bot: Bot, organization: str = None) -> str:
     """
     # Получаем список специалистов
     if organization:
-        specialists = await specialist_crud.get_list(organization=organization)
+        specialists = await specialist_crud.list_projection(WORD_COLUMNS, organization=organization)
         filename = f"specialists_{organization.replace(' ', '_')}.docx"
     else:
-        specialists = await specialist_crud.get_list()
+        specialists = await specialist_crud.list_projection(WORD_COLUMNS)
         filename = "specialists_all.docx"
     
     # Создаем документ